@@ -0,0 +1,178 @@
+'''
+access log
+
+Structured, batched http access log.
+
+aiohttp calls QueueAccessLogger.log() after each response has been sent. The record
+(method, path, status, bytes, latency, session id) is pushed onto a bounded queue and
+a background task writes records in batches as json lines, either to the
+agi_green.access logger or appended to ACCESS_LOG_FILE. Nothing on the request path
+does blocking I/O; if the writer falls behind, records are dropped and counted. On
+shutdown (the aiohttp app's cleanup) the writer writes what is queued and stops.
+
+Environment:
+- ACCESS_LOG: set to 0 to disable
+- ACCESS_LOG_FILE: append json lines to this file instead of logging (without it, records are
+  only built when the agi_green.access logger is enabled for INFO)
+- ACCESS_LOG_SAMPLE: fraction of requests to record (default 1.0)
+- ACCESS_LOG_BATCH: max records per write (default 100)
+- ACCESS_LOG_FLUSH_INTERVAL: max seconds a record waits before being written (default 1.0)
+'''
+
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+from typing import Any, Dict, List, Tuple
+
+import aiofiles
+from aiohttp.abc import AbstractAccessLogger
+
+logger = logging.getLogger('agi_green.access')
+
+ACCESS_LOG = os.getenv('ACCESS_LOG', '1').lower() not in ('0', 'false', 'no', 'off')
+ACCESS_LOG_FILE = os.getenv('ACCESS_LOG_FILE') or None
+ACCESS_LOG_SAMPLE = float(os.getenv('ACCESS_LOG_SAMPLE', 1.0))
+ACCESS_LOG_BATCH = int(os.getenv('ACCESS_LOG_BATCH', 100))
+ACCESS_LOG_FLUSH_INTERVAL = float(os.getenv('ACCESS_LOG_FLUSH_INTERVAL', 1.0))
+ACCESS_LOG_QUEUE_SIZE = int(os.getenv('ACCESS_LOG_QUEUE_SIZE', 10000))
+
+_STOP = object() # queued by close(): the writer finishes its batch and exits
+
+
+class AccessLog:
+    'bounded queue of access records with a background batch writer'
+
+    def __init__(self, file_path:str=ACCESS_LOG_FILE, sample:float=ACCESS_LOG_SAMPLE, batch:int=ACCESS_LOG_BATCH,
+                 flush_interval:float=ACCESS_LOG_FLUSH_INTERVAL, maxsize:int=ACCESS_LOG_QUEUE_SIZE):
+        self.file_path = file_path
+        self.sample = sample
+        self.batch = batch
+        self.flush_interval = flush_interval
+        self.maxsize = maxsize
+        self.dropped = 0
+        self.written = 0
+        self._queue: asyncio.Queue = None
+        self._task: asyncio.Task = None
+
+    def record(self, **record:Any):
+        'queue a record for writing (never blocks; drops when the queue is full)'
+        if self.sample < 1.0 and random.random() >= self.sample:
+            return
+
+        if self._task is None or self._task.done():
+            self._queue = self._queue or asyncio.Queue(self.maxsize)
+            self._task = asyncio.get_running_loop().create_task(self._writer())
+
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def _next_batch(self) -> Tuple[List[Dict[str, Any]], bool]:
+        '''wait for a record, then collect more until the batch is full or flush_interval passes
+
+        returns (records, stop): stop is True once close() asked the writer to exit
+        '''
+        record = await self._queue.get()
+        if record is _STOP:
+            return [], True
+        records = [record]
+        deadline = time.monotonic() + self.flush_interval
+
+        while len(records) < self.batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                record = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if record is _STOP:
+                return records, True
+            records.append(record)
+
+        return records, False
+
+    async def write(self, records:List[Dict[str, Any]]):
+        lines = [json.dumps(r, default=str) for r in records]
+
+        if self.file_path:
+            async with aiofiles.open(self.file_path, 'a') as f:
+                await f.write('\n'.join(lines) + '\n')
+        else:
+            logger.info('\n'.join(lines))
+
+        self.written += len(records)
+
+    async def _writer(self):
+        while True:
+            records, stop = await self._next_batch()
+            if records:
+                try:
+                    await self.write(records)
+                except Exception as e:
+                    self.dropped += len(records)
+                    logging.getLogger(__name__).error(f'access log write failed: {e}')
+            if stop:
+                return
+
+    async def flush(self):
+        'write everything queued so far (for shutdown and tests)'
+        if self._queue is None:
+            return
+        records = []
+        while not self._queue.empty():
+            records.append(self._queue.get_nowait())
+        records = [r for r in records if r is not _STOP]
+        if records:
+            await self.write(records)
+
+    async def close(self):
+        'write what is queued and stop the writer task'
+        task, self._task = self._task, None
+        if task is not None and not task.done():
+            await self._queue.put(_STOP) # after the queued records, so they are written first
+            await task
+        await self.flush()
+        self._queue = None # a new writer (and queue) starts with the next record
+
+
+access_log = AccessLog()
+
+
+async def close_access_log(app):
+    'aiohttp on_cleanup handler: write what is queued and stop the writer'
+    await access_log.close()
+
+
+class QueueAccessLogger(AbstractAccessLogger):
+    'aiohttp access logger that feeds the process-wide AccessLog'
+
+    def log(self, request, response, time:float):
+        access_log.record(
+            ts=round(_now() - time, 3),
+            method=request.method,
+            path=request.path,
+            status=response.status,
+            bytes=response.content_length if response.content_length is not None else response.body_length,
+            latency_ms=round(time * 1000, 2),
+            session_id=request.cookies.get('SESSION_ID') or _new_session_id(response),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        # without a file, records go to the agi_green.access logger: skip them unless it shows INFO
+        return ACCESS_LOG and (access_log.file_path is not None or logger.isEnabledFor(logging.INFO))
+
+
+def _now() -> float:
+    return time.time()
+
+
+def _new_session_id(response) -> str|None:
+    'session id handed out in this response, if any'
+    cookie = response.cookies.get('SESSION_ID')
+    return cookie.value if cookie is not None else None
@@ -5,6 +5,7 @@ import argparse
 import random
 import logging
 import asyncio
+from typing import Dict
 from aiohttp import web
 
 from agi_green.dispatcher import Dispatcher, protocol_handler
@@ -15,7 +16,8 @@ from agi_green.protocol_http import HTTPServerProtocol, HTTPSessionProtocol
 here = dirname(__file__)
 logger = logging.getLogger(__name__)
 
-from agi_green.protocol_mq import MQProtocol
+from agi_green.protocol_mq import select_mq_protocol, mq_protocol_class
+from agi_green.mq_history import history_enabled, MQ_HISTORY_REPLAY, SEQ_KEY
 
 
 def get_uid(digits=12):
@@ -50,6 +52,11 @@ class ChatServer(Dispatcher):
 
         self.nodes = {}
 
+    async def run(self):
+        # choose the MQ backend before any session is created (probes brokers, or uses the cached choice)
+        await select_mq_protocol()
+        await super().run()
+
 class ChatSession(Dispatcher):
     '''
     Manages the connection to RabbitMQ and WebSocket connection to browser.
@@ -73,8 +80,9 @@ class ChatSession(Dispatcher):
 
         self.http = HTTPSessionProtocol(self)
         self.ws = WebSocketProtocol(self)
-        self.mq = MQProtocol(self, host=rabbitmq_host)
+        self.mq = mq_protocol_class()(self, host=rabbitmq_host)
         self.cmd = CommandProtocol(self)
+        self.painting: Dict[str, list] = {} # socket id => live chat held back while history is painted into it
 
         logger.info(f'{type(self).__name__} {self.context.user.screen_name} created: rabbitmq={rabbitmq_host}')
 
@@ -89,11 +97,37 @@ class ChatSession(Dispatcher):
         'post connection node setup'
         logger.info(f'{self} connected')
         socket_channel = self.get_socket_channel(socket.id)
-        await self.mq.subscribe('broadcast')
-        await self.mq.subscribe(socket_channel)  # Subscribe to socket-specific channel
         user_channel = f'user.{self.context.user.screen_name}'
-        await self.mq.subscribe(user_channel)
-        await self.mq.subscribe('session.'+self.context.session_id)
+
+        # until the history is painted, chat for this socket is held back (see on_mq_chat): a message
+        # that arrives meanwhile may or may not be in the history read below
+        held = self.painting[socket.id] = []
+        try:
+            await self.mq.subscribe('broadcast')
+            await self.mq.subscribe(socket_channel)  # Subscribe to socket-specific channel
+            await self.mq.subscribe(user_channel)
+            await self.mq.subscribe('session.'+self.context.session_id)
+
+            # paint recent messages into the new socket (new tab or reconnect) from the MQ history;
+            # display only: the chat handlers (e.g. a bot's on_mq_chat) already ran when they arrived
+            painted: Dict[str, int] = {} # channel => last sequence number painted
+            for channel in ('broadcast', user_channel):
+                if history_enabled(channel):
+                    for message in await self.mq.history(channel, last=MQ_HISTORY_REPLAY):
+                        painted[channel] = message[SEQ_KEY]
+                        if message.get('cmd') == 'chat':
+                            await self.send('ws', 'append_chat',
+                                author=message.get('author'),
+                                content=message.get('content'),
+                                socket_id=socket.id)
+
+            # then what arrived live and wasn't painted (no await between the last check and the del)
+            while held:
+                channel, seq, message = held.pop(0)
+                if seq is None or seq > painted.get(channel, 0):
+                    await self.send('ws', 'append_chat', socket_id=socket.id, **message)
+        finally:
+            del self.painting[socket.id]
 
         self.context.chat.active_channel = socket_channel  # Use socket-specific channel as active
 
@@ -132,6 +166,22 @@ class ChatSession(Dispatcher):
         'receive chat message from RabbitMQ'
         # Extract socket ID from channel for routing purposes
         socket_id = self.get_socket_id_from_channel(channel_id)
+
+        if self.painting and (socket_id is None or socket_id in self.painting):
+            # sockets still being painted get it after their history, unless it was painted
+            # (history_seq holds the sequence number of the message being delivered)
+            seq = self.mq.history_seq.get(channel_id) if history_enabled(channel_id) else None
+            message = {'author': author, 'content': content}
+            for painting_id, held in self.painting.items():
+                if socket_id in (None, painting_id):
+                    held.append((channel_id, seq, message))
+            if socket_id is not None:
+                return
+            for socket in list(self.ws.sockets):
+                if getattr(socket, 'id', None) not in self.painting:
+                    await self.send('ws', 'append_chat', socket_id=socket.id, **message)
+            return
+
         await self.send('ws', 'append_chat',
                     author=author,
                     content=content,
@@ -153,6 +203,8 @@ def main():
     parser.add_argument("-D", "--docker", action="store_true", help="run in docker mode")
     parser.add_argument("-g", "--gpt", action="store_true", help="enable gpt4 chat")
     parser.add_argument("--http", action="store_true", help="use http (default is https)")
+    parser.add_argument("-w", "--workers", default=1, type=int,
+                        help="number of worker processes (session affinity is kept per SESSION_ID)")
     args = parser.parse_args()
 
     if args.port %2 != 0:
@@ -182,6 +234,12 @@ def main():
 
         ssl_context = create_ssl_context(cert_file, key_file)
 
+    if args.workers > 1:
+        from agi_green.prefork import run_prefork
+        factory = lambda: ChatServer(root=dirname(abspath(__file__)), host=args.host, port=args.port, session_class=node_class, ssl_context=ssl_context)
+        run_prefork(factory, host=args.host, port=args.port, workers=args.workers, ssl_context=ssl_context)
+        return 0
+
     dispatcher = ChatServer(root=dirname(abspath(__file__)), port=args.port, node_class=node_class)
     dispatcher.run()
     return 0
@@ -2,11 +2,16 @@ from typing import Any, Callable
 import hashlib
 import asyncio
 import weakref
+import itertools
+import copy
 import os
 
 def hash_mutable(obj):
     return hashlib.sha256(str(obj).encode('utf-8')).hexdigest()
 
+# process-wide, so a version never repeats: a namespace replaced by another can't look unchanged
+_versions = itertools.count(1)
+
 class DictNamespace(dict):
     '''An optionally asychronous reactive javascript style dict for attribute access to keys
     Attributes starting with _ are stored as actual attributes, not in the dict (unless written as dict keys) so they can be used for internal state
@@ -28,9 +33,18 @@ class DictNamespace(dict):
     You can make variable depth simply by assigning a DictNamespace()
 
     You can attach change handlers to the object with _bind_change_handler(handler).
+
+    Changes are tracked at mutation time: every write (item or attribute assignment, deletion,
+    update, _deep_update, ...) bumps _version, and so does every write to a nested DictNamespace,
+    which propagates the new version to its parents. _changed() is then a comparison of versions.
+    In-place changes to other mutable values (e.g. obj.items.append(x)) are not seen; reassign
+    the value or call _touch().
     '''
     def __init__(self, _depth=0, _default: Any=None, **kwargs):
-        super().__init__(**kwargs)
+        super().__init__()
+        self._version = next(_versions)
+        self._parents = {} # id => weakref of the DictNamespaces holding this one
+        self._seen_versions = {}
 
         if _depth > 0:
             self._default = lambda: DictNamespace(_depth=_depth-1, _default=_default)
@@ -40,8 +54,6 @@ class DictNamespace(dict):
             else:
                 self._default = lambda: _default
 
-        self._dirty_hashes = {}
-
         if kwargs:
             self._deep_update(kwargs)
 
@@ -64,12 +76,105 @@ class DictNamespace(dict):
 
     def _changed(self, key:str):
         'return True if the object has been changed since the last time this was called with this key'
-        h = hash_mutable(self)
-        if h != self._dirty_hashes.get(key):
-            self._dirty_hashes[key] = h
+        if self._version != self._seen_versions.get(key):
+            self._seen_versions[key] = self._version
             return True
         return False
 
+    def _touch(self, version:int=None):
+        'mark the object (and the DictNamespaces containing it) as changed'
+        if version is None:
+            version = next(_versions)
+        elif self._version == version:
+            return # already marked (shared or cyclic nesting)
+        self._version = version
+        for ref in list(self._parents.values()):
+            parent = ref()
+            if parent is not None:
+                parent._touch(version)
+
+    def _adopt(self, value):
+        if isinstance(value, DictNamespace):
+            value._parents[id(self)] = weakref.ref(self)
+
+    def _release(self, value):
+        if isinstance(value, DictNamespace) and not any(v is value for v in self.values()):
+            value._parents.pop(id(self), None)
+
+    def __setitem__(self, key, value):
+        old = self.get(key)
+        super().__setitem__(key, value)
+        if old is not value:
+            self._release(old)
+            self._adopt(value)
+        self._touch()
+
+    def __delitem__(self, key):
+        old = super().pop(key)
+        self._release(old)
+        self._touch()
+
+    def pop(self, key, *default):
+        had = key in self
+        value = super().pop(key, *default)
+        if had:
+            self._release(value)
+            self._touch()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._release(item[1])
+        self._touch()
+        return item
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+    def clear(self):
+        values = list(self.values())
+        super().clear()
+        for value in values:
+            self._release(value)
+        self._touch()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    # internal state of one object: a copy starts with its own (the parents are rebuilt by _adopt)
+    _own_state = ('_version', '_parents', '_seen_versions', '_dead')
+
+    def _empty_copy(self, copy_value:Callable):
+        new = type(self).__new__(type(self))
+        dict.__init__(new)
+        new._version = next(_versions)
+        new._parents = {}
+        new._seen_versions = {}
+        for name, value in self.__dict__.items():
+            if name not in self._own_state:
+                setattr(new, name, copy_value(value))
+        return new
+
+    def __copy__(self):
+        new = self._empty_copy(lambda value: value)
+        for k, v in self.items():
+            new[k] = v
+        return new
+
+    def __deepcopy__(self, memo):
+        new = self._empty_copy(lambda value: copy.deepcopy(value, memo))
+        memo[id(self)] = new
+        for k, v in self.items():
+            new[copy.deepcopy(k, memo)] = copy.deepcopy(v, memo)
+        return new
+
     def _ensure_finalization(self):
         'ensure that the object is _dead when it is garbage collected'
         if not hasattr(self, '_dead'):
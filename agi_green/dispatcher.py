@@ -105,10 +105,18 @@ class IgnoreException(Exception):
 
 _protocol_garbage_tracker = None
 
-def protocol_handler(_func=None, *, priority=2, update=False):
+def protocol_handler(_func=None, *, priority=2, update=False, paths=None):
+    '''decorator for on_<protocol>_<cmd> handlers
+
+    priority: handlers are called in ascending priority order
+    update: handler returns a dict that updates kwargs for subsequent handlers
+    paths: (http request/response handlers only) url paths the handler cares about.
+        A path ending in '*' is a prefix. Handlers without paths see every non-asset request.
+    '''
     def decorator(func):
         setattr(func, 'priority', priority)
         setattr(func, 'update', update)
+        setattr(func, 'paths', tuple(paths) if paths else None)
         setattr(func, 'is_protocol_handler', True)
         return add_kwargs(func)
 
@@ -145,6 +153,7 @@ class Protocol:
         return self.dispatcher.is_server
 
     def __init__(self, parent: 'Protocol' = None):
+        self.parent: 'Protocol' = None
         parent.add_protocol(self) if parent else None
         self.children: List['Protocol'] = []
         self.exception = Exception
@@ -315,6 +324,14 @@ class Protocol:
         # call registered handler
         cmd_handlers = self.dispatcher.registered_methods[self.protocol_id][cmd]
 
+        if not cmd_handlers:
+            logger.warn(f"no handler for {self.protocol_id}:{cmd}")
+            return None
+
+        return await self.call_handlers(cmd_handlers, **kwargs)
+
+    async def call_handlers(self, cmd_handlers:List[Callable], **kwargs):
+        'call handlers in order, return last non-None response (see handle_mesg)'
         response = None
         if cmd_handlers:
             for handler in cmd_handlers:
@@ -331,13 +348,11 @@ class Protocol:
                     if r is not None:
                         response = r
 
-                    if response and response.pop('__break__', False):
+                    if isinstance(response, dict) and response.pop('__break__', False):
                         break
 
                 except self.exception as e:
                     logger.error(e, exc_info=True)
-        else:
-            logger.warn(f"no handler for {self.protocol_id}:{cmd}")
 
         return response
 
@@ -350,6 +365,15 @@ class Protocol:
         'default: send request to self - override to implement a protocol specific send'
         return await self.handle_mesg(cmd, **kwargs)
 
+    async def request(self, protocol_id, cmd:str, timeout:float=None, **kwargs):
+        'send message via specified protocol and wait for the reply'
+        logger.info(f'requesting: {protocol_id}:{format_call(cmd, kwargs)}')
+        return await self.dispatcher.get_protocol(protocol_id).do_request(cmd, timeout=timeout, **kwargs)
+
+    async def do_request(self, cmd: str, timeout:float=None, **kwargs):
+        'default: handle the request locally and return the response - override to implement a protocol specific request'
+        return await asyncio.wait_for(self.handle_mesg(cmd, **kwargs), timeout)
+
 
 class Dispatcher(Protocol):
     @property
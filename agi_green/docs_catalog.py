@@ -0,0 +1,120 @@
+'''
+docs catalog
+
+Process-wide index of the markdown documents served under /docs.
+
+Each document's first header is parsed once and cached with the file's mtime,
+so a rescan only re-reads files that actually changed. The rendered index is
+kept in memory and is never written back into the package tree.
+'''
+
+import os
+import re
+import glob
+import time
+import logging
+from os.path import basename, join
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+re_header = re.compile(r'^#+\s+(.*)', re.MULTILINE)
+
+INDEX_NAME = 'index.md'
+
+
+def read_header(file_path:str) -> str|None:
+    'return the text of the first markdown header in file_path, or None'
+    try:
+        with open(file_path, 'r') as f:
+            m = re_header.search(f.read())
+    except OSError as e:
+        logger.warning(f'Could not read doc {file_path}: {e}')
+        return None
+    return m.group(1) if m else None
+
+
+class DocsCatalog:
+    '''
+    Incrementally maintained catalog of docs/*.md across a list of static directories.
+
+    scan_interval: minimum seconds between directory rescans (0 rescans on every call)
+    '''
+
+    def __init__(self, pattern:str='docs/*.md', scan_interval:float=1.0):
+        self.pattern = pattern
+        self.scan_interval = scan_interval
+        self._headers: Dict[str, Tuple[float, str|None]] = {} # path => (mtime, header)
+        self._indexes: Dict[Tuple[str, ...], Tuple[float, Tuple, str]] = {} # dirs => (scan time, signature, text)
+
+    def _scan(self, static_dirs:Tuple[str, ...]) -> List[str]:
+        'glob the doc files in static_dirs, refreshing headers of new or modified files'
+        files = []
+        for static_dir in static_dirs:
+            for file_path in glob.glob(join(static_dir, self.pattern)):
+                if basename(file_path) == INDEX_NAME:
+                    continue # legacy generated index
+
+                try:
+                    mtime = os.path.getmtime(file_path)
+                except OSError:
+                    continue
+
+                cached = self._headers.get(file_path)
+                if cached is None or cached[0] != mtime:
+                    self._headers[file_path] = (mtime, read_header(file_path))
+                    logger.debug(f'docs catalog: parsed {file_path}')
+
+                files.append(file_path)
+        return files
+
+    def _render(self, files:List[str]) -> str:
+        lines = [
+            f'<!-- This index is generated by {__name__} -->\n\n',
+            '| File | Description |\n',
+            '| ---- | ----------- |\n',
+        ]
+        for file_path in sorted(files):
+            header = self._headers[file_path][1]
+            if header:
+                base = basename(file_path).replace('.md', '')
+                lines.append(f'| [**{base}**](/docs/{base}) | *{header}* |\n')
+        return ''.join(lines)
+
+    def index(self, static_dirs:List[str]) -> str:
+        'return the rendered markdown index for static_dirs'
+        key = tuple(static_dirs)
+        now = time.monotonic()
+        cached = self._indexes.get(key)
+
+        if cached is not None and now - cached[0] < self.scan_interval:
+            return cached[2]
+
+        files = self._scan(key)
+        signature = tuple((f, self._headers[f]) for f in sorted(files))
+
+        if cached is not None and cached[1] == signature:
+            text = cached[2]
+        else:
+            text = self._render(files)
+
+        self._indexes[key] = (now, signature, text)
+
+        # forget files that have disappeared from every catalog
+        live = {f for _, sig, _ in self._indexes.values() for f, _ in sig}
+        for file_path in list(self._headers):
+            if file_path not in live:
+                del self._headers[file_path]
+
+        return text
+
+    def invalidate(self, file_path:str=None):
+        'drop cached state for file_path (or everything) so the next index() call rescans'
+        if file_path is None:
+            self._headers.clear()
+        else:
+            self._headers.pop(file_path, None)
+        self._indexes.clear()
+
+
+docs_catalog = DocsCatalog()
@@ -0,0 +1,82 @@
+'''
+markdown cache
+
+Process-wide LRU cache of markdown documents for the open_md render path.
+
+Entries are validated against the file's mtime and size on every lookup, so an
+edited document is re-read on the next request. Reads are asynchronous (aiofiles)
+so a cache miss never blocks the event loop. Total cached content is bounded by
+max_bytes; documents larger than the budget are read but not cached.
+'''
+
+import os
+import logging
+from collections import OrderedDict
+from typing import Tuple
+
+import aiofiles
+
+logger = logging.getLogger(__name__)
+
+MD_CACHE_MAX_BYTES = int(os.getenv('MD_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+MD_INLINE_MAX_BYTES = int(os.getenv('MD_INLINE_MAX_BYTES', 256 * 1024))
+
+
+class MarkdownCache:
+    '''
+    mtime/size validated LRU cache of file contents
+
+    max_bytes: memory budget for cached content (file sizes)
+    '''
+
+    def __init__(self, max_bytes:int=MD_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, Tuple[Tuple[int, int], str]] = OrderedDict() # path => ((mtime_ns, size), content)
+
+    @staticmethod
+    def stamp(file_path:str) -> Tuple[int, int]:
+        'return the (mtime_ns, size) validator for file_path (raises OSError if missing)'
+        st = os.stat(file_path)
+        return st.st_mtime_ns, st.st_size
+
+    def _evict(self, file_path:str):
+        entry = self._entries.pop(file_path, None)
+        if entry is not None:
+            self.total_bytes -= entry[0][1]
+
+    async def get(self, file_path:str) -> str:
+        'return the content of file_path, from cache if still valid'
+        stamp = self.stamp(file_path)
+        entry = self._entries.get(file_path)
+
+        if entry is not None and entry[0] == stamp:
+            self._entries.move_to_end(file_path)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        self._evict(file_path)
+
+        async with aiofiles.open(file_path, 'r') as f:
+            content = await f.read()
+
+        size = stamp[1]
+        if size <= self.max_bytes:
+            self._entries[file_path] = (stamp, content)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                logger.debug(f'md cache: evicting {oldest}')
+                self._evict(oldest)
+
+        return content
+
+    def clear(self):
+        self._entries.clear()
+        self.total_bytes = 0
+
+
+md_cache = MarkdownCache()
@@ -0,0 +1,196 @@
+'''
+mq blobs
+
+Claim check for large MQ payloads.
+
+When an encoded message is larger than MQ_CLAIM_CHECK_BYTES, the payload is written to
+a content-addressed blob store and the broker only carries a small reference:
+
+    {"cmd": "chat", "_claim": "<sha256>", "_size": 123456}
+
+Receivers resolve the reference when the message is delivered, through an LRU cache, so a
+payload fanned out to many local sessions is read once.
+
+The claim check is off unless MQ_CLAIM_CHECK_BYTES is set, because every receiver must be
+able to read the store. The default store is a private (0700) directory on the local
+filesystem (MQ_BLOB_DIR), which only covers the processes of one user on one host (e.g. the
+unix socket backend, or prefork workers); with several hosts, point MQ_BLOB_DIR at shared
+storage or set claim_check.store to a BlobStore on shared storage before enabling it.
+'''
+
+import os
+import abc
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import tempfile
+from os.path import join, exists
+from collections import OrderedDict
+from typing import Any, Dict
+
+import aiofiles
+
+from agi_green.utils import private_dir, user_tmp_path
+
+logger = logging.getLogger(__name__)
+
+MQ_CLAIM_CHECK_BYTES = int(os.getenv('MQ_CLAIM_CHECK_BYTES', 0)) # larger payloads go to the blob store (0 = off)
+MQ_BLOB_DIR = os.getenv('MQ_BLOB_DIR') or user_tmp_path('agi_green_blobs')
+MQ_BLOB_CACHE_BYTES = int(os.getenv('MQ_BLOB_CACHE_BYTES', 16 * 1024 * 1024))
+MQ_BLOB_TTL = float(os.getenv('MQ_BLOB_TTL', 3600)) # seconds a blob is kept for receivers to claim
+
+CLAIM_KEY = '_claim'
+
+
+class BlobStore(abc.ABC):
+    'content-addressed byte store'
+
+    @abc.abstractmethod
+    async def put(self, key:str, data:bytes):
+        'store data under key (its sha256); storing an existing key is a no-op'
+
+    @abc.abstractmethod
+    async def get(self, key:str) -> bytes:
+        'raise KeyError if key is not stored'
+
+    async def sweep(self, max_age:float):
+        'delete blobs older than max_age seconds (optional)'
+
+
+class FileBlobStore(BlobStore):
+    'blobs as files under root/<first 2 hex digits>/<sha256>, readable only by this user'
+
+    def __init__(self, root:str=MQ_BLOB_DIR):
+        self.root = root
+
+    def _path(self, key:str) -> str:
+        if len(key) != 64 or not all(c in '0123456789abcdef' for c in key):
+            raise KeyError(key)
+        return join(self.root, key[:2], key)
+
+    async def put(self, key:str, data:bytes):
+        path = self._path(key)
+        if exists(path):
+            try:
+                os.utime(path) # restart its ttl: the message referencing it was just sent
+                return
+            except FileNotFoundError:
+                pass # swept meanwhile
+        shard = os.path.dirname(path)
+        if not os.path.isdir(shard):
+            private_dir(self.root) # refuses a root planted by another user
+            private_dir(shard)
+        fd, tmp = tempfile.mkstemp(dir=shard, prefix=f'{key}.', suffix='.tmp') # 0600, unique per put
+        os.close(fd)
+        try:
+            async with aiofiles.open(tmp, 'wb') as f:
+                await f.write(data)
+            os.replace(tmp, path) # atomic: readers never see a partial blob; a concurrent put of the same key wrote the same bytes
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    async def get(self, key:str) -> bytes:
+        try:
+            async with aiofiles.open(self._path(key), 'rb') as f:
+                return await f.read()
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    async def sweep(self, max_age:float):
+        await asyncio.get_running_loop().run_in_executor(None, self._sweep, max_age)
+
+    def _sweep(self, max_age:float):
+        cutoff = time.time() - max_age
+        removed = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = join(dirpath, name)
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        if removed:
+            logger.info(f'blob store {self.root}: removed {removed} expired blobs')
+
+
+class ClaimCheck:
+    'replaces large payloads by blob references on send, and resolves them on receive'
+
+    def __init__(self, store:BlobStore=None, threshold:int=MQ_CLAIM_CHECK_BYTES,
+                 cache_bytes:int=MQ_BLOB_CACHE_BYTES, ttl:float=MQ_BLOB_TTL):
+        self.store = store or FileBlobStore()
+        self.threshold = threshold
+        self.cache_bytes = cache_bytes
+        self.ttl = ttl
+        self._cache: OrderedDict = OrderedDict() # key => (data, size)
+        self._cache_size = 0
+        self._last_sweep = time.monotonic()
+        self.checked = 0
+        self.resolved = 0
+        self.cache_hits = 0
+
+    async def encode(self, message:Dict[str, Any]) -> str:
+        'json for the broker: the message itself, or a reference if it is over the threshold'
+        text = json.dumps(message)
+        if not self.threshold or len(text) <= self.threshold:
+            return text
+
+        data = text.encode()
+        key = hashlib.sha256(data).hexdigest()
+        await self.store.put(key, data)
+        self.checked += 1
+        self._remember(key, message, len(data))
+        self._maybe_sweep()
+        return json.dumps({'cmd': message.get('cmd'), CLAIM_KEY: key, '_size': len(data)})
+
+    async def resolve(self, message:Dict[str, Any]) -> Dict[str, Any]:
+        'the full message for a reference (other messages are returned as they are)'
+        key = message.get(CLAIM_KEY)
+        if key is None:
+            return message
+
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return cached[0]
+
+        data = await self.store.get(key)
+        resolved = json.loads(data)
+        self.resolved += 1
+        self._remember(key, resolved, len(data))
+        return resolved
+
+    def _remember(self, key:str, message:Dict[str, Any], size:int):
+        if size > self.cache_bytes:
+            return
+        self._cache[key] = (message, size)
+        self._cache_size += size
+        while self._cache_size > self.cache_bytes:
+            _, (_, evicted) = self._cache.popitem(last=False)
+            self._cache_size -= evicted
+
+    def _maybe_sweep(self):
+        now = time.monotonic()
+        if self.ttl and now - self._last_sweep > self.ttl / 2:
+            self._last_sweep = now
+            asyncio.get_running_loop().create_task(self.store.sweep(self.ttl))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'checked': self.checked,
+            'resolved': self.resolved,
+            'cache_hits': self.cache_hits,
+            'cache_bytes': self._cache_size,
+        }
+
+
+claim_check = ClaimCheck()
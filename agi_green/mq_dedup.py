@@ -0,0 +1,80 @@
+'''
+mq dedup
+
+Message ids and per-subscriber duplicate suppression.
+
+Every published message carries an id (`_id`): a random per-process prefix and a counter,
+so making one costs no syscalls. RabbitMQ (after a robust reconnect) and Azure Service Bus
+(at-least-once) can deliver a message again; each subscriber remembers the ids it received
+in a DedupWindow and drops repeats before the handlers run. A message retried from the
+outbox keeps its id, so a publish that succeeded before the retry is dropped too.
+
+The window is bounded both ways: at most MQ_DEDUP_SIZE ids, each kept for at most
+MQ_DEDUP_TTL seconds. Ids are stored as their 64-bit hashes, in one insertion-ordered dict
+that is also the expiry queue.
+'''
+
+import os
+import time
+import itertools
+from typing import Any, Dict
+
+MQ_DEDUP_SIZE = int(os.getenv('MQ_DEDUP_SIZE', 4096)) # ids remembered per subscriber (0 = no dedup)
+MQ_DEDUP_TTL = float(os.getenv('MQ_DEDUP_TTL', 300)) # seconds an id is remembered
+
+ID_KEY = '_id'
+
+_id_prefix = os.urandom(6).hex()
+_id_counter = itertools.count(1)
+
+def new_message_id() -> str:
+    'an id unique across processes: random process prefix + counter'
+    return f'{_id_prefix}{next(_id_counter):x}'
+
+
+class DedupWindow:
+    'the ids recently received by one subscriber'
+
+    def __init__(self, size:int=MQ_DEDUP_SIZE, ttl:float=MQ_DEDUP_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._seen: Dict[int, float] = {} # hash(id) => time received, oldest first
+        self.checked = 0
+        self.hits = 0
+
+    def seen(self, message_id:str) -> bool:
+        'True if message_id was received within the window; otherwise remember it'
+        if not self.size:
+            return False
+        self.checked += 1
+        now = time.monotonic()
+        key = hash(message_id)
+
+        received = self._seen.get(key)
+        if received is not None and now - received < self.ttl:
+            self.hits += 1
+            return True
+
+        self._expire(now)
+        self._seen.pop(key, None) # re-insert at the end (expired entry)
+        self._seen[key] = now
+        return False
+
+    def _expire(self, now:float):
+        seen = self._seen
+        while seen:
+            oldest = next(iter(seen))
+            if len(seen) < self.size and now - seen[oldest] < self.ttl:
+                break
+            del seen[oldest]
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'checked': self.checked,
+            'hits': self.hits,
+            'hit_rate': self.hits / self.checked if self.checked else 0.0,
+            'size': len(self._seen),
+        }
@@ -0,0 +1,151 @@
+'''
+mq history
+
+Bounded per-channel message history, so late joiners (a new tab, a reconnecting socket)
+can be shown recent messages without a database round trip.
+
+History is kept for the channels matching MQ_HISTORY_CHANNELS (comma separated channel
+ids or glob patterns, e.g. "broadcast,user.*"; empty = off), at most MQ_HISTORY_SIZE
+messages per channel. Messages are recorded once, when they are published, and numbered
+with a per-channel sequence number carried to receivers (as `_seq`, removed before the
+handlers are called), so a subscriber can ask for the last N messages or for everything
+after the last sequence number it received.
+
+- MemoryHistory: ring buffers in this process, for at most MQ_HISTORY_MAX_CHANNELS channels
+  (the least recently used are dropped). Complete for the in-process backend; with the
+  other backends it only holds messages published by this process.
+- RedisHistory: a capped list per channel on a redis server, shared by every process.
+  Used by the redis backend, and by the other backends when MQ_HISTORY_URL is set.
+'''
+
+import os
+import abc
+import json
+import asyncio
+import fnmatch
+import logging
+import weakref
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Tuple
+
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+MQ_HISTORY_CHANNELS = [c.strip() for c in os.getenv('MQ_HISTORY_CHANNELS', '').split(',') if c.strip()]
+MQ_HISTORY_SIZE = int(os.getenv('MQ_HISTORY_SIZE', 100)) # messages kept per channel
+MQ_HISTORY_URL = os.getenv('MQ_HISTORY_URL') or None # redis url for a history shared by all processes
+MQ_HISTORY_MAX_CHANNELS = int(os.getenv('MQ_HISTORY_MAX_CHANNELS', 10000)) # channels kept in memory (least recently used dropped)
+MQ_HISTORY_REPLAY = int(os.getenv('MQ_HISTORY_REPLAY', 20)) # messages shown to a newly connected socket
+
+SEQ_KEY = '_seq'
+
+Entry = Tuple[int, Dict[str, Any]] # sequence number, message
+
+
+def history_enabled(channel_id:str, patterns:List[str]=None) -> bool:
+    'True if messages on channel_id (without subdomain) are kept'
+    patterns = MQ_HISTORY_CHANNELS if patterns is None else patterns
+    return any(fnmatch.fnmatchcase(channel_id, p) for p in patterns)
+
+
+class ChannelHistory(abc.ABC):
+    'the last messages of each channel, numbered'
+
+    def __init__(self, size:int=MQ_HISTORY_SIZE):
+        self.size = size
+
+    @abc.abstractmethod
+    async def append(self, full_channel_id:str, message:Dict[str, Any]) -> int:
+        'record a message, return its sequence number'
+
+    @abc.abstractmethod
+    async def entries(self, full_channel_id:str) -> List[Entry]:
+        'the kept messages of a channel, oldest first'
+
+    async def read(self, full_channel_id:str, last:int=None, since:int=None) -> List[Entry]:
+        'the last `last` messages and/or the messages after sequence number `since`, oldest first'
+        entries = await self.entries(full_channel_id)
+        if since is not None and entries and entries[-1][0] < since:
+            since = 0 # the channel was dropped and numbered again since then: everything is new
+        if since is not None:
+            entries = [e for e in entries if e[0] > since]
+        if last is not None:
+            entries = entries[-last:] if last > 0 else []
+        return entries
+
+
+class MemoryHistory(ChannelHistory):
+    'ring buffers in this process, for the most recently used channels'
+
+    def __init__(self, size:int=MQ_HISTORY_SIZE, max_channels:int=MQ_HISTORY_MAX_CHANNELS):
+        super().__init__(size)
+        self.max_channels = max_channels
+        self.buffers: OrderedDict = OrderedDict() # channel => ring buffer of entries, least recently used first
+
+    async def append(self, full_channel_id:str, message:Dict[str, Any]) -> int:
+        buffer = self.buffers.get(full_channel_id)
+        if buffer is None:
+            buffer = self.buffers[full_channel_id] = deque(maxlen=self.size)
+            while len(self.buffers) > self.max_channels:
+                self.buffers.popitem(last=False)
+        else:
+            self.buffers.move_to_end(full_channel_id)
+        seq = buffer[-1][0] + 1 if buffer else 1
+        buffer.append((seq, message))
+        return seq
+
+    async def entries(self, full_channel_id:str) -> List[Entry]:
+        buffer = self.buffers.get(full_channel_id)
+        if buffer is None:
+            return []
+        self.buffers.move_to_end(full_channel_id)
+        return list(buffer)
+
+
+class RedisHistory(ChannelHistory):
+    'a capped list per channel on a redis server, numbered by a per-channel counter'
+
+    # numbering and appending in one script keeps the list in sequence order across processes
+    _append_script = '''
+local seq = redis.call('INCR', KEYS[1])
+redis.call('RPUSH', KEYS[2], seq .. ' ' .. ARGV[1])
+redis.call('LTRIM', KEYS[2], -tonumber(ARGV[2]), -1)
+return seq
+'''
+
+    def __init__(self, url:str, size:int=MQ_HISTORY_SIZE, prefix:str='mq_history:'):
+        super().__init__(size)
+        self.url = url
+        self.prefix = prefix
+        self.client = aioredis.from_url(url)
+        self._append = self.client.register_script(self._append_script)
+
+    async def append(self, full_channel_id:str, message:Dict[str, Any]) -> int:
+        keys = [f'{self.prefix}seq:{full_channel_id}', f'{self.prefix}{full_channel_id}']
+        return int(await self._append(keys=keys, args=[json.dumps(message), self.size]))
+
+    async def entries(self, full_channel_id:str) -> List[Entry]:
+        entries = []
+        for item in await self.client.lrange(f'{self.prefix}{full_channel_id}', 0, -1):
+            seq, message = (item.decode() if isinstance(item, bytes) else item).split(' ', 1)
+            entries.append((int(seq), json.loads(message)))
+        return entries
+
+
+_stores: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, ChannelHistory]]' = weakref.WeakKeyDictionary()
+
+def get_history(url:str=MQ_HISTORY_URL) -> ChannelHistory:
+    'the process-wide history (per event loop): shared on redis if url is set, else in memory'
+    stores = _stores.setdefault(asyncio.get_running_loop(), {})
+    store = stores.get(url)
+    if store is None:
+        if url and not REDIS_AVAILABLE:
+            logger.error(f'MQ history on {url} needs the redis package, keeping history in memory')
+            return get_history(None)
+        store = stores[url] = RedisHistory(url) if url else MemoryHistory()
+    return store
@@ -0,0 +1,90 @@
+'''
+mq hub
+
+Process-local fan-out for MQ channels shared by many sessions (e.g. broadcast).
+
+Instead of every session subscribing to a shared channel on the broker, the hub keeps
+one upstream subscription per channel per process, on its own MQ protocol instance,
+and dispatches each received message to every local session that joined the channel.
+Broker traffic for a broadcast then scales with the number of processes rather than
+the number of sessions. The hub is backend agnostic: the upstream is an instance of
+the same AbstractMQProtocol subclass the sessions use.
+'''
+
+import asyncio
+import logging
+import weakref
+from collections import defaultdict
+from typing import Dict, Set
+
+from agi_green.dispatcher import Dispatcher
+
+logger = logging.getLogger(__name__)
+
+
+class FanoutHub:
+    'one upstream subscription per shared channel, fanned out to local subscribers'
+
+    def __init__(self, protocol_class:type, **kwargs):
+        self.protocol_class = protocol_class
+        self.kwargs = kwargs
+        self.members: Dict[str, Set] = defaultdict(set) # full channel id => member protocols
+        self.dispatcher: Dispatcher = None
+        self.upstream = None
+        self._lock = asyncio.Lock()
+
+    async def _ensure_upstream(self):
+        if self.upstream is None:
+            self.dispatcher = Dispatcher()
+            upstream = self.protocol_class(self.dispatcher, **self.kwargs)
+            upstream.fanout_hub = self
+            await upstream.run()
+            self.upstream = upstream
+            logger.info(f'fan-out hub upstream started: {upstream}')
+
+    async def join(self, full_channel_id:str, member):
+        'add member to the channel, subscribing upstream for the first local member'
+        async with self._lock:
+            first = not self.members[full_channel_id]
+            self.members[full_channel_id].add(member)
+            if first:
+                await self._ensure_upstream()
+                await self.upstream.subscribe(full_channel_id)
+
+    async def leave(self, full_channel_id:str, member):
+        'remove member from the channel, unsubscribing upstream when no local members remain'
+        async with self._lock:
+            members = self.members.get(full_channel_id)
+            if members is None:
+                return
+            members.discard(member)
+            if not members:
+                del self.members[full_channel_id]
+                if self.upstream is not None:
+                    await self.upstream.unsubscribe(full_channel_id)
+
+    async def dispatch(self, full_channel_id:str, data:dict) -> list:
+        'deliver an upstream message to every local member, concurrently; returns the members\' responses'
+        members = list(self.members.get(full_channel_id, ()))
+        results = await asyncio.gather(
+            *[m.handle_mesg(channel_id=m.shared_channels[full_channel_id], **data) for m in members],
+            return_exceptions=True)
+        for r in results:
+            if isinstance(r, Exception):
+                logger.error(f'fan-out to {full_channel_id} failed: {r}')
+        return [None if isinstance(r, Exception) else r for r in results]
+
+    def member_count(self, full_channel_id:str) -> int:
+        return len(self.members.get(full_channel_id, ()))
+
+
+_hubs: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[tuple, FanoutHub]]' = weakref.WeakKeyDictionary()
+
+def get_hub(protocol_class:type, **kwargs) -> FanoutHub:
+    'the process-wide hub (per event loop) for an MQ backend class and connection settings; kwargs are used to create its upstream'
+    hubs = _hubs.setdefault(asyncio.get_running_loop(), {})
+    key = (protocol_class, tuple(sorted(kwargs.items())))
+    hub = hubs.get(key)
+    if hub is None:
+        hub = hubs[key] = FanoutHub(protocol_class, **kwargs)
+    return hub
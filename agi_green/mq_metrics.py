@@ -0,0 +1,201 @@
+'''
+mq metrics
+
+Process-wide instrumentation common to all MQ backends, cheap enough to leave on: each
+message costs a couple of counter increments and a bucket search, and everything else
+(outbox depth, subscriptions, listener tasks) is read from the live protocols when the
+metrics are scraped.
+
+- publish latency: do_send to the broker accepting the message (or the confirm, with
+  MQ_PUBLISH_CONFIRMS)
+- delivery latency: publish to receipt, from the send time carried with each message
+  (`_ts`, removed before handlers are called); across hosts this includes clock skew
+- per-channel counters of published, delivered and failed messages. Channels are
+  grouped by kind (`socket.*`, `user.*`, `broadcast`, ...) to bound the number of series;
+  rates are computed by the scraper (e.g. prometheus rate())
+- subscribe/unsubscribe churn (mq_control_stats), outbox depth, listener task counts
+- duplicate deliveries dropped by the subscribers' dedup windows, and the hit rate
+
+Set METRICS_PATH (e.g. /metrics) to have the http server export them in the prometheus
+text format, or as json with ?format=json. It is off by default: the endpoint has no
+authentication and is served on the public port, so restrict it at the proxy. With prefork
+workers, each process reports its own metrics and a scrape reaches whichever worker the
+connection is routed to.
+'''
+
+import os
+import time
+import bisect
+import weakref
+from collections import Counter, defaultdict
+from typing import Any, Dict, List
+
+METRICS_PATH = os.getenv('METRICS_PATH', '') # http path for the metrics (empty = not served)
+
+# seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+TS_KEY = '_ts'
+
+# Subscription changes are out of band (bind/unbind, task cancel): they never publish to the broker.
+# 'subscribe'/'unsubscribe' count them; 'legacy_unsubscribe_dropped' counts in-band unsubscribe
+# messages still received from older peers, which are discarded.
+mq_control_stats: Counter = Counter()
+
+
+def channel_kind(channel_id:str) -> str:
+    'channel id without subdomain, with per-entity suffixes folded: socket.ab12 => socket.*'
+    channel_id = channel_id.split(':', 1)[-1]
+    prefix, dot, _ = channel_id.partition('.')
+    return f'{prefix}.*' if dot else channel_id
+
+
+class Histogram:
+    'fixed-bucket histogram (prometheus style: cumulative on export)'
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # last is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value:float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q:float) -> float:
+        'upper bound of the bucket holding quantile q (None if empty)'
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0
+        for bound, n in zip(self.buckets, self.counts):
+            total += n
+            if total >= rank:
+                return bound
+        return float('inf')
+
+    def cumulative(self) -> List[int]:
+        total, out = 0, []
+        for n in self.counts:
+            total += n
+            out.append(total)
+        return out
+
+
+class MQMetrics:
+    'counters and histograms fed by AbstractMQProtocol'
+
+    def __init__(self):
+        self.protocols: weakref.WeakSet = weakref.WeakSet() # live MQ protocol instances
+        self.publish_latency = Histogram()
+        self.delivery_latency = Histogram()
+        self.channels: Dict[str, Counter] = defaultdict(Counter) # channel kind => published/delivered/failed/duplicate
+        self.dedup: Counter = Counter() # checked/duplicate
+        self.started = time.time()
+
+    def register(self, protocol):
+        self.protocols.add(protocol)
+
+    def on_publish(self, channel:str, sent:float):
+        'a message was accepted by the broker; sent is its send time (time.time())'
+        self.publish_latency.observe(time.time() - sent)
+        self.channels[channel_kind(channel)]['published'] += 1
+
+    def on_publish_failed(self, channel:str):
+        self.channels[channel_kind(channel)]['publish_failed'] += 1
+
+    def on_deliver(self, channel:str, sent:float=None):
+        'a message was received; sent is the send time it carried, if any'
+        if sent is not None:
+            self.delivery_latency.observe(max(0.0, time.time() - sent))
+        self.channels[channel_kind(channel)]['delivered'] += 1
+
+    def on_dedup(self, channel:str, duplicate:bool):
+        'a received message id was checked against the dedup window'
+        self.dedup['checked'] += 1
+        if duplicate:
+            self.dedup['duplicate'] += 1
+            self.channels[channel_kind(channel)]['duplicate'] += 1
+
+    def dedup_hit_rate(self) -> float:
+        checked = self.dedup['checked']
+        return self.dedup['duplicate'] / checked if checked else 0.0
+
+    def on_deliver_failed(self, channel:str):
+        self.channels[channel_kind(channel)]['delivery_failed'] += 1
+
+    def gauges(self) -> Dict[str, int]:
+        'current totals over the live protocols'
+        gauges = Counter()
+        for protocol in list(self.protocols):
+            gauges['protocols'] += 1
+            gauges['subscriptions'] += len(protocol.queues)
+            gauges['listener_tasks'] += protocol.listener_count()
+            outbox = protocol.outbox
+            gauges['outbox_messages'] += len(outbox)
+            gauges['outbox_bytes'] += outbox.memory_bytes + outbox.spill_bytes
+            gauges['outbox_dropped'] += outbox.dropped
+        return dict(gauges)
+
+    def stats(self) -> Dict[str, Any]:
+        def latency(h:Histogram):
+            return {'count': h.count, 'mean_ms': 1000 * h.sum / h.count if h.count else None,
+                    'p50_ms': _ms(h.quantile(0.5)), 'p99_ms': _ms(h.quantile(0.99))}
+        return {
+            'uptime': time.time() - self.started,
+            'publish_latency': latency(self.publish_latency),
+            'delivery_latency': latency(self.delivery_latency),
+            'channels': {kind: dict(c) for kind, c in self.channels.items()},
+            'control': dict(mq_control_stats),
+            'dedup': {**self.dedup, 'hit_rate': self.dedup_hit_rate()},
+            **self.gauges(),
+        }
+
+    def prometheus(self) -> str:
+        'metrics in the prometheus text exposition format'
+        lines = []
+
+        def histogram(name:str, h:Histogram, help:str):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} histogram')
+            for bound, n in zip(list(h.buckets) + ['+Inf'], h.cumulative()):
+                lines.append(f'{name}_bucket{{le="{bound}"}} {n}')
+            lines.append(f'{name}_sum {h.sum}')
+            lines.append(f'{name}_count {h.count}')
+
+        histogram('agi_mq_publish_latency_seconds', self.publish_latency, 'time from send to broker acceptance')
+        histogram('agi_mq_delivery_latency_seconds', self.delivery_latency, 'time from send to receipt')
+
+        lines.append('# HELP agi_mq_messages_total MQ messages by channel kind and event')
+        lines.append('# TYPE agi_mq_messages_total counter')
+        for kind, counts in sorted(self.channels.items()):
+            for event, n in sorted(counts.items()):
+                lines.append(f'agi_mq_messages_total{{channel="{_label(kind)}",event="{event}"}} {n}')
+
+        lines.append('# HELP agi_mq_control_total MQ subscription changes')
+        lines.append('# TYPE agi_mq_control_total counter')
+        for op, n in sorted(mq_control_stats.items()):
+            lines.append(f'agi_mq_control_total{{op="{op}"}} {n}')
+
+        lines.append('# HELP agi_mq_dedup_total received message ids checked for duplicates, and duplicates dropped')
+        lines.append('# TYPE agi_mq_dedup_total counter')
+        for result in ('checked', 'duplicate'):
+            lines.append(f'agi_mq_dedup_total{{result="{result}"}} {self.dedup[result]}')
+
+        for name, value in sorted(self.gauges().items()):
+            lines.append(f'# TYPE agi_mq_{name} gauge')
+            lines.append(f'agi_mq_{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _ms(seconds:float) -> float:
+    return None if seconds is None else 1000 * seconds
+
+def _label(value:str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+mq_metrics = MQMetrics()
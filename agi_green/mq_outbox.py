@@ -0,0 +1,202 @@
+'''
+mq outbox
+
+Bounded store for MQ traffic that can't be sent yet: messages sent before an MQ
+protocol has connected or while its broker is unreachable, and subscriptions made
+before connecting.
+
+- messages are kept in memory up to MQ_OUTBOX_MAX_MESSAGES / MQ_OUTBOX_MAX_BYTES; beyond
+  that they are appended to a spill file (json lines), and past MQ_OUTBOX_MAX_SPILL_BYTES
+  they are dropped and counted. The limits are a budget shared by every outbox in the
+  process (outbox_budget), so they don't grow with the number of sessions
+- once anything has spilled, later messages are spilled too, so replay keeps send order
+- replay yields batches (memory first, then the spill file) for the protocol to send
+  concurrently, which lets the backend's per-tick batching pack them
+- pending subscriptions are a set: subscribing to the same channel twice while offline
+  replays one subscribe, and unsubscribing while offline cancels it
+
+Every backend queues sends made before it has connected. Only RabbitMQ, which is told when
+its connection comes back, also queues publishes that fail during a broker outage; the other
+backends raise those to the caller.
+'''
+
+import os
+import json
+import logging
+import tempfile
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+import aiofiles
+
+logger = logging.getLogger(__name__)
+
+MQ_OUTBOX_MAX_MESSAGES = int(os.getenv('MQ_OUTBOX_MAX_MESSAGES', 1000)) # per process, in memory
+MQ_OUTBOX_MAX_BYTES = int(os.getenv('MQ_OUTBOX_MAX_BYTES', 1024 * 1024)) # per process, in memory
+MQ_OUTBOX_MAX_SPILL_BYTES = int(os.getenv('MQ_OUTBOX_MAX_SPILL_BYTES', 100 * 1024 * 1024)) # per process, on disk
+MQ_OUTBOX_REPLAY_BATCH = int(os.getenv('MQ_OUTBOX_REPLAY_BATCH', 100))
+MQ_OUTBOX_DIR = os.getenv('MQ_OUTBOX_DIR') or None # None => system temp dir
+
+Message = Tuple[str, str, Dict[str, Any]] # cmd, channel, kwargs
+
+
+class OutboxBudget:
+    'memory and spill limits shared by a group of outboxes'
+
+    def __init__(self, max_messages:int=MQ_OUTBOX_MAX_MESSAGES, max_bytes:int=MQ_OUTBOX_MAX_BYTES,
+                 max_spill_bytes:int=MQ_OUTBOX_MAX_SPILL_BYTES):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_spill_bytes = max_spill_bytes
+        self.messages = 0
+        self.memory_bytes = 0
+        self.spill_bytes = 0
+
+    def reserve_memory(self, size:int) -> bool:
+        if self.messages >= self.max_messages or self.memory_bytes + size > self.max_bytes:
+            return False
+        self.messages += 1
+        self.memory_bytes += size
+        return True
+
+    def release_memory(self, messages:int, size:int):
+        self.messages -= messages
+        self.memory_bytes -= size
+
+    def reserve_spill(self, size:int) -> bool:
+        if self.spill_bytes + size > self.max_spill_bytes:
+            return False
+        self.spill_bytes += size
+        return True
+
+    def release_spill(self, size:int):
+        self.spill_bytes -= size
+
+
+outbox_budget = OutboxBudget() # shared by every MQ protocol in the process
+
+
+class Outbox:
+    'pending messages and subscriptions of one MQ protocol'
+
+    def __init__(self, budget:OutboxBudget=None, spill_dir:str=MQ_OUTBOX_DIR):
+        self.budget = budget or outbox_budget
+        self.spill_dir = spill_dir
+        self.messages: deque = deque() # (message, size)
+        self.memory_bytes = 0
+        self.subscriptions: Dict[str, None] = {} # ordered set of channel ids
+        self.spill_path: str = None
+        self.spilled = 0 # messages currently in the spill file
+        self.spill_bytes = 0
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self.messages) + self.spilled
+
+    def add_subscription(self, channel_id:str):
+        self.subscriptions[channel_id] = None
+
+    def remove_subscription(self, channel_id:str) -> bool:
+        'cancel a pending subscription; False if there was none'
+        return self.subscriptions.pop(channel_id, False) is None
+
+    def pop_subscriptions(self) -> List[str]:
+        subscriptions = list(self.subscriptions)
+        self.subscriptions.clear()
+        return subscriptions
+
+    async def put(self, cmd:str, channel:str, kwargs:Dict[str, Any]):
+        line = json.dumps([cmd, channel, kwargs])
+        size = len(line)
+
+        if not self.spilled and self.budget.reserve_memory(size):
+            self.messages.append(((cmd, channel, kwargs), size))
+            self.memory_bytes += size
+            return
+
+        if not self.budget.reserve_spill(size + 1):
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.error(f'mq outbox full, {self.dropped} messages dropped')
+            return
+
+        if self.spill_path is None:
+            fd, self.spill_path = tempfile.mkstemp(prefix='agi_mq_outbox_', suffix='.jsonl', dir=self.spill_dir)
+            os.close(fd)
+            logger.warning(f'mq outboxes over {self.budget.max_messages} messages / {self.budget.max_bytes} bytes, spilling to {self.spill_path}')
+
+        async with aiofiles.open(self.spill_path, 'a') as f:
+            await f.write(line + '\n')
+        self.spilled += 1
+        self.spill_bytes += size + 1
+
+    async def replay(self, batch:int=MQ_OUTBOX_REPLAY_BATCH) -> AsyncIterator[List[Message]]:
+        '''yield the pending messages in send order, in batches, removing them
+
+        Only messages pending when replay starts are yielded; anything put back meanwhile
+        (e.g. because the broker dropped again) waits for the next replay.
+        '''
+        remaining = len(self.messages)
+        while remaining and self.messages:
+            n = min(batch, remaining, len(self.messages))
+            remaining -= n
+            messages = [self.messages.popleft() for _ in range(n)]
+            size = sum(size for _, size in messages)
+            self.memory_bytes -= size
+            self.budget.release_memory(n, size)
+            yield [message for message, _ in messages]
+
+        if not self.spilled:
+            return
+
+        path, self.spill_path = self.spill_path, None
+        self.spilled = 0
+        self.budget.release_spill(self.spill_bytes)
+        self.spill_bytes = 0
+        try:
+            async with aiofiles.open(path, 'r') as f:
+                messages = []
+                async for line in f:
+                    cmd, channel, kwargs = json.loads(line)
+                    messages.append((cmd, channel, kwargs))
+                    if len(messages) >= batch:
+                        yield messages
+                        messages = []
+                if messages:
+                    yield messages
+        finally:
+            self._remove(path)
+
+    def clear(self):
+        'discard everything pending'
+        self.budget.release_memory(len(self.messages), self.memory_bytes)
+        self.messages.clear()
+        self.memory_bytes = 0
+        self.subscriptions.clear()
+        if self.spill_path is not None:
+            self._remove(self.spill_path)
+            self.spill_path = None
+        self.spilled = 0
+        self.budget.release_spill(self.spill_bytes)
+        self.spill_bytes = 0
+
+    def __del__(self):
+        # a protocol dropped without close() still gives its share of the budget back
+        self.clear()
+
+    @staticmethod
+    def _remove(path:str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queued': len(self.messages),
+            'queued_bytes': self.memory_bytes,
+            'spilled': self.spilled,
+            'spilled_bytes': self.spill_bytes,
+            'dropped': self.dropped,
+            'subscriptions': len(self.subscriptions),
+        }
@@ -0,0 +1,331 @@
+'''
+mq router
+
+Zero-broker MQ transport between processes on one host (e.g. prefork workers).
+
+A small topic router listens on a unix domain socket (MQ_UNIX_SOCKET). It is embedded:
+the first process to take the lock file next to the socket runs the router on its own
+event loop, and every process, including that one, connects to it as a client. If the
+router process exits, its lock is released and the clients reconnect (with backoff), one
+of them taking over as router.
+
+The default socket is per user and per app (MQ_APP_NAME, default the name of the main
+script), in a private directory under $XDG_RUNTIME_DIR (or the temp dir), so unrelated
+deployments on one host don't share a router; the socket itself is 0600.
+
+- each process subscribes to a topic once and demultiplexes messages locally
+- the router forwards each published frame unchanged to every process subscribed to
+  its topic (including the publisher's)
+- frames are length prefixed binary: 4 byte big-endian length, then op (1 byte), topic
+  length (2 bytes), topic (utf-8) and body
+- frames written in the same loop tick are sent with one write
+'''
+
+import os
+import re
+import sys
+import fcntl
+import struct
+import asyncio
+import logging
+import weakref
+from os.path import join, dirname, basename, splitext
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+
+from agi_green.utils import private_dir, user_runtime_dir
+
+logger = logging.getLogger(__name__)
+
+def _default_app_name() -> str:
+    'the main script name, e.g. my_chat for python my_chat.py'
+    script = sys.argv[0] if sys.argv and sys.argv[0] not in ('-c', '-m') else ''
+    return re.sub(r'[^\w.]', '', splitext(basename(script))[0]).lstrip('.') or 'agi_green'
+
+MQ_APP_NAME = os.getenv('MQ_APP_NAME') or _default_app_name()
+MQ_UNIX_SOCKET = os.getenv('MQ_UNIX_SOCKET') or join(user_runtime_dir(), f'mq-{MQ_APP_NAME}.sock')
+MQ_ROUTER_RECONNECT_ATTEMPTS = int(os.getenv('MQ_ROUTER_RECONNECT_ATTEMPTS', 10)) # after losing the router (backoff up to 30s)
+MQ_ROUTER_MAX_BUFFER = int(os.getenv('MQ_ROUTER_MAX_BUFFER', 16 * 1024 * 1024)) # unsent bytes before a client is dropped
+MQ_ROUTER_BACKLOG = int(os.getenv('MQ_ROUTER_BACKLOG', 10000)) # frames kept while reconnecting
+
+OP_SUB = 1
+OP_UNSUB = 2
+OP_PUB = 3
+
+_length = struct.Struct('!I')
+_head = struct.Struct('!BH') # op, topic length
+
+
+def encode_frame(op:int, topic:str, body:bytes=b'') -> bytes:
+    topic_bytes = topic.encode()
+    return _length.pack(_head.size + len(topic_bytes) + len(body)) + _head.pack(op, len(topic_bytes)) + topic_bytes + body
+
+
+async def read_frame(reader:asyncio.StreamReader) -> Tuple[int, str, bytes, bytes]:
+    'read one frame: (op, topic, body, raw frame)'
+    prefix = await reader.readexactly(_length.size)
+    payload = await reader.readexactly(_length.unpack(prefix)[0])
+    op, topic_length = _head.unpack_from(payload)
+    end = _head.size + topic_length
+    return op, payload[_head.size:end].decode(), payload[end:], prefix + payload
+
+
+class FrameWriter:
+    'buffers frames and writes them once per loop tick'
+
+    def __init__(self, writer:asyncio.StreamWriter):
+        self.writer = writer
+        self.buffer = bytearray()
+        self.frames = 0
+        self.writes = 0
+
+    def send(self, frame:bytes):
+        if not self.buffer:
+            asyncio.get_running_loop().call_soon(self.flush)
+        self.buffer += frame
+        self.frames += 1
+
+    def flush(self):
+        if self.buffer and not self.writer.is_closing():
+            self.writer.write(bytes(self.buffer))
+            self.writes += 1
+        self.buffer.clear()
+
+    @property
+    def backlog(self) -> int:
+        'bytes written but not yet sent'
+        return len(self.buffer) + self.writer.transport.get_write_buffer_size()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+class Router:
+    'topic => subscribed connections; forwards published frames'
+
+    def __init__(self, path:str=MQ_UNIX_SOCKET, max_buffer:int=MQ_ROUTER_MAX_BUFFER):
+        self.path = path
+        self.max_buffer = max_buffer
+        self.subscribers: Dict[str, Set[FrameWriter]] = defaultdict(set)
+        self.server: asyncio.AbstractServer = None
+        self.connections: Set[FrameWriter] = set()
+        self.routed = 0
+        self.dropped_clients = 0
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path) # stale socket from a router that exited
+        self.server = await asyncio.start_unix_server(self._serve, path=self.path)
+        os.chmod(self.path, 0o600)
+        logger.info(f'mq router listening on {self.path} (pid {os.getpid()})')
+
+    async def _serve(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        out = FrameWriter(writer)
+        self.connections.add(out)
+        topics = set()
+
+        try:
+            while True:
+                op, topic, _, frame = await read_frame(reader)
+                if op == OP_PUB:
+                    self.routed += 1
+                    for subscriber in list(self.subscribers.get(topic, ())):
+                        if subscriber.backlog > self.max_buffer:
+                            logger.error(f'mq router: dropping client that stopped reading ({subscriber.backlog} bytes queued)')
+                            self.dropped_clients += 1
+                            self._remove(subscriber)
+                            subscriber.writer.close()
+                            continue
+                        subscriber.send(frame)
+                elif op == OP_SUB:
+                    self.subscribers[topic].add(out)
+                    topics.add(topic)
+                elif op == OP_UNSUB:
+                    self._unsubscribe(topic, out)
+                    topics.discard(topic)
+                else:
+                    logger.error(f'mq router: unknown op {op}, closing client')
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass # client went away
+        except asyncio.CancelledError:
+            pass # router shutting down (python 3.11 asyncio logs cancelled client handlers as errors)
+        finally:
+            self._remove(out)
+            writer.close()
+
+    def _unsubscribe(self, topic:str, out:FrameWriter):
+        subscribers = self.subscribers.get(topic)
+        if subscribers is not None:
+            subscribers.discard(out)
+            if not subscribers:
+                del self.subscribers[topic]
+
+    def _remove(self, out:FrameWriter):
+        self.connections.discard(out)
+        for topic in list(self.subscribers):
+            self._unsubscribe(topic, out)
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            for out in list(self.connections):
+                out.writer.close()
+            await self.server.wait_closed()
+            self.server = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class RouterClient:
+    '''one process's connection to the router
+
+    Listeners are objects with an asyncio.Queue `inbox`; each receives (topic, body bytes)
+    for the topics it subscribed to.
+    '''
+
+    def __init__(self, path:str=MQ_UNIX_SOCKET):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self.listeners: Dict[str, Set] = defaultdict(set)
+        self.router: Router = None # set if this process runs the router
+        self.out: FrameWriter = None
+        self.backlog: List[bytes] = [] # frames published while disconnected
+        self._lock_fd: int = None
+        self._reader_task: asyncio.Task = None
+        self._reconnect_task: asyncio.Task = None
+        self._closed = False
+        self.published = 0
+        self.received = 0
+
+    def _try_lock(self) -> bool:
+        try:
+            fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        except PermissionError as e:
+            raise ConnectionError(f'mq router lock {self.lock_path} belongs to another user: {e}') from e
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def connect(self, attempts:int=100, delay:float=0.05):
+        'connect to the router, becoming the router if no process is'
+        if self.path == MQ_UNIX_SOCKET and not os.getenv('MQ_UNIX_SOCKET'):
+            private_dir(dirname(self.path)) # the default directory: create it, or refuse one owned by another user
+        for _ in range(attempts):
+            if self.router is None and self._try_lock():
+                self.router = Router(self.path)
+                await self.router.start()
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                await asyncio.sleep(delay) # the router process is starting (or restarting)
+            except PermissionError as e:
+                raise ConnectionError(f'mq router socket {self.path} belongs to another user: {e}') from e
+        else:
+            raise ConnectionError(f'could not connect to mq router at {self.path}')
+
+        self.out = FrameWriter(writer)
+        for topic in self.listeners:
+            self.out.send(encode_frame(OP_SUB, topic))
+        for frame in self.backlog:
+            self.out.send(frame)
+        self.backlog.clear()
+        self._reader_task = asyncio.create_task(self._read(reader))
+
+    async def _read(self, reader:asyncio.StreamReader):
+        try:
+            while True:
+                op, topic, body, _ = await read_frame(reader)
+                if op != OP_PUB:
+                    continue
+                self.received += 1
+                for listener in list(self.listeners.get(topic, ())):
+                    listener.inbox.put_nowait((topic, body))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+        self.out = None
+        if not self._closed:
+            logger.warning(f'lost connection to mq router at {self.path}, reconnecting')
+            self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self, attempts:int=MQ_ROUTER_RECONNECT_ATTEMPTS, delay:float=1.0):
+        'connect again after losing the router, with backoff; frames published meanwhile wait in the backlog'
+        for attempt in range(1, attempts + 1):
+            try:
+                await self.connect()
+                return
+            except ConnectionError as e:
+                if attempt == attempts:
+                    logger.error(f'could not reconnect to mq router at {self.path} after {attempts} attempts, giving up: {e}')
+                    return
+                backoff = min(30, delay * 2 ** (attempt - 1))
+                logger.warning(f'mq router reconnect failed ({e}), retrying in {backoff}s')
+                await asyncio.sleep(backoff)
+
+    def _send(self, frame:bytes):
+        if self.out is not None:
+            self.out.send(frame)
+        elif len(self.backlog) < MQ_ROUTER_BACKLOG:
+            self.backlog.append(frame)
+        else:
+            logger.error(f'mq router backlog full, message dropped')
+
+    def subscribe(self, topic:str, listener):
+        first = not self.listeners[topic]
+        self.listeners[topic].add(listener)
+        if first and self.out is not None:
+            self.out.send(encode_frame(OP_SUB, topic))
+
+    def unsubscribe(self, topic:str, listener):
+        listeners = self.listeners.get(topic)
+        if listeners is None:
+            return
+        listeners.discard(listener)
+        if not listeners:
+            del self.listeners[topic]
+            if self.out is not None:
+                self.out.send(encode_frame(OP_UNSUB, topic))
+
+    def publish(self, topic:str, body:bytes):
+        self.published += 1
+        self._send(encode_frame(OP_PUB, topic, body))
+
+    async def close(self):
+        self._closed = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            await asyncio.gather(self._reconnect_task, return_exceptions=True)
+            self._reconnect_task = None
+        if self.out is not None:
+            self.out.close()
+            self.out = None
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+        if self.router is not None:
+            await self.router.close()
+            self.router = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+
+_clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, RouterClient]]' = weakref.WeakKeyDictionary()
+
+async def get_router_client(path:str=MQ_UNIX_SOCKET) -> RouterClient:
+    'the connected process-wide router client (per event loop) for path'
+    clients = _clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(path)
+    if client is None:
+        client = clients[path] = RouterClient(path)
+        await client.connect()
+    return client
@@ -0,0 +1,103 @@
+'''
+mq rpc
+
+Request/response over MQ:
+
+    online = await self.request('mq', 'is_online', channel='user.bob', timeout=2.0)
+
+publishes `is_online` on the channel with a correlation id and the process's reply channel,
+and returns the first reply.
+
+- one reply channel per process and MQ backend (`_rpc:<random id>`), subscribed once by a
+  ReplyRouter on its own protocol instance, like the fan-out hub's upstream
+- pending requests are futures keyed by correlation id; a reply resolves its future, and a
+  timeout (asyncio.TimeoutError) or cancellation of the caller forgets it, so late replies
+  are dropped
+- a receiving session answers with the return value of its handlers for the command (see
+  Protocol.handle_mesg); sessions without a handler don't answer, so a request on a channel
+  with several subscribers returns the first answer from a session that handles it
+'''
+
+import os
+import asyncio
+import logging
+import weakref
+from collections import Counter
+from typing import Any, Dict
+
+from agi_green.dispatcher import Dispatcher, Protocol, protocol_handler
+from agi_green.mq_dedup import new_message_id
+
+logger = logging.getLogger(__name__)
+
+MQ_REQUEST_TIMEOUT = float(os.getenv('MQ_REQUEST_TIMEOUT', 10)) # default seconds to wait for a reply
+
+REPLY_TO_KEY = '_reply_to'
+CORRELATION_KEY = '_corr'
+REPLY_CMD = 'rpc_reply'
+
+
+class ReplyRouter(Protocol):
+    'the process reply channel: resolves pending requests by correlation id'
+
+    protocol_id = 'rpc'
+
+    def __init__(self, protocol_class:type, **kwargs):
+        super().__init__(Dispatcher())
+        self.protocol_class = protocol_class
+        self.kwargs = kwargs
+        self.channel = f'_rpc:{os.urandom(8).hex()}'
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.upstream = None
+        self.stats = Counter() # requests, replies, timeouts, cancelled, late
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        'subscribe to the reply channel (once)'
+        async with self._lock:
+            if self.upstream is None:
+                upstream = self.protocol_class(self.dispatcher, **self.kwargs)
+                await upstream.run()
+                await upstream.subscribe(self.channel)
+                self.upstream = upstream
+                logger.info(f'mq reply channel {self.channel} on {upstream}')
+
+    async def request(self, protocol, cmd:str, channel:str, timeout:float=None, **kwargs) -> Any:
+        'send cmd on channel through protocol and wait for the first reply'
+        await self.start()
+        correlation_id = new_message_id()
+        future = asyncio.get_running_loop().create_future()
+        self.pending[correlation_id] = future
+        self.stats['requests'] += 1
+        try:
+            await protocol.do_send(cmd, channel, **kwargs, **{REPLY_TO_KEY: self.channel, CORRELATION_KEY: correlation_id})
+            return await asyncio.wait_for(future, MQ_REQUEST_TIMEOUT if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            self.stats['timeouts'] += 1
+            raise
+        except asyncio.CancelledError:
+            self.stats['cancelled'] += 1
+            raise
+        finally:
+            self.pending.pop(correlation_id, None)
+
+    @protocol_handler
+    async def on_mq_rpc_reply(self, channel_id:str, correlation_id:str, result:Any=None, **kwargs):
+        future = self.pending.pop(correlation_id, None)
+        if future is None or future.done():
+            self.stats['late'] += 1 # timed out, cancelled, or already answered by another session
+            return
+        self.stats['replies'] += 1
+        future.set_result(result)
+
+
+_routers: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[tuple, ReplyRouter]]' = weakref.WeakKeyDictionary()
+
+def get_reply_router(protocol_class:type, **kwargs) -> ReplyRouter:
+    'the process-wide reply router (per event loop) for an MQ backend class and connection settings'
+    routers = _routers.setdefault(asyncio.get_running_loop(), {})
+    key = (protocol_class, tuple(sorted(kwargs.items())))
+    router = routers.get(key)
+    if router is None:
+        router = routers[key] = ReplyRouter(protocol_class, **kwargs)
+    return router
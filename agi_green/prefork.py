@@ -0,0 +1,326 @@
+'''
+prefork
+
+Multi-process ChatServer with session affinity.
+
+run_prefork() forks N worker processes, each running its own ChatServer (built by a
+factory). The parent process owns the listening socket: it accepts connections, peeks
+at the request headers for the SESSION_ID cookie and hands the connection's file
+descriptor to the worker that owns that session (consistent hashing), over a unix
+SOCK_SEQPACKET socketpair. HTTP requests and /ws upgrades for a session therefore always land on
+the same worker, so the in-memory ChatSession is never split across processes.
+
+- Connections without a SESSION_ID are spread round robin. Workers mint new session
+  ids that hash back to themselves, so a session stays where it was created.
+- With TLS the headers can't be read, so connections are hashed by client address.
+- Workers are supervised: a worker that exits is restarted (with backoff). Workers stop
+  when the parent exits (even if it is killed): the handoff socket reports end of file.
+- Cross-worker messaging goes over MQ; the in-process MQ backend only reaches
+  sessions in the same worker.
+
+Usage:
+
+    from agi_green.chat_server import ChatServer
+    from agi_green.prefork import run_prefork
+
+    run_prefork(lambda: ChatServer(port=8000, session_class=MySession), port=8000, workers=4)
+'''
+
+import os
+import re
+import sys
+import time
+import zlib
+import socket
+import signal
+import asyncio
+import logging
+import itertools
+import multiprocessing
+from typing import Any, Callable, List
+
+logger = logging.getLogger(__name__)
+
+# set in each worker's environment by run_prefork, read by HTTPServerProtocol
+WORKER_INDEX_VAR = 'AGI_WORKER_INDEX'
+WORKER_COUNT_VAR = 'AGI_WORKER_COUNT'
+WORKER_HANDOFF_FD_VAR = 'AGI_WORKER_HANDOFF_FD'
+
+PEEK_SIZE = 8192
+PEEK_TIMEOUT = 5.0
+
+re_session_cookie = re.compile(rb'^cookie:.*?\bSESSION_ID=([^;\s]+)', re.IGNORECASE | re.MULTILINE)
+
+
+def session_worker(session_id:str, workers:int) -> int:
+    'index of the worker that owns session_id'
+    return zlib.crc32(session_id.encode()) % workers
+
+
+async def peek_session_id(conn:socket.socket) -> str|None:
+    'peek (without consuming) at the request headers on conn and return the SESSION_ID cookie, if any'
+    deadline = time.monotonic() + PEEK_TIMEOUT
+    loop = asyncio.get_running_loop()
+    data = b''
+
+    while time.monotonic() < deadline:
+        ready = loop.create_future()
+        loop.add_reader(conn.fileno(), lambda: ready.done() or ready.set_result(None))
+        try:
+            await asyncio.wait_for(ready, deadline - time.monotonic())
+        except asyncio.TimeoutError:
+            break
+        finally:
+            loop.remove_reader(conn.fileno())
+
+        try:
+            peeked = conn.recv(PEEK_SIZE, socket.MSG_PEEK)
+        except BlockingIOError:
+            continue
+
+        if not peeked:
+            break # closed by client
+
+        if len(peeked) == len(data):
+            if len(data) >= PEEK_SIZE:
+                break
+            # still readable but nothing new: the rest of the headers are in flight
+            await asyncio.sleep(0.005)
+            continue
+
+        data = peeked
+        if b'\r\n\r\n' in data:
+            break
+
+    m = re_session_cookie.search(data)
+    return m.group(1).decode() if m else None
+
+
+def handoff_channel() -> tuple[socket.socket, socket.socket]:
+    '''(parent end, worker end) of a handoff socketpair
+
+    SOCK_SEQPACKET keeps each handoff a separate message, like a datagram, but unlike
+    SOCK_DGRAM the worker reads end of file once the parent end is closed.
+    '''
+    return socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+
+
+async def receive_handoffs(channel:socket.socket, on_connection:Callable[[socket.socket], Any]):
+    'call on_connection for each connection handed off on channel; return when the parent goes away'
+    loop = asyncio.get_running_loop()
+    channel.setblocking(False)
+    readable = asyncio.Event()
+    loop.add_reader(channel.fileno(), readable.set)
+
+    try:
+        while True:
+            await readable.wait()
+            readable.clear()
+
+            while True:
+                try:
+                    msg, fds, _, _ = socket.recv_fds(channel, 64, 64)
+                except BlockingIOError:
+                    break
+                except ConnectionError:
+                    return
+
+                if not msg:
+                    return # parent end closed
+
+                for fd in fds:
+                    conn = socket.socket(fileno=fd)
+                    conn.setblocking(False)
+                    on_connection(conn)
+    finally:
+        loop.remove_reader(channel.fileno())
+
+
+class Worker:
+    'one supervised worker slot'
+
+    def __init__(self, index:int):
+        self.index = index
+        self.process: multiprocessing.Process = None
+        self.channel: socket.socket = None # parent end of the handoff socketpair
+        self.started = 0.0
+        self.restart_at: float|None = None
+        self.failures = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+
+class PreforkSupervisor:
+    'accepts connections, routes them to workers, and restarts workers that die'
+
+    def __init__(self, factory:Callable, host:str='0.0.0.0', port:int=8000, workers:int=None, ssl_context=None):
+        self.factory = factory
+        self.host = host
+        self.port = port
+        self.workers = [Worker(i) for i in range(workers or os.cpu_count() or 1)]
+        self.ssl_context = ssl_context
+        self.listener: socket.socket = None
+        self._round_robin = itertools.cycle(range(len(self.workers)))
+        self._stopped: asyncio.Event = None
+
+    def spawn(self, worker:Worker):
+        'start (or restart) the process for a worker slot'
+        if worker.channel is not None:
+            worker.channel.close()
+
+        parent, child = handoff_channel()
+        keep = child.fileno()
+        close_fds = [self.listener.fileno(), parent.fileno()] + [w.channel.fileno() for w in self.workers if w.channel is not None and w is not worker]
+
+        ctx = multiprocessing.get_context('fork')
+        worker.process = ctx.Process(
+            target=_worker_main,
+            args=(self.factory, worker.index, len(self.workers), keep, close_fds),
+            name=f'agi-worker-{worker.index}',
+            daemon=True,
+        )
+        worker.process.start()
+        child.close()
+        worker.channel = parent
+        worker.started = time.monotonic()
+        worker.restart_at = None
+        logger.info(f'worker {worker.index} started: pid {worker.process.pid}')
+
+    def pick(self, session_id:str|None, address) -> Worker:
+        'worker for a connection: by session id, else by client address (tls), else round robin'
+        n = len(self.workers)
+
+        if session_id:
+            index = session_worker(session_id, n)
+        elif self.ssl_context is not None and address:
+            index = session_worker(str(address[0]), n)
+        else:
+            index = next(self._round_robin)
+
+        # skip workers that are down (affinity resumes once they are restarted)
+        for i in range(n):
+            worker = self.workers[(index + i) % n]
+            if worker.alive:
+                return worker
+
+        return None
+
+    async def handoff(self, conn:socket.socket, address):
+        try:
+            session_id = None if self.ssl_context is not None else await peek_session_id(conn)
+            worker = self.pick(session_id, address)
+
+            if worker is None:
+                logger.error('no live workers, dropping connection')
+                return
+
+            socket.send_fds(worker.channel, [b'c'], [conn.fileno()])
+        except OSError as e:
+            logger.error(f'connection handoff failed: {e}')
+        finally:
+            conn.close()
+
+    async def accept_loop(self):
+        loop = asyncio.get_running_loop()
+        tasks = set()
+
+        while not self._stopped.is_set():
+            conn, address = await loop.sock_accept(self.listener)
+            conn.setblocking(False)
+            task = asyncio.create_task(self.handoff(conn, address))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    async def supervise(self):
+        while not self._stopped.is_set():
+            await asyncio.sleep(1)
+            now = time.monotonic()
+
+            for worker in self.workers:
+                if worker.alive or self._stopped.is_set():
+                    continue
+
+                if worker.restart_at is None:
+                    worker.failures = worker.failures + 1 if now - worker.started < 10 else 0
+                    backoff = min(30, 2 ** worker.failures - 1)
+                    logger.error(f'worker {worker.index} exited (code {worker.process.exitcode}), restarting in {backoff}s')
+                    worker.restart_at = now + backoff
+
+                if now >= worker.restart_at:
+                    self.spawn(worker)
+
+    def stop(self):
+        self._stopped.set()
+        for worker in self.workers:
+            if worker.alive:
+                worker.process.terminate()
+
+    async def run(self):
+        self._stopped = asyncio.Event()
+        self.listener = socket.create_server((self.host, self.port), backlog=1024, reuse_port=hasattr(socket, 'SO_REUSEPORT'))
+        self.listener.setblocking(False)
+
+        for worker in self.workers:
+            self.spawn(worker)
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+
+        logger.info(f'prefork: serving {self.host}:{self.port} with {len(self.workers)} workers')
+
+        tasks = [asyncio.create_task(self.accept_loop()), asyncio.create_task(self.supervise())]
+        for task in tasks:
+            task.add_done_callback(lambda t: self.stop())
+
+        try:
+            await self._stopped.wait()
+        finally:
+            self.stop()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for worker in self.workers:
+                if worker.process is not None:
+                    await loop.run_in_executor(None, worker.process.join, 5)
+            self.listener.close()
+
+
+def _worker_main(factory:Callable, index:int, count:int, handoff_fd:int, close_fds:List[int]):
+    'worker process entry point'
+    # undo the parent event loop's signal handling inherited through fork
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    for fd in close_fds:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+    os.environ[WORKER_INDEX_VAR] = str(index)
+    os.environ[WORKER_COUNT_VAR] = str(count)
+    os.environ[WORKER_HANDOFF_FD_VAR] = str(handoff_fd)
+
+    async def main():
+        server = factory()
+        await server.run()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
+
+
+def run_prefork(factory:Callable, host:str='0.0.0.0', port:int=8000, workers:int=None, ssl_context=None):
+    '''serve with multiple worker processes sharing one port
+
+    factory: called in each worker (inside its event loop) to build the ChatServer
+    workers: number of worker processes (default: cpu count)
+    '''
+    supervisor = PreforkSupervisor(factory, host=host, port=port, workers=workers, ssl_context=ssl_context)
+    asyncio.run(supervisor.run())
@@ -1,12 +1,16 @@
 import os
 from os.path import join, dirname, splitext, isabs
 import re
-from typing import Callable, Awaitable, Dict, Any, List, Set, Union, Tuple
+from typing import Callable, Awaitable, Dict, Any, List, Set, Union, Tuple, FrozenSet
 from logging import getLogger, Logger
 import json
+import asyncio
 import logging
 import glob
 import uuid
+import time
+import socket
+from collections import OrderedDict, defaultdict
 from queue import Queue
 from os.path import exists
 from pathlib import Path
@@ -16,6 +20,14 @@ from openai import OpenAI
 
 from agi_green.dispatcher import Protocol, format_call, protocol_handler
 from agi_green.config_namespace import DictNamespace
+from agi_green.docs_catalog import docs_catalog
+from agi_green.md_cache import md_cache, MD_INLINE_MAX_BYTES
+from agi_green.session_store import SessionStore, dump_context
+from agi_green.utils import process_rss_mb
+from agi_green.uploads import read_post, release_uploads
+from agi_green.access_log import QueueAccessLogger, close_access_log
+from agi_green.mq_metrics import mq_metrics, METRICS_PATH
+from agi_green.prefork import receive_handoffs, session_worker, WORKER_INDEX_VAR, WORKER_COUNT_VAR, WORKER_HANDOFF_FD_VAR
 
 here = dirname(__file__)
 logger = logging.getLogger(__name__)
@@ -32,6 +44,106 @@ text_content_types = {
     '.md': 'text/markdown',
 }
 
+default_static_dirs = [join(here, 'static'), join(here, 'frontend', 'dist')]
+
+# idle session eviction (0 disables the corresponding trigger)
+SESSION_IDLE_TIMEOUT = float(os.getenv('SESSION_IDLE_TIMEOUT', 3600))  # seconds without sockets before hibernation
+SESSION_MAX_ACTIVE = int(os.getenv('SESSION_MAX_ACTIVE', 0))  # LRU cap on live sessions
+SESSION_MEMORY_LIMIT_MB = float(os.getenv('SESSION_MEMORY_LIMIT_MB', 0))  # hibernate idle sessions above this RSS
+SESSION_SWEEP_INTERVAL = float(os.getenv('SESSION_SWEEP_INTERVAL', 60))
+SESSION_PENDING_MAX = int(os.getenv('SESSION_PENDING_MAX', 10000))  # sessionless pages waiting for their session
+
+def is_asset_request(request:web.Request) -> bool:
+    'True for GET/HEAD of a file with an extension (other than markdown, which is rendered per session)'
+    return request.method in ('GET', 'HEAD') and splitext(request.url.name)[1] not in ('', '.md')
+
+
+class HTTPRoutes:
+    '''
+    Compiled routing table for http request/response handlers
+
+    Handlers declare the url paths they care about with @protocol_handler(paths=[...]).
+    Exact paths are a dict lookup and prefixes ('/path/*') are checked with one compiled regex,
+    so routing an asset request costs O(1) regardless of how many protocols are registered.
+    Handlers without paths are catch-all and see every request except static assets.
+    '''
+
+    def __init__(self, handlers:List[Callable]):
+        self.handlers = handlers
+        self.catch_all = [h for h in handlers if not getattr(h, 'paths', None)]
+        self.exact:Dict[str, List[Callable]] = defaultdict(list)
+        self.prefixes:Dict[str, List[Callable]] = defaultdict(list)
+
+        for h in handlers:
+            for path in getattr(h, 'paths', None) or ():
+                if path.endswith('*'):
+                    self.prefixes[path[:-1]].append(h)
+                else:
+                    self.exact[path].append(h)
+
+        if self.prefixes:
+            self.prefix_re = re.compile('|'.join(re.escape(p) for p in self.prefixes))
+        else:
+            self.prefix_re = None
+
+    def route(self, path:str, asset:bool=False) -> List[Callable]:
+        'handlers for path in priority order'
+        matched = self.exact.get(path)
+        prefixed = self.prefix_re is not None and self.prefix_re.match(path)
+
+        if not matched and not prefixed:
+            return [] if asset else self.catch_all
+
+        selected = set(matched or ())
+        if prefixed:
+            for prefix, handlers in self.prefixes.items():
+                if path.startswith(prefix):
+                    selected.update(handlers)
+        if not asset:
+            selected.update(self.catch_all)
+
+        return [h for h in self.handlers if h in selected]
+
+
+class SessionProfile:
+    '''
+    What a new session does with a plain GET/HEAD, recorded once per server
+
+    Holds copies, not references: the static dirs a session has after its constructor, whether it
+    has static handlers, the paths its http request/response handlers declared and its http commands.
+    This is enough to serve static files, markdown pages and 404s to clients without a live session.
+    '''
+
+    class Route:
+        'stands in for a handler in the routing tables (only its paths matter)'
+        __slots__ = ('paths',)
+
+        def __init__(self, handler:Callable):
+            self.paths = getattr(handler, 'paths', None)
+
+    def __init__(self, http:'HTTPSessionProtocol'):
+        registered = http.dispatcher.registered_methods[http.protocol_id]
+        self.static:Tuple[str, ...] = tuple(http.static)
+        self.has_static_handlers = bool(http.static_handlers)
+        self.routes = {cmd: HTTPRoutes([self.Route(h) for h in registered.get(cmd, ())]) for cmd in ('request', 'response')}
+        self.commands:FrozenSet[str] = frozenset(cmd for cmd, handlers in registered.items() if handlers)
+
+    def find_static(self, filename:str) -> str|None:
+        for static_dir in self.static:
+            file_path = join(static_dir, filename)
+            if os.path.isfile(file_path):
+                return file_path
+        return None
+
+    def needs_session(self, request:web.Request) -> bool:
+        'True if a session handler could see the request'
+        asset = is_asset_request(request)
+        if self.routes['request'].route(request.path, asset) or self.routes['response'].route(request.path, asset):
+            return True
+        name = request.url.name
+        return bool(name) and '.' not in name and request.url.path[1:].replace('/', '_') in self.commands
+
+
 class HTTPServerProtocol(Protocol):
     '''
     http server (or https if ssl_context is provided)
@@ -55,19 +167,47 @@ class HTTPServerProtocol(Protocol):
         self.runner:web.AppRunner = None
         self.site:web.TCPSite = None
         self.session_class = self.dispatcher.session_class
-        self.sessions:Dict[str, Protocol] = {}
+        self.sessions:OrderedDict[str, Protocol] = OrderedDict() # least recently used first
+        self.session_activity:Dict[str, float] = {}
+        self.session_store = SessionStore()
+        self._hibernating:Dict[str, str] = {} # session_id => context snapshot being written
+        self._rehydrating:Dict[str, asyncio.Future] = {} # session_id => context being loaded
+        self.session_profile:SessionProfile|None = None # set by the first session, see handle_sessionless_request
+        self._pending_ws:OrderedDict[str, List[Tuple[str, dict]]] = OrderedDict() # session_id => ws messages for its first socket
+        self.idle_timeout = SESSION_IDLE_TIMEOUT
+
+        # prefork worker (see agi_green.prefork): connections are handed off by the parent process
+        self.worker_index = int(os.getenv(WORKER_INDEX_VAR, 0))
+        self.worker_count = int(os.getenv(WORKER_COUNT_VAR, 1))
+        handoff_fd = os.getenv(WORKER_HANDOFF_FD_VAR)
+        self.handoff_fd = int(handoff_fd) if handoff_fd else None
+        self.max_sessions = SESSION_MAX_ACTIVE
+        self.memory_limit_mb = SESSION_MEMORY_LIMIT_MB
 
     async def http_to_https_redirect(self, request):
         assert self.ssl_context is not None, "SSL context must be set for HTTPS redirect"
         https_location = f'https://{request.host}{request.rel_url}'
         raise web.HTTPMovedPermanently(https_location)
 
-    def get_or_create_session(self, request):
+    async def handle_metrics_request(self, request:web.Request) -> web.Response:
+        'MQ metrics of this process (one worker under prefork): prometheus text, or json with ?format=json'
+        if request.query.get('format') == 'json':
+            return web.json_response(mq_metrics.stats())
+        return web.Response(text=mq_metrics.prometheus(), content_type='text/plain', headers={'Cache-Control': 'no-store'})
+
+    def new_session_id(self) -> str:
+        'generate a session id (in a prefork worker, one that the parent routes back to this worker)'
+        while True:
+            session_id = str(uuid.uuid4())
+            if self.worker_count <= 1 or session_worker(session_id, self.worker_count) == self.worker_index:
+                return session_id
+
+    async def get_or_create_session(self, request):
         session_id = request.cookies.get('SESSION_ID')
         new_session_id = None
 
         if not session_id:
-            new_session_id = session_id = str(uuid.uuid4())
+            new_session_id = session_id = self.new_session_id()
 
         try:
             session = self.sessions[session_id]
@@ -77,7 +217,28 @@ class HTTPServerProtocol(Protocol):
         if session is None:
             session:Protocol = self.session_class(self, session_id=session_id)
             self.sessions[session_id] = session
+            if not new_session_id:
+                # concurrent requests for the session wait until its context is restored
+                rehydrating = self._rehydrating[session_id] = asyncio.ensure_future(self.rehydrate_session(session, session_id))
+                try:
+                    await rehydrating
+                except BaseException:
+                    self.sessions.pop(session_id, None)
+                    raise
+                finally:
+                    self._rehydrating.pop(session_id, None)
+            if self.session_profile is None:
+                self.session_profile = self.profile_session(session)
+            for cmd, kwargs in self._pending_ws.pop(session_id, ()):
+                await session.send('ws', cmd, **kwargs)
             self.add_task(session.run())
+        else:
+            self.sessions.move_to_end(session_id)
+            rehydrating = self._rehydrating.get(session_id)
+            if rehydrating is not None:
+                await asyncio.shield(rehydrating)
+
+        self.session_activity[session_id] = time.monotonic()
 
         # Set the subdomain in the session context
         host = request.host.split(':')[0]  # Remove port if present
@@ -85,9 +246,185 @@ class HTTPServerProtocol(Protocol):
 
         return session, new_session_id
 
+    async def rehydrate_session(self, session:Protocol, session_id:str):
+        'restore the context of a hibernated session into a freshly created session'
+        snapshot = self._hibernating.pop(session_id, None)
+        data = json.loads(snapshot) if snapshot is not None else await self.session_store.pop(session_id)
+
+        if data:
+            session.context._deep_update(data)
+            logger.info(f'Rehydrated session: {session_id}')
+
+    async def hibernate_session(self, session_id:str):
+        'serialize the session context to the session store and tear the session down'
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return
+
+        self.session_activity.pop(session_id, None)
+        snapshot = None
+        if self.session_store.valid_id(session_id):
+            snapshot = dump_context(session.context)
+            self._hibernating[session_id] = snapshot
+            logger.info(f'Hibernating session: {session_id}')
+        else:
+            # a forged SESSION_ID cookie can't name a file: drop the session rather than keep it forever
+            logger.warning(f'Session id {session_id!r} can not be hibernated, closing the session without saving it')
+
+        try:
+            await session.close()
+        except Exception as e:
+            logger.error(f'Error closing hibernated session {session_id}: {e}', exc_info=True)
+
+        if snapshot is None:
+            return
+
+        try:
+            await self.session_store.save(session_id, snapshot)
+        finally:
+            if self._hibernating.pop(session_id, None) is None:
+                # rehydrated while we were writing: the file is stale
+                await self.session_store.pop(session_id)
+
+    @staticmethod
+    def session_has_sockets(session:Protocol) -> bool:
+        try:
+            return bool(session.get_protocol('ws').sockets)
+        except ValueError:
+            return False
+
+    async def evict_idle_sessions(self):
+        'hibernate sessions without sockets that are idle, over the LRU cap, or under memory pressure'
+        now = time.monotonic()
+        idle = [sid for sid, session in self.sessions.items() if not self.session_has_sockets(session)]
+
+        evict = []
+        if self.idle_timeout:
+            evict = [sid for sid in idle if now - self.session_activity.get(sid, now) > self.idle_timeout]
+
+        candidates = [sid for sid in idle if sid not in evict]
+        n = 0
+
+        if self.max_sessions:
+            n = len(self.sessions) - len(evict) - self.max_sessions
+
+        if self.memory_limit_mb and process_rss_mb() > self.memory_limit_mb:
+            n = max(n, len(candidates) // 10 + 1)
+
+        evict += candidates[:max(n, 0)]
+
+        for sid in evict:
+            try:
+                await self.hibernate_session(sid)
+            except Exception as e:
+                logger.error(f'Error hibernating session {sid}: {e}', exc_info=True)
+
+        return len(evict)
+
+    async def session_sweep_loop(self):
+        'periodically evict idle sessions'
+        while True:
+            await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+            try:
+                n = await self.evict_idle_sessions()
+                if n:
+                    logger.info(f'Hibernated {n} idle sessions ({len(self.sessions)} active)')
+                await self.session_store.sweep()
+            except Exception as e:
+                logger.error(f'Session sweep failed: {e}', exc_info=True)
+
+    def profile_session(self, session:Protocol|None=None) -> SessionProfile|None:
+        'profile a session, or construct one that is never run or registered just to profile it'
+        if session is None:
+            session = self.session_class(self, session_id='')
+        try:
+            return SessionProfile(session.get_protocol('http'))
+        except ValueError:
+            return None
+
+    def defer_ws(self, session_id:str, cmd:str, **kwargs):
+        'queue a ws message for a session that will be created when its page connects'
+        self._pending_ws.setdefault(session_id, []).append((cmd, kwargs))
+        self._pending_ws.move_to_end(session_id)
+        while len(self._pending_ws) > SESSION_PENDING_MAX:
+            self._pending_ws.popitem(last=False)
+
+    async def handle_sessionless_request(self, request:web.Request, session_id:str|None) -> web.StreamResponse|None:
+        '''serve a plain GET/HEAD for a client without a live session, or return None if it needs one
+
+        Files, markdown pages and 404s are resolved as a new session would (see SessionProfile).
+        A rendered markdown page's open_md message waits in _pending_ws for the session that its
+        websocket creates. Queries, commands, paths that http handlers declared, files that only
+        static handlers might provide still go through a session.
+        '''
+        if request.method not in ('GET', 'HEAD') or request.query:
+            return None
+
+        if self.session_profile is None:
+            self.session_profile = self.profile_session()
+        profile = self.session_profile
+
+        filename = request.match_info.get('filename') or 'index.html'
+
+        if profile is None or '*' in filename or '..' in filename or profile.needs_session(request):
+            return None
+
+        new_session_id = None
+        if not session_id:
+            # hand out the session id now; the session itself is created on first stateful use
+            new_session_id = session_id = self.new_session_id()
+
+        index_html = profile.find_static('index.html')
+        response = None
+
+        if filename in ('docs', 'docs/index'):
+            if index_html is None:
+                return None
+            self.defer_ws(session_id, 'open_md', name='docs/index.md', content=docs_catalog.index(list(profile.static)), viewmode='render')
+            response = await HTTPSessionProtocol.serve_file(index_html)
+
+        elif (file_path := profile.find_static(filename+'.md')) is not None:
+            if index_html is None:
+                return None
+            try:
+                size = md_cache.stamp(file_path)[1]
+            except OSError:
+                return None
+            filename += '.md'
+            if size > MD_INLINE_MAX_BYTES:
+                self.defer_ws(session_id, 'open_md', name=filename, url=f'/{filename}?view=raw', viewmode='render')
+            else:
+                self.defer_ws(session_id, 'open_md', name=filename, content=await md_cache.get(file_path), viewmode='render')
+            response = await HTTPSessionProtocol.serve_file(index_html)
+
+        elif (file_path := profile.find_static(filename)) is not None:
+            if splitext(filename)[1] == '.md':
+                response = web.FileResponse(file_path) # raw, as a session serves it without ?view=render
+            else:
+                response = await HTTPSessionProtocol.serve_file(file_path)
+
+        elif profile.has_static_handlers:
+            return None
+
+        else:
+            response = web.HTTPNotFound()
+
+        self.context.host = request.host
+        if new_session_id:
+            response.set_cookie('SESSION_ID', new_session_id, max_age=60*60*24*365)
+
+        return response
+
     async def handle_http_request(self, request:web.Request):
-        logger.info(f"HTTP Request received: {request.method} {request.path}")
-        session, new_session_id = self.get_or_create_session(request)
+        logger.debug(f"HTTP Request received: {request.method} {request.path}")
+        session_id = request.cookies.get('SESSION_ID')
+
+        if session_id not in self.sessions:
+            response = await self.handle_sessionless_request(request, session_id)
+            if response is not None:
+                return response
+
+        session, new_session_id = await self.get_or_create_session(request)
         http:HTTPSessionProtocol = session.get_protocol('http')
 
         # Convert headers to a simple dict for message passing
@@ -105,14 +442,14 @@ class HTTPServerProtocol(Protocol):
                 response.set_cookie('SESSION_ID', new_session_id, max_age=60*60*24*365)
                 logger.info(f'New session: {new_session_id}')
         else:
-            logger.info(f'Existing session: {session.context.session_id}')
+            logger.debug(f'Existing session: {session.context.session_id}')
 
         return response
 
     async def handle_websocket_request(self, request:web.Request):
         socket = web.WebSocketResponse()
         await socket.prepare(request)
-        session, new_session_id = self.get_or_create_session(request)
+        session, new_session_id = await self.get_or_create_session(request)
         socket.id = request.query['socket_id']
 
         # Convert headers to a simple dict for message passing
@@ -124,7 +461,7 @@ class HTTPServerProtocol(Protocol):
         await ws.handle_mesg('connect', socket=socket, headers=headers)
 
         async for msg in socket:
-            logger.info(f'ws {msg.type}, {msg.data}')
+            logger.debug(f'ws {msg.type}, {msg.data}')
             if msg.type == WSMsgType.TEXT:
                 data = json.loads(msg.data)
                 # Handle the message
@@ -136,6 +473,7 @@ class HTTPServerProtocol(Protocol):
 
         # Handle disconnect
         await ws.handle_mesg('disconnect', socket=socket)
+        self.session_activity[session.context.session_id] = time.monotonic()
 
         if new_session_id:
             logger.error(f'Unexpected new session on ws message: {self} {new_session_id}')
@@ -145,20 +483,33 @@ class HTTPServerProtocol(Protocol):
 
     async def run(self):
         self.add_task(super().run())
+        self.add_task(self.session_sweep_loop())
 
         self.app = web.Application(client_max_size=10_000_000_000)  # 10GB limit to match websocket
         logger.info(f'web.Application(client_max_size=10_000_000_000)')
+        self.app.on_cleanup.append(close_access_log)
         # on_http_* methods are handled by HTTPSessionProtocol
         #handle_websocket_request
         self.app.router.add_get('/ws', self.handle_websocket_request)  # Delegate WebSocket connections
+        if METRICS_PATH:
+            # opt-in, unauthenticated, and registered before the catch-all route so it shadows any app page at
+            # that path; in a prefork worker it only reports this worker (scrapes land on the routed worker)
+            self.app.router.add_get(METRICS_PATH, self.handle_metrics_request)
         self.app.router.add_get('/{filename:.*}', self.handle_http_request)
         self.app.router.add_post('/{filename:.*}', self.handle_http_request)
         self.app.router.add_get('/', self.handle_http_request, name='index')
 
+        if self.handoff_fd is not None:
+            # prefork worker: the parent process owns the port and hands us connections
+            self.runner = web.AppRunner(self.app, access_log_class=QueueAccessLogger)
+            await self.runner.setup()
+            self.add_task(self.accept_handoffs())
+            logger.info(f'worker {self.worker_index}/{self.worker_count} serving {self.host}:{self.port}')
+
         # Check if SSL context is provided for HTTPS
-        if self.ssl_context:
+        elif self.ssl_context:
             # HTTPS server setup
-            self.runner = web.AppRunner(self.app)
+            self.runner = web.AppRunner(self.app, access_log_class=QueueAccessLogger)
             await self.runner.setup()
             self.site = web.TCPSite(self.runner, self.host, self.port, ssl_context=self.ssl_context)
             logger.info(f'Serving https://{self.host}:{self.port}')
@@ -175,7 +526,7 @@ class HTTPServerProtocol(Protocol):
                 await redirect_site.start()
         else:
             # HTTP server setup
-            self.runner = web.AppRunner(self.app)
+            self.runner = web.AppRunner(self.app, access_log_class=QueueAccessLogger)
             await self.runner.setup()
             self.site = web.TCPSite(self.runner, self.host, self.port)
             await self.site.start()
@@ -183,6 +534,21 @@ class HTTPServerProtocol(Protocol):
             logger.info(f'{self.app.router}')
 
 
+    async def accept_handoffs(self):
+        'adopt connections handed off by the prefork parent process'
+        loop = asyncio.get_running_loop()
+        channel = socket.socket(fileno=self.handoff_fd)
+
+        def adopt(conn:socket.socket):
+            self.add_task(loop.connect_accepted_socket(self.runner.server, conn, ssl=self.ssl_context))
+
+        try:
+            await receive_handoffs(channel, adopt)
+        finally:
+            channel.close()
+        logger.error('prefork parent went away, stopping worker')
+        self.dispatcher.stop()
+
     async def close(self):
         # Stop the aiohttp site
         if self.site:
@@ -210,8 +576,9 @@ class HTTPSessionProtocol(Protocol):
 
     def __init__(self, parent:Protocol):
         super().__init__(parent)
-        self.static = [join(here, 'static'), join(here, 'frontend', 'dist')]
+        self.static = list(default_static_dirs)
         self.static_handlers:List[Callable] = []
+        self._routes:Dict[str, HTTPRoutes] = {}
 
         for static_dir in self.static:
             if not exists(static_dir):
@@ -238,12 +605,12 @@ class HTTPSessionProtocol(Protocol):
             self.static_handlers.insert(index, handler)
 
     def find_static(self, filename:str):
-        logger.info(f"Looking for static file: {filename}")
+        logger.debug(f"Looking for static file: {filename}")
         if '*' in filename:
             # Handle glob pattern
             for static_dir in self.static:
                 file_path = os.path.join(static_dir, filename)
-                logger.info(f"Checking glob path: {file_path}")
+                logger.debug(f"Checking glob path: {file_path}")
                 matches = glob.glob(file_path)
                 if matches:
                     if len(matches) > 1:
@@ -255,7 +622,7 @@ class HTTPSessionProtocol(Protocol):
             for static_dir in self.static:
                 file_path = os.path.join(static_dir, filename)
                 exists = os.path.isfile(file_path)
-                logger.info(f"Checking path: {file_path}, exists: {exists}")
+                logger.debug(f"Checking path: {file_path}, exists: {exists}")
                 if exists:
                     return file_path
 
@@ -269,42 +636,35 @@ class HTTPSessionProtocol(Protocol):
             files.extend(glob.glob(file_path))
         return files
 
-    def index_md(self):
-        index_file = join(here, 'static', 'docs', 'index.md')
-        files = self.find_static_glob('docs/*.md')
-        newest_file = max(files, key=os.path.getmtime)
-
-        if newest_file != index_file:
-            if index_file in files:
-                files.remove(index_file)
-            files.sort()
-
-            with open(index_file, 'w') as f:
-                f.write(f'<!-- This index is generated by {__file__} - edits will be lost. -->\n\n')
-                f.write('| File | Description |\n')
-                f.write('| ---- | ----------- |\n')
-                for file in files:
-                    with open(file, 'r') as f2:
-                        s = f2.read()
-                        # find first markdown header
-                        m = re.search(r'^#+\s+(.*)', s, re.MULTILINE)
-                        if m:
-                            header = m.group(1)
-                            base = os.path.basename(file).replace('.md','')
-                            f.write(f'| [**{base}**](/docs/{base}) | *{header}* |\n')
-
-
-        if not exists(index_file):
-            return None
-        return index_file
+    def routes(self, cmd:str) -> HTTPRoutes:
+        'compiled routes for http:cmd handlers (recompiled when the handler registry changes)'
+        handlers = self.dispatcher.registered_methods[self.protocol_id][cmd]
+        routes = self._routes.get(cmd)
+
+        if routes is None or routes.handlers is not handlers:
+            routes = self._routes[cmd] = HTTPRoutes(handlers)
+
+        return routes
+
+    def index_md(self) -> str:
+        'return the docs index markdown, rendered in memory by the process-wide docs catalog'
+        return docs_catalog.index(self.static)
 
     async def handle_request(self, request:web.Request, headers:dict=None):
-        data = DictNamespace()
-        url = str(request.url)
+        if request.method != 'POST':
+            return await self.dispatch_request(request, DictNamespace(), headers)
 
-        if request.method == 'POST':
-            data.update(await request.post())
+        # multipart file parts are streamed to temp files, which live until the request is handled
+        fields, uploads = await read_post(request)
+        try:
+            data = DictNamespace()
+            data.update(fields)
+            return await self.dispatch_request(request, data, headers)
+        finally:
+            release_uploads(uploads)
 
+    async def dispatch_request(self, request:web.Request, data:DictNamespace, headers:dict=None):
+        url = str(request.url)
         data.update(request.query)
 
         # Send request to all protocols before serving static files
@@ -312,8 +672,10 @@ class HTTPSessionProtocol(Protocol):
         data.request_method = str(request.method)
         data.headers = headers
 
-        # First try http_request handlers
-        response = await self.handle_mesg('request', **data)
+        # First try http_request handlers (static assets only reach handlers that declared their path)
+        asset = is_asset_request(request)
+        handlers = self.routes('request').route(request.path, asset)
+        response = await self.call_handlers(handlers, **data) if handlers else None
 
         if response is not None:
             if isinstance(response, dict):
@@ -349,12 +711,17 @@ class HTTPSessionProtocol(Protocol):
 
             query = request.query.copy()
 
-            if filename == 'docs':
-                file_path_md = self.index_md()
-                filename = 'docs/index'
-            else:
-                # check for filename+'.md' and serve that instead with query: view=render
-                file_path_md = self.find_static(filename+'.md')
+            if filename in ('docs', 'docs/index'):
+                content = self.index_md()
+
+                if query.get('view', 'render') == 'raw':
+                    return web.Response(text=content, content_type='text/markdown')
+
+                await self.send('ws', 'open_md', name='docs/index.md', content=content, viewmode='render')
+                return await self.serve_file(self.find_static('index.html'))
+
+            # check for filename+'.md' and serve that instead with query: view=render
+            file_path_md = self.find_static(filename+'.md')
 
             if file_path_md is not None:
                 query.add('view','render')
@@ -380,18 +747,22 @@ class HTTPSessionProtocol(Protocol):
                 if format == 'raw':
                     return web.FileResponse(file_path)
 
-                if not os.path.exists(file_path) or not os.path.isfile(file_path):
+                try:
+                    size = md_cache.stamp(file_path)[1]
+                except OSError:
                     raise web.HTTPNotFound()
 
-                with open(file_path, 'r') as f:
-                    content = f.read()
+                # queue up the message (will be queued until after the websocket is connected)
+                if size > MD_INLINE_MAX_BYTES:
+                    # too big for one ws message: send a reference, the client fetches the raw view
+                    await self.send('ws', 'open_md', name=filename, url=f'/{filename}?view=raw', viewmode='render')
+                else:
+                    content = await md_cache.get(file_path)
+                    await self.send('ws', 'open_md', name=filename, content=content, viewmode='render')
 
                 # serve the index.html file. The open_md message will populate the md viewer
                 file_path = self.find_static('index.html')
 
-                # queue up the message (will be queued until after the websocket is connected)
-                await self.send('ws', 'open_md', name=filename, content=content, viewmode='render')
-
                 return await self.serve_file(file_path)
 
             else:
@@ -399,7 +770,9 @@ class HTTPSessionProtocol(Protocol):
 
         # After getting any response, pass through http_response handler
         if response is not None:
-            await self.handle_mesg('response', request=request, response=response, **data)
+            handlers = self.routes('response').route(request.path, asset)
+            if handlers:
+                await self.call_handlers(handlers, request=request, response=response, **data)
 
         # Ensure we never return None which would cause AttributeError
         if response is None:
@@ -411,7 +784,7 @@ class HTTPSessionProtocol(Protocol):
 
     @staticmethod
     async def serve_file(file_path):
-        logger.info(f"Serving file: {file_path}")
+        logger.debug(f"Serving file: {file_path}")
         response = web.FileResponse(file_path)
 
         # Add cache control headers
@@ -425,6 +798,4 @@ class HTTPSessionProtocol(Protocol):
         elif file_path.endswith('.js'):
             response.content_type = 'application/javascript'
 
-        print(f'{file_path} => {response.content_type}')
-
         return response
@@ -1,30 +1,54 @@
 """Message Queue Protocol implementations for AGI.green
 
-This module provides three implementations of the message queue protocol:
+This module provides five implementations of the message queue protocol:
 1. Azure Service Bus (AzureServiceBusProtocol)
 2. RabbitMQ (RabbitMQProtocol)
-3. In-Process Queue (InProcessMQProtocol)
+3. Redis pub/sub (RedisMQProtocol), selected with MQ_PROTOCOL=redis
+4. Unix socket router (UnixSocketMQProtocol), broker-less across processes on one host, selected with MQ_PROTOCOL=unix
+5. In-Process Queue (InProcessMQProtocol), shared by all sessions in the process
 
-The implementation can be selected in two ways:
+The implementation is selected at server startup by `await select_mq_protocol()`
+(ChatServer.run calls it; importing this module does not touch any broker):
 
 1. Explicitly via environment variable:
-    Set MQ_PROTOCOL to one of: 'azure', 'rabbitmq', or 'inprocess'
+    Set MQ_PROTOCOL to one of: 'azure', 'rabbitmq', 'redis', 'unix', or 'inprocess'
     If set, the specified implementation will be used and will raise an exception if it fails.
 
 2. Auto-detection (default when MQ_PROTOCOL is not set):
-    - First tries Azure Service Bus if AZURE_SERVICEBUS_CONNECTION_STRING is set
-    - Then tries RabbitMQ if available
+    - Azure Service Bus (if AZURE_SERVICEBUS_CONNECTION_STRING is set) and RabbitMQ are
+      probed in parallel with a short timeout; Azure is preferred, then RabbitMQ
     - Falls back to InProcess implementation
+    - The result is cached on disk, so the next start within MQ_DETECT_CACHE_TTL skips probing
 
 Required environment variables:
-- MQ_PROTOCOL (optional): Force a specific implementation ('azure'|'rabbitmq'|'inprocess')
+- MQ_PROTOCOL (optional): Force a specific implementation ('azure'|'rabbitmq'|'redis'|'unix'|'inprocess')
+- MQ_UNIX_SOCKET (optional): socket path for the unix socket router (default per user and MQ_APP_NAME, in $XDG_RUNTIME_DIR or the temp dir)
+- REDIS_URL (optional, defaults to 'redis://localhost:6379/0'): server for the Redis implementation
+- MQ_PROBE_TIMEOUT (optional, default 1.0): seconds per broker probe
+- MQ_CONNECT_ATTEMPTS (optional, default 3): probes of a backend forced by MQ_PROTOCOL, 1s apart, before giving up
+- MQ_DETECT_CACHE, MQ_DETECT_CACHE_TTL (optional): detection cache file (default per user and MQ_APP_NAME, in a private temp dir) and lifetime (default 300s)
 - AZURE_SERVICEBUS_CONNECTION_STRING (required for Azure implementation)
 - RABBITMQ_HOST (optional, defaults to 'localhost')
 - RABBITMQ_PORT (optional, defaults to 5672)
+- MQ_RABBIT_PUBLISH_CHANNELS, MQ_RABBIT_CONSUMER_CHANNELS (optional, default 2 and 4): channels in the process-wide RabbitMQ pool
+- MQ_PUBLISH_CONFIRMS (optional, default off): wait for RabbitMQ publisher confirms
+- MQ_PUBLISH_BATCH (optional, default 256): max messages per publish flush
+- MQ_PREFETCH (optional, default 32): RabbitMQ unacked messages per session consumer
+- MQ_CONCURRENCY (optional, default 8): messages a session handles concurrently
+- MQ_ORDER_KEY (optional, default 'author'): messages on a channel with the same value of this field are handled in order
+- MQ_AZURE_SENDER_IDLE (optional, default 300): seconds before an unused Azure sender is closed
+- MQ_AZURE_PREFETCH, MQ_AZURE_RECEIVE_BATCH (optional, default 20): Azure receiver prefetch and receive batch size
+- MQ_SHARED_CHANNELS (optional, defaults to 'broadcast'): comma separated channels received once per process and fanned out to local sessions
+- MQ_HISTORY_CHANNELS, MQ_HISTORY_SIZE, MQ_HISTORY_URL (optional, default off): channels that keep their last messages for late joiners, see mq_history
+- METRICS_PATH (optional, default off, e.g. '/metrics'): unauthenticated http endpoint for the MQ metrics of the process (of one worker under prefork), see mq_metrics
+- MQ_DEDUP_SIZE, MQ_DEDUP_TTL (optional, default 4096 and 300s): ids remembered per subscriber to drop redelivered messages, see mq_dedup
+- MQ_REQUEST_TIMEOUT (optional, default 10): seconds `request('mq', ...)` waits for a reply, see mq_rpc
+- MQ_CLAIM_CHECK_BYTES (optional, default 0 = off): larger messages are stored in the blob store (MQ_BLOB_DIR, which every receiver must be able to read) and sent as a reference, see mq_blobs
 
 Example:
-    # Auto-detect implementation:
-    from agi_green.protocol_mq import MQProtocol
+    # Auto-detect implementation (inside the server's event loop):
+    from agi_green.protocol_mq import select_mq_protocol
+    MQProtocol = await select_mq_protocol()
 
     # Or force specific implementation:
     # export MQ_PROTOCOL=azure
@@ -37,10 +61,14 @@ from typing import Callable, Awaitable, Dict, Any, List, Set, Union, Tuple
 from logging import getLogger, Logger
 import json
 import logging
-from queue import Queue, Empty
 from os.path import exists
 import asyncio
 import abc
+import time
+import zlib
+import hashlib
+import weakref
+from collections import defaultdict, deque
 
 try:
     import aio_pika
@@ -49,6 +77,18 @@ except ImportError:
     RABBITMQ_AVAILABLE = False
 
 from agi_green.dispatcher import Protocol, format_call, protocol_handler
+from agi_green.mq_hub import get_hub, FanoutHub
+from agi_green.mq_router import RouterClient, get_router_client, MQ_UNIX_SOCKET, MQ_APP_NAME
+from agi_green.mq_outbox import Outbox
+from agi_green.mq_blobs import claim_check, CLAIM_KEY
+from agi_green.mq_history import ChannelHistory, get_history, history_enabled, SEQ_KEY
+from agi_green.mq_metrics import mq_metrics, mq_control_stats, TS_KEY
+from agi_green.mq_dedup import DedupWindow, new_message_id, ID_KEY
+from agi_green.mq_rpc import get_reply_router, REPLY_TO_KEY, CORRELATION_KEY, REPLY_CMD
+from agi_green.utils import private_dir, user_tmp_path
+
+# added by AbstractMQProtocol.envelope and request, removed by deliver
+ENVELOPE_KEYS = (ID_KEY, TS_KEY, SEQ_KEY, REPLY_TO_KEY, CORRELATION_KEY)
 
 # Add to existing imports, wrapped in try/except to handle when Azure SDK isn't installed
 try:
@@ -59,14 +99,53 @@ try:
 except ImportError:
     AZURE_AVAILABLE = False
 
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
 here = dirname(__file__)
 logger = logging.getLogger(__name__)
 log_level = os.getenv('LOG_LEVEL', 'WARNING').upper()
 logging.basicConfig(level=log_level)
 
+# Channels shared by many sessions: one upstream subscription per process, fanned out locally (see mq_hub)
+MQ_SHARED_CHANNELS = {c.strip() for c in os.getenv('MQ_SHARED_CHANNELS', 'broadcast').split(',') if c.strip()}
+
+# RabbitMQ connection pool (shared by every RabbitMQProtocol in the process)
+MQ_RABBIT_PUBLISH_CHANNELS = int(os.getenv('MQ_RABBIT_PUBLISH_CHANNELS', 2))
+MQ_RABBIT_CONSUMER_CHANNELS = int(os.getenv('MQ_RABBIT_CONSUMER_CHANNELS', 4))
+MQ_PUBLISH_CONFIRMS = os.getenv('MQ_PUBLISH_CONFIRMS', '0').lower() in ('1', 'true', 'yes', 'on')
+MQ_PUBLISH_BATCH = int(os.getenv('MQ_PUBLISH_BATCH', 256))
+MQ_PREFETCH = int(os.getenv('MQ_PREFETCH', 32)) # unacked messages per consumer
+MQ_CONCURRENCY = int(os.getenv('MQ_CONCURRENCY', 8)) # messages handled concurrently per session consumer
+MQ_ORDER_KEY = os.getenv('MQ_ORDER_KEY', 'author') # messages with the same value (per channel) are handled in order
+
+# Azure Service Bus sender pool and receivers
+MQ_AZURE_SENDER_IDLE = float(os.getenv('MQ_AZURE_SENDER_IDLE', 300)) # seconds before an unused sender is closed
+MQ_AZURE_PREFETCH = int(os.getenv('MQ_AZURE_PREFETCH', 20)) # receiver prefetch_count
+MQ_AZURE_RECEIVE_BATCH = int(os.getenv('MQ_AZURE_RECEIVE_BATCH', 20)) # max messages per receive call
+
+# Redis pub/sub
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+# Backend selection (see select_mq_protocol)
+MQ_PROBE_TIMEOUT = float(os.getenv('MQ_PROBE_TIMEOUT', 1.0)) # seconds per connection probe
+MQ_CONNECT_ATTEMPTS = int(os.getenv('MQ_CONNECT_ATTEMPTS', 3)) # probes of a forced backend (MQ_PROTOCOL) before giving up
+MQ_CONNECT_RETRY_DELAY = 1.0 # seconds between probes of a forced backend
+MQ_DETECT_CACHE_DIR = user_tmp_path('agi_green')
+MQ_DETECT_CACHE = os.getenv('MQ_DETECT_CACHE') or join(MQ_DETECT_CACHE_DIR, f'mq-backend-{MQ_APP_NAME}.json')
+MQ_DETECT_CACHE_TTL = float(os.getenv('MQ_DETECT_CACHE_TTL', 300)) # seconds a cached auto-detect result is trusted
+
 # Add connection test caching
 _connection_test_results = {}
 
+def _forget_failed_probes():
+    """Drop cached probe failures, so the next probe tries the broker again"""
+    for key in [k for k, ok in _connection_test_results.items() if not ok]:
+        del _connection_test_results[key]
+
 async def _test_azure_connection(connection_string: str = None, raise_errors: bool = False) -> bool:
     """Test Azure Service Bus connection with caching"""
     if not AZURE_AVAILABLE:
@@ -81,33 +160,22 @@ async def _test_azure_connection(connection_string: str = None, raise_errors: bo
         return False
 
     cache_key = f"azure:{connection_string}"
-    if cache_key in _connection_test_results:
-        if not _connection_test_results[cache_key] and raise_errors:
-            raise ConnectionError("Could not connect to Azure Service Bus")
-        return _connection_test_results[cache_key]
-
-    try:
-        client = AsyncServiceBusClient.from_connection_string(connection_string)
-        async with client:
-            for attempt in range(3):
-                try:
-                    # Try to get a list of queues or perform a simple operation
-                    _connection_test_results[cache_key] = True
-                    return True
-                except Exception as e:
-                    if attempt == 2:  # Last attempt
-                        logger.debug(f"Azure Service Bus connection test failed: {e}")
-                    await asyncio.sleep(1)
-    except Exception as e:
-        logger.debug(f"Azure Service Bus connection test failed: {e}")
-
-    _connection_test_results[cache_key] = False
-    if raise_errors:
+    if cache_key not in _connection_test_results:
+        try:
+            client = AsyncServiceBusClient.from_connection_string(connection_string)
+            async with client:
+                pass
+            _connection_test_results[cache_key] = True
+        except Exception as e:
+            logger.debug(f"Azure Service Bus connection test failed: {e}")
+            _connection_test_results[cache_key] = False
+
+    if not _connection_test_results[cache_key] and raise_errors:
         raise ConnectionError("Could not connect to Azure Service Bus")
-    return False
+    return _connection_test_results[cache_key]
 
 async def _test_rabbitmq_connection(host: str = None, port: int = None, raise_errors: bool = False) -> bool:
-    """Test RabbitMQ connection with caching"""
+    """Test RabbitMQ connection with caching (one attempt, MQ_PROBE_TIMEOUT)"""
     if not RABBITMQ_AVAILABLE:
         if raise_errors:
             raise ImportError("aio_pika package not installed")
@@ -117,29 +185,18 @@ async def _test_rabbitmq_connection(host: str = None, port: int = None, raise_er
     port = port or int(os.getenv('RABBITMQ_PORT', '5672'))
 
     cache_key = f"rabbitmq:{host}:{port}"
-    if cache_key in _connection_test_results:
-        if not _connection_test_results[cache_key] and raise_errors:
-            raise ConnectionError(f"Could not connect to RabbitMQ at {host}:{port}")
-        return _connection_test_results[cache_key]
-
-    try:
-        for attempt in range(3):
-            try:
-                connection = await aio_pika.connect_robust(host=host, port=port)
-                await connection.close()
-                _connection_test_results[cache_key] = True
-                return True
-            except Exception as e:
-                if attempt == 2:  # Last attempt
-                    logger.debug(f"RabbitMQ connection test failed: {e}")
-                await asyncio.sleep(1)
-    except Exception as e:
-        logger.debug(f"RabbitMQ connection test failed: {e}")
-
-    _connection_test_results[cache_key] = False
-    if raise_errors:
+    if cache_key not in _connection_test_results:
+        try:
+            connection = await aio_pika.connect(host=host, port=port, timeout=MQ_PROBE_TIMEOUT)
+            await connection.close()
+            _connection_test_results[cache_key] = True
+        except Exception as e:
+            logger.debug(f"RabbitMQ connection test failed: {e}")
+            _connection_test_results[cache_key] = False
+
+    if not _connection_test_results[cache_key] and raise_errors:
         raise ConnectionError(f"Could not connect to RabbitMQ at {host}:{port}")
-    return False
+    return _connection_test_results[cache_key]
 
 class AbstractMQProtocol(Protocol, abc.ABC):
     """Abstract base class for message queue protocols"""
@@ -152,8 +209,12 @@ class AbstractMQProtocol(Protocol, abc.ABC):
         self.port = port
         self.connected = False
         self.queues: Dict[str, Any] = {}
-        self.offline_queue: Queue = Queue()
-        self.offline_subscription_queue: Queue = Queue()
+        self.outbox = Outbox() # messages and subscriptions waiting for a connection
+        self.shared_channels: Dict[str, str] = {} # full channel id => channel id, for channels joined via the fan-out hub
+        self.fanout_hub: FanoutHub = None # set on the hub's own upstream instance
+        self.history_seq: Dict[str, int] = {} # channel id => sequence number of the last message received, for channels with history
+        self.dedup = DedupWindow() # ids of recently received messages
+        mq_metrics.register(self)
 
     @abc.abstractmethod
     async def run(self):
@@ -163,6 +224,7 @@ class AbstractMQProtocol(Protocol, abc.ABC):
     @abc.abstractmethod
     async def close(self):
         """Close all connections and clean up"""
+        self.outbox.clear()
         await super().close()
 
     @abc.abstractmethod
@@ -185,6 +247,152 @@ class AbstractMQProtocol(Protocol, abc.ABC):
         """Send a message to a channel"""
         pass
 
+    async def replay_outbox(self):
+        """Send what was queued while offline: subscriptions, then messages in batches
+
+        Each batch is sent concurrently so the backend can pack it into one flush. Messages
+        that fail again are queued again for the next replay.
+        """
+        await asyncio.gather(*[self.subscribe(channel_id) for channel_id in self.outbox.pop_subscriptions()])
+        async for batch in self.outbox.replay():
+            await asyncio.gather(*[self.do_send(cmd, channel, **kwargs) for cmd, channel, kwargs in batch])
+
+    async def encode(self, cmd: str, kwargs: Dict[str, Any]) -> str:
+        """JSON body for the broker; payloads over MQ_CLAIM_CHECK_BYTES are replaced by a blob reference"""
+        return await claim_check.encode(dict(kwargs, cmd=cmd))
+
+    def history_store(self) -> ChannelHistory:
+        """Where channel history is kept (see mq_history)"""
+        return get_history()
+
+    async def envelope(self, cmd: str, channel: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Stamp an outgoing message about to be published: id, send time, history sequence number"""
+        if ID_KEY not in kwargs: # a retry from the outbox keeps its original id and send time
+            kwargs = dict(kwargs, **{ID_KEY: new_message_id(), TS_KEY: time.time()})
+        return await self.record_history(cmd, channel, kwargs)
+
+    async def do_request(self, cmd: str, channel: str, timeout: float = None, **kwargs) -> Any:
+        """Send a message to a channel and return the first reply (see mq_rpc)
+
+        Raises asyncio.TimeoutError if no subscriber answers within timeout (default MQ_REQUEST_TIMEOUT).
+        """
+        router = get_reply_router(type(self), **self.hub_kwargs())
+        return await router.request(self, cmd, channel, timeout=timeout, **kwargs)
+
+    def handles(self, cmd: str) -> bool:
+        """True if this session has a handler for an mq command"""
+        return bool(self.dispatcher.registered_methods.get(self.protocol_id, {}).get(cmd))
+
+    async def answer(self, channel_id: str, reply_to: str, correlation_id: str, cmd: str, results: list):
+        """Reply to a request received on channel_id with the first non-None handler response,
+        unless no local session handles cmd
+        """
+        sessions = list(self.fanout_hub.members.get(channel_id, ())) if self.fanout_hub is not None else [self]
+        if not any(s.handles(cmd) for s in sessions):
+            return
+        result = next((r for r in results if r is not None), None)
+        await self.do_send(REPLY_CMD, reply_to, correlation_id=correlation_id, result=result)
+
+    def listener_count(self) -> int:
+        """Running listener tasks (for metrics)"""
+        return len(self.running_tasks)
+
+    async def record_history(self, cmd: str, channel: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Record an outgoing message if its channel keeps history; returns kwargs numbered with its sequence number"""
+        if SEQ_KEY in kwargs or not history_enabled(channel.split(':', 1)[-1]):
+            return kwargs # not kept, or already recorded (a retry from the outbox)
+        seq = await self.history_store().append(self.get_full_channel_id(channel), dict(kwargs, cmd=cmd))
+        return dict(kwargs, **{SEQ_KEY: seq})
+
+    async def history(self, channel_id: str, last: int = None, since: int = None) -> List[Dict[str, Any]]:
+        """Recent messages of a channel: the last `last` and/or those after sequence number `since`, oldest first"""
+        entries = await self.history_store().read(self.get_full_channel_id(channel_id), last=last, since=since)
+        return [dict(message, **{SEQ_KEY: seq}) for seq, message in entries]
+
+    async def replay_history(self, channel_id: str, since: int = None) -> int:
+        """Deliver the messages of channel_id this session missed (after sequence number `since`, default
+        the last message received) to its handlers, as if they had just arrived. Handlers act on them, so
+        this is for catching up after a gap; to show history (e.g. in a new socket) read history() instead.
+        Returns the number of messages replayed.
+        """
+        if since is None:
+            since = self.history_seq.get(channel_id, 0)
+        messages = await self.history(channel_id, since=since)
+        for message in messages:
+            self.history_seq[channel_id] = message.pop(SEQ_KEY)
+            await self.handle_mesg(channel_id=channel_id, **message)
+        return len(messages)
+
+    def hub_kwargs(self) -> Dict[str, Any]:
+        """Connection settings for this backend, used to create the fan-out hub's upstream instance"""
+        return {'host': self.host, 'port': self.port}
+
+    async def join_shared(self, channel_id: str) -> bool:
+        """Join a shared channel through the process fan-out hub. Returns False if channel_id is not shared."""
+        if self.fanout_hub is not None or channel_id not in MQ_SHARED_CHANNELS:
+            return False
+
+        full_channel_id = self.get_full_channel_id(channel_id)
+        if full_channel_id not in self.shared_channels:
+            self.shared_channels[full_channel_id] = channel_id
+            await get_hub(type(self), **self.hub_kwargs()).join(full_channel_id, self)
+        return True
+
+    async def leave_shared(self, channel_id: str) -> bool:
+        """Leave a shared channel. Returns False if channel_id was not joined through the hub."""
+        full_channel_id = self.get_full_channel_id(channel_id)
+        if self.shared_channels.pop(full_channel_id, None) is None:
+            return False
+
+        await get_hub(type(self), **self.hub_kwargs()).leave(full_channel_id, self)
+        return True
+
+    async def leave_all_shared(self):
+        for full_channel_id in list(self.shared_channels):
+            await self.leave_shared(full_channel_id)
+
+    async def deliver(self, channel_id: str, data: dict):
+        """Dispatch a received message (on the hub upstream: fan out to the local subscribers)"""
+        if CLAIM_KEY in data:
+            try:
+                data = await claim_check.resolve(data)
+            except KeyError:
+                logger.error(f'mq message on {channel_id} refers to missing blob {data[CLAIM_KEY]}, dropped')
+                mq_metrics.on_deliver_failed(channel_id)
+                return
+
+        message_id = data.get(ID_KEY)
+        if message_id is not None:
+            duplicate = self.dedup.seen(message_id)
+            mq_metrics.on_dedup(channel_id, duplicate)
+            if duplicate:
+                return # redelivered (broker reconnect, at-least-once delivery or an outbox retry)
+
+        # handlers don't see the envelope fields (the message dict may be shared, so copy rather than pop)
+        sent = data.get(TS_KEY)
+        seq = data.get(SEQ_KEY)
+        reply_to = data.get(REPLY_TO_KEY)
+        correlation_id = data.get(CORRELATION_KEY)
+        if message_id is not None or sent is not None or seq is not None or reply_to is not None:
+            data = {k: v for k, v in data.items() if k not in ENVELOPE_KEYS}
+        mq_metrics.on_deliver(channel_id, sent)
+
+        if seq is not None:
+            # the last sequence number per channel is kept for replay_history
+            if self.fanout_hub is not None:
+                for member in self.fanout_hub.members.get(channel_id, ()):
+                    member.history_seq[member.shared_channels[channel_id]] = seq
+            else:
+                self.history_seq[channel_id] = seq
+
+        if self.fanout_hub is not None:
+            results = await self.fanout_hub.dispatch(channel_id, data)
+        else:
+            results = [await self.handle_mesg(channel_id=channel_id, **data)]
+
+        if reply_to is not None:
+            await self.answer(channel_id, reply_to, correlation_id, data.get('cmd'), results)
+
     def get_full_channel_id(self, channel_id: str) -> str:
         """Get the full channel ID including subdomain"""
         if ':' in channel_id:
@@ -196,155 +404,436 @@ class AbstractMQProtocol(Protocol, abc.ABC):
         return f"{subdomain}:{channel_id}"
 
 
+class ConcurrencyWindow:
+    """Run handlers concurrently, at most `limit` at a time, preserving order per key
+
+    submit() waits for a free slot (so a consumer naturally applies backpressure) and
+    starts the handler as a task. A handler whose key matches one still in flight waits
+    for it to finish first, so messages with the same key are handled in arrival order.
+    """
+
+    def __init__(self, limit: int = MQ_CONCURRENCY):
+        self.limit = max(1, limit)
+        self._slots = asyncio.Semaphore(self.limit)
+        self._tails: Dict[Any, asyncio.Task] = {} # key => last task submitted with that key
+        self.tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, key: Any, handler: Callable[[], Awaitable]) -> asyncio.Task:
+        await self._slots.acquire()
+        previous = self._tails.get(key)
+        task = asyncio.create_task(self._run(key, previous, handler))
+        self._tails[key] = task
+        self.tasks.add(task)
+        return task
+
+    async def _run(self, key, previous: asyncio.Task, handler):
+        try:
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+            await handler()
+        finally:
+            self._slots.release()
+            self.tasks.discard(asyncio.current_task())
+            if self._tails.get(key) is asyncio.current_task():
+                del self._tails[key]
+
+    async def drain(self):
+        """Wait for everything in flight"""
+        await asyncio.gather(*list(self.tasks), return_exceptions=True)
+
+    async def cancel(self):
+        for task in list(self.tasks):
+            task.cancel()
+        await self.drain()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.tasks)
+
+
+class RabbitMQPool:
+    """Process-wide RabbitMQ connection with pooled channels, shared by all sessions
+
+    - one robust connection per (event loop, host, port)
+    - consumer channels are handed out round robin; each session declares its own queue on one
+    - publishes are queued and flushed once per loop tick: everything published in the same
+      tick goes out together, and with publisher confirms the whole batch is confirmed in one
+      round trip
+    - each routing key always goes out on the same publish channel (by hash), so messages to a
+      channel keep their order across batches, with or without confirms
+    - publish latency (queued -> written, or -> confirmed) is tracked in stats()
+    """
+
+    def __init__(self, host: str, port: int = 5672, publish_channels: int = MQ_RABBIT_PUBLISH_CHANNELS,
+                 consumer_channels: int = MQ_RABBIT_CONSUMER_CHANNELS, confirms: bool = MQ_PUBLISH_CONFIRMS,
+                 batch: int = MQ_PUBLISH_BATCH, prefetch: int = MQ_PREFETCH):
+        self.host = host
+        self.port = port
+        self.n_publish_channels = max(1, publish_channels)
+        self.n_consumer_channels = max(1, consumer_channels)
+        self.confirms = confirms
+        self.batch = max(1, batch)
+        self.prefetch = max(1, prefetch)
+        self.connection: aio_pika.Connection = None
+        self.exchanges: List[aio_pika.Exchange] = [] # 'agi.green' exchange on each publish channel
+        self.consumer_channels: List[aio_pika.Channel] = []
+        self._next_consumer = 0
+        self._pending: deque = deque() # (routing key, body, queued time, future)
+        self._flush_task: asyncio.Task = None
+        self._lock = asyncio.Lock()
+        self.online = False
+        self.reconnect_listeners: 'weakref.WeakSet[RabbitMQProtocol]' = weakref.WeakSet() # replay their outbox on reconnect
+        self._replay_tasks: Set[asyncio.Task] = set() # outbox replays started by _on_reconnect
+        # metrics
+        self.published = 0
+        self.failed = 0
+        self.batches = 0
+        self.latencies: deque = deque(maxlen=1024) # recent publish latencies (seconds)
+        self.max_latency = 0.0
+
+    async def connect(self):
+        async with self._lock:
+            if self.connection is not None:
+                return
+            logger.info(f'Connecting to RabbitMQ on {self.host}:{self.port}')
+            connection = await aio_pika.connect_robust(host=self.host, port=self.port)
+            for _ in range(self.n_publish_channels):
+                channel = await connection.channel(publisher_confirms=self.confirms)
+                self.exchanges.append(await channel.declare_exchange('agi.green', aio_pika.ExchangeType.DIRECT))
+            for _ in range(self.n_consumer_channels):
+                channel = await connection.channel(publisher_confirms=False)
+                # per consumer (not channel-wide) limit, so sessions sharing a channel don't starve each other
+                await channel.set_qos(prefetch_count=self.prefetch, global_=False)
+                self.consumer_channels.append(channel)
+            connection.close_callbacks.add(self._on_connection_lost)
+            connection.reconnect_callbacks.add(self._on_reconnect)
+            self.connection = connection
+            self.online = True
+            logger.info(f'Connected to RabbitMQ on {self.host}:{self.port} '
+                        f'({self.n_publish_channels} publish, {self.n_consumer_channels} consumer channels, confirms={self.confirms})')
+
+    def _on_connection_lost(self, connection, exc=None):
+        if self.online:
+            logger.warning(f'RabbitMQ connection to {self.host}:{self.port} lost: {exc}')
+        self.online = False
+
+    def _on_reconnect(self, connection):
+        logger.info(f'RabbitMQ connection to {self.host}:{self.port} restored')
+        self.online = True
+        for protocol in list(self.reconnect_listeners):
+            task = asyncio.create_task(protocol.replay_outbox())
+            self._replay_tasks.add(task)
+            task.add_done_callback(self._replay_done)
+
+    def _replay_done(self, task: asyncio.Task):
+        self._replay_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f'outbox replay after reconnect failed: {task.exception()}')
+
+    def publish_exchange(self, routing_key: str) -> aio_pika.Exchange:
+        """The exchange (publish channel) for a routing key; RabbitMQ only orders messages within a channel"""
+        return self.exchanges[zlib.crc32(routing_key.encode()) % len(self.exchanges)]
+
+    def consumer_channel(self):
+        channel = self.consumer_channels[self._next_consumer % len(self.consumer_channels)]
+        self._next_consumer += 1
+        return channel
+
+    def publish(self, routing_key: str, body: bytes) -> asyncio.Future:
+        """Queue a message for the next flush. The returned future resolves once it is written (or confirmed)"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((routing_key, body, time.perf_counter(), future))
+        if self._flush_task is None:
+            self._flush_task = loop.create_task(self._flush())
+        return future
+
+    async def _flush(self):
+        try:
+            while self._pending:
+                n = min(len(self._pending), self.batch)
+                batch = [self._pending.popleft() for _ in range(n)]
+                results = await asyncio.gather(
+                    *[self.publish_exchange(key).publish(aio_pika.Message(body=body), routing_key=key) for key, body, _, _ in batch],
+                    return_exceptions=True)
+                self.batches += 1
+                now = time.perf_counter()
+                for (key, _, queued, future), result in zip(batch, results):
+                    if isinstance(result, BaseException):
+                        self.failed += 1
+                        if not future.done():
+                            future.set_exception(result)
+                        continue
+                    latency = now - queued
+                    self.published += 1
+                    self.latencies.append(latency)
+                    self.max_latency = max(self.max_latency, latency)
+                    if not future.done():
+                        future.set_result(None)
+        finally:
+            self._flush_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Publish counters and latency percentiles (ms) over the most recent publishes"""
+        recent = sorted(self.latencies)
+
+        def percentile(p):
+            return round(recent[min(len(recent) - 1, int(p * len(recent)))] * 1000, 3) if recent else None
+
+        return {
+            'published': self.published,
+            'failed': self.failed,
+            'batches': self.batches,
+            'mean_batch': round(self.published / self.batches, 2) if self.batches else None,
+            'pending': len(self._pending),
+            'confirms': self.confirms,
+            'latency_p50_ms': percentile(0.5),
+            'latency_p99_ms': percentile(0.99),
+            'latency_max_ms': round(self.max_latency * 1000, 3),
+        }
+
+    async def close(self):
+        for task in list(self._replay_tasks):
+            task.cancel()
+        await asyncio.gather(*self._replay_tasks, return_exceptions=True)
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
+        self.exchanges.clear()
+        self.consumer_channels.clear()
+
+
+_rabbitmq_pools: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, int], RabbitMQPool]]' = weakref.WeakKeyDictionary()
+
+async def get_rabbitmq_pool(host: str, port: int = 5672) -> RabbitMQPool:
+    """The connected process-wide pool (per event loop) for a RabbitMQ server"""
+    pools = _rabbitmq_pools.setdefault(asyncio.get_running_loop(), {})
+    pool = pools.get((host, port))
+    if pool is None:
+        pool = pools[(host, port)] = RabbitMQPool(host, port)
+    await pool.connect()
+    return pool
+
+
 class RabbitMQProtocol(AbstractMQProtocol):
-    '''RabbitMQ broadcast protocol'''
+    '''RabbitMQ broadcast protocol
+
+    Each session has a single exclusive queue and one consumer task. Subscribing to a
+    channel adds a binding (routing key = full channel id) to that queue, and incoming
+    messages are demultiplexed locally by their routing key.
+
+    The connection and channels come from the process-wide RabbitMQPool; a session only
+    owns its queue and consumer.
+    '''
 
     def __init__(self, parent: Protocol, host: str, port: int = 5672, **kwargs):
         super().__init__(parent, host, port, **kwargs)
-        self.connection: aio_pika.Connection = None
+        self.pool: RabbitMQPool = None
         self.channel: aio_pika.Channel = None
         self.exchange: aio_pika.Exchange = None
-        # Note: queues, offline_queue, and offline_subscription_queue are now inherited
-        # Track listening tasks per channel for proper cleanup
-        self._listening_tasks: Dict[str, asyncio.Task] = {}
+        self.queue: aio_pika.Queue = None
+        # Note: queues (full channel id => channel id) and outbox are inherited
+        self._consumer_task: asyncio.Task = None
+        self.window = ConcurrencyWindow(MQ_CONCURRENCY)
 
     async def run(self):
         await super().run()
 
         try:
-            logger.info(f'Connecting to RabbitMQ on {self.host}:{self.port}')
-            self.connection = await aio_pika.connect_robust(host=self.host, port=self.port)
+            self.pool = await get_rabbitmq_pool(self.host, self.port)
         except aio_pika.AMQPException as e:
             logger.error(f"RabbitMQ connection failed: {e}")
             await self.send('ws', 'append_chat', author='info', content=f'We got an unexpected error.\n\nRabbitMQ connection failed: {e}')
             return
 
-        self.channel = await self.connection.channel()
+        self.pool.reconnect_listeners.add(self)
+        self.channel = self.pool.consumer_channel()
         self.exchange = await self.channel.declare_exchange('agi.green', aio_pika.ExchangeType.DIRECT)
+        # the connection is shared, so the queue is deleted explicitly in close()
+        self.queue = await self.channel.declare_queue(exclusive=True, auto_delete=True)
+        self._consumer_task = asyncio.create_task(self.listen_to_queue(self.queue))
+        self.running_tasks.append(self._consumer_task)
+        self._consumer_task.add_done_callback(self.running_tasks.remove)
         self.connected = True
 
-        logger.info(f'Connected to RabbitMQ on {self.host}:{self.port}')
-
-        # Do any pending subscriptions
-        while not self.offline_subscription_queue.empty():
-            channel_id = self.offline_subscription_queue.get()
-            await self.subscribe(channel_id)
+        logger.info(f'Session queue {self.queue.name} on RabbitMQ {self.host}:{self.port}')
 
-        # Send any pending messages
-        while not self.offline_queue.empty():
-            cmd, ch, kwargs = self.offline_queue.get()
-            await self.do_send(cmd, ch, **kwargs)
+        # Do any pending subscriptions and send any pending messages
+        await self.replay_outbox()
 
 
     async def close(self):
         # Close the RabbitMQ channel and connection
         await self.unsubscribe_all()
 
-        if self.channel:
-            await self.channel.close()
-            await self.connection.close()
+        if self._consumer_task is not None:
+            self._consumer_task.cancel()
+            await asyncio.gather(self._consumer_task, return_exceptions=True)
+            self._consumer_task = None
+        await self.window.cancel()
+
+        # the pooled connection and channels stay open for other sessions
+        if self.queue is not None:
+            try:
+                await self.queue.delete(if_unused=False, if_empty=False)
+            except aio_pika.AMQPException as e:
+                logger.warning(f'deleting queue {self.queue.name} failed: {e}')
+            self.queue = None
+        self.connected = False
 
         # terminate
 
         await super().close()
 
-    async def listen_to_queue(self, channel_id, queue):
-        full_channel_id = self.get_full_channel_id(channel_id)
+    async def listen_to_queue(self, queue):
+        '''consume the session queue, dispatching each message to the channel it was routed by
+
+        Up to MQ_CONCURRENCY messages are handled at once (RabbitMQ delivers up to MQ_PREFETCH
+        ahead); messages on a channel with the same MQ_ORDER_KEY value are handled in order.
+        Each message is acked when its own handler finishes, or rejected if it raises.
+        '''
         try:
             async with queue.iterator() as queue_iter:
                 async for message in queue_iter:
-                    async with message.process():
+                    channel_id = self.queues.get(message.routing_key)
+                    if channel_id is None:
+                        # arrived after we unbound the channel
+                        await message.ack()
+                        continue
+                    try:
                         data = json.loads(message.body.decode())
-                        if data['cmd'] == 'unsubscribe':
-                            if data['sender_id'] == id(self):
-                                break
-                        else:
-                           await self.handle_mesg(channel_id=channel_id, **data)
+                    except ValueError as e:
+                        logger.error(f'invalid message on {message.routing_key}: {e}')
+                        await message.reject()
+                        continue
+                    key = (channel_id, data.get(MQ_ORDER_KEY))
+                    await self.window.submit(key, lambda m=message, c=channel_id, d=data: self.process_message(m, c, d))
         finally:
-            # Clean up data structures and task tracking
-            if full_channel_id in self.queues:
-                del self.queues[full_channel_id]
-            self._listening_tasks.pop(full_channel_id, None)
-            logger.info(f'{self.dispatcher.context.user.screen_name} unsubscribed from {full_channel_id}')
+            logger.info(f'{self.dispatcher.context.user.screen_name} stopped consuming {queue.name}')
+
+    async def process_message(self, message, channel_id: str, data: dict):
+        async with message.process(ignore_processed=True):
+            await self.deliver(channel_id, data)
 
     async def subscribe(self, channel_id: str):
+        if await self.join_shared(channel_id):
+            return
+
         if not self.connected:
-            self.offline_subscription_queue.put(channel_id)
+            self.outbox.add_subscription(channel_id)
             return
 
         full_channel_id = self.get_full_channel_id(channel_id)
 
-        # Check if a listening task already exists for this channel
+        # Check if a binding already exists for this channel
         if full_channel_id in self.queues:
-            logger.info(f'Already subscribed to {full_channel_id}, skipping duplicate task creation')
+            logger.info(f'Already subscribed to {full_channel_id}, skipping duplicate binding')
             return
 
-        queue = await self.channel.declare_queue(exclusive=True)
-        await queue.bind(self.exchange, routing_key=full_channel_id)
-        self.queues[full_channel_id] = queue
+        self.queues[full_channel_id] = channel_id
+        await self.queue.bind(self.exchange, routing_key=full_channel_id)
+        mq_control_stats['subscribe'] += 1
         logger.info(f'{self.dispatcher.context.user.screen_name} subscribed to {full_channel_id}')
 
-        # Create and track listening task for proper cleanup
-        task = asyncio.create_task(self.listen_to_queue(channel_id, queue))
-        self._listening_tasks[full_channel_id] = task
-        self.running_tasks.append(task)
-        task.add_done_callback(self.running_tasks.remove)
-
     async def unsubscribe(self, channel_id: str):
-        full_channel_id = self.get_full_channel_id(channel_id)
-
-        # Cancel the listening task first to stop the infinite loop
-        if full_channel_id in self._listening_tasks:
-            task = self._listening_tasks[full_channel_id]
-            if not task.done():
-                task.cancel()
-                try:
-                    await task
-                except asyncio.CancelledError:
-                    pass
-            # Remove from tracking (may already be removed by finally block)
-            self._listening_tasks.pop(full_channel_id, None)
+        if await self.leave_shared(channel_id) or self.outbox.remove_subscription(channel_id):
+            return
 
-        # Send unsubscribe message
-        await self.send('mq', 'unsubscribe', channel=full_channel_id, sender_id=id(self))
+        full_channel_id = self.get_full_channel_id(channel_id)
 
-        # Remove the queue if it exists
-        if full_channel_id in self.queues:
-            del self.queues[full_channel_id]
+        if self.queues.pop(full_channel_id, None) is None:
+            return
 
+        # Remove the binding; nothing needs to be published to the channel
+        try:
+            await self.queue.unbind(self.exchange, routing_key=full_channel_id)
+        except aio_pika.AMQPException as e:
+            logger.warning(f'unbind {full_channel_id} failed: {e}')
+        mq_control_stats['unsubscribe'] += 1
 
+        logger.info(f'{self.dispatcher.context.user.screen_name} unsubscribed from {full_channel_id}')
 
     async def unsubscribe_all(self):
         'unsubscribe to everything'
+        await self.leave_all_shared()
         for full_channel_id in list(self.queues.keys()):
-            channel_id = full_channel_id.split(':', 1)[1] if ':' in full_channel_id else full_channel_id
-            await self.unsubscribe(channel_id)
+            await self.unsubscribe(full_channel_id)
 
 
     async def do_send(self, cmd: str, channel: str, **kwargs):
         'broadcast message to RabbitMQ'
         if not self.connected:
-            self.offline_queue.put((cmd, channel, kwargs))
+            await self.outbox.put(cmd, channel, kwargs)
             return
 
-        kwargs['cmd'] = cmd
+        if not self.pool.online:
+            # broker outage: hold the message until the pool reconnects
+            await self.outbox.put(cmd, channel, kwargs)
+            return
+
+        kwargs = await self.envelope(cmd, channel, kwargs)
         full_channel = self.get_full_channel_id(channel)
+        body = (await self.encode(cmd, kwargs)).encode()
 
-        await self.exchange.publish(
-            aio_pika.Message(body=json.dumps(kwargs).encode()),
-            routing_key=full_channel  # We use routing key as full_channel for direct exchanges
-        )
+        # routing key is the full channel for direct exchanges; batched with other publishes in this tick
+        try:
+            await self.pool.publish(full_channel, body)
+        except (aio_pika.AMQPException, ConnectionError) as e:
+            logger.warning(f'publish to {full_channel} failed, queued for retry: {e}')
+            mq_metrics.on_publish_failed(channel)
+            await self.outbox.put(cmd, channel, kwargs)
+            return
+        mq_metrics.on_publish(channel, kwargs[TS_KEY])
+
+
+class InProcessBroker:
+    """Process-wide channel => subscriber index shared by every InProcessMQProtocol
+
+    Each subscription is an asyncio.Queue that its listener awaits, so delivery is
+    immediate and idle channels cost nothing. Because the index is shared, sessions in
+    the same process see each other's messages (e.g. on broadcast).
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+
+    def subscribe(self, full_channel_id: str, queue: asyncio.Queue):
+        self._subscribers[full_channel_id].add(queue)
+
+    def unsubscribe(self, full_channel_id: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(full_channel_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[full_channel_id]
+
+    def publish(self, full_channel_id: str, message: dict) -> int:
+        """Deliver message to every subscriber of the channel, return the number of subscribers"""
+        subscribers = self._subscribers.get(full_channel_id, ())
+        for queue in list(subscribers):
+            try:
+                queue.put_nowait(message)
+            except RuntimeError as e:
+                # subscriber's event loop is gone (e.g. a session that was never closed)
+                logger.warning(f'dropping dead subscriber on {full_channel_id}: {e}')
+                self.unsubscribe(full_channel_id, queue)
+        return len(subscribers)
+
+    def subscriber_count(self, full_channel_id: str) -> int:
+        return len(self._subscribers.get(full_channel_id, ()))
+
+
+_inprocess_broker = InProcessBroker()
 
 
 class InProcessMQProtocol(AbstractMQProtocol):
-    """In-process message queue implementation using Python's Queue"""
+    """In-process message queue implementation using a process-wide asyncio broker"""
 
     def __init__(self, parent: Protocol, **kwargs):
         super().__init__(parent, **kwargs)
-        self._subscribers: Dict[str, Set[Queue]] = {}
-        self._message_queues: Dict[str, Queue] = {}
-        # Get the event loop from asyncio instead of dispatcher
-        self._loop = asyncio.get_event_loop()
+        self.broker = _inprocess_broker
         # Track listening tasks per channel for proper cleanup
         self._listening_tasks: Dict[str, asyncio.Task] = {}
 
@@ -352,15 +841,8 @@ class InProcessMQProtocol(AbstractMQProtocol):
         await super().run()
         self.connected = True
 
-        # Process any pending subscriptions
-        while not self.offline_subscription_queue.empty():
-            channel_id = self.offline_subscription_queue.get()
-            await self.subscribe(channel_id)
-
-        # Send any pending messages
-        while not self.offline_queue.empty():
-            cmd, ch, kwargs = self.offline_queue.get()
-            await self.do_send(cmd, ch, **kwargs)
+        # Do any pending subscriptions and send any pending messages
+        await self.replay_outbox()
 
     async def close(self):
         await self.unsubscribe_all()
@@ -368,23 +850,24 @@ class InProcessMQProtocol(AbstractMQProtocol):
         await super().close()
 
     async def subscribe(self, channel_id: str):
+        if await self.join_shared(channel_id):
+            return
+
         if not self.connected:
-            self.offline_subscription_queue.put(channel_id)
+            self.outbox.add_subscription(channel_id)
             return
 
         full_channel_id = self.get_full_channel_id(channel_id)
 
         # Check if a listening task already exists for this channel
-        if full_channel_id in self._subscribers:
+        if full_channel_id in self.queues:
             logger.info(f'Already subscribed to {full_channel_id}, skipping duplicate task creation')
             return
 
-        self._subscribers[full_channel_id] = set()
-        self._message_queues[full_channel_id] = Queue()
-
-        queue = Queue()
-        self._subscribers[full_channel_id].add(queue)
+        queue = asyncio.Queue()
         self.queues[full_channel_id] = queue
+        mq_control_stats['subscribe'] += 1
+        self.broker.subscribe(full_channel_id, queue)
 
         # Create and track listening task for cleanup
         task = asyncio.create_task(self._listen_to_queue(channel_id, queue))
@@ -392,39 +875,30 @@ class InProcessMQProtocol(AbstractMQProtocol):
         self.running_tasks.append(task)
         task.add_done_callback(self.running_tasks.remove)
 
-    async def _listen_to_queue(self, channel_id: str, queue: Queue):
+    async def _listen_to_queue(self, channel_id: str, queue: asyncio.Queue):
         full_channel_id = self.get_full_channel_id(channel_id)
         try:
             while True:
+                data = await queue.get()
                 try:
-                    # Use non-blocking approach with timeout to allow cancellation
-                    data = None
-                    try:
-                        data = queue.get(block=False)  # Non-blocking get
-                    except Empty:
-                        # Queue is empty, wait a bit and check for cancellation
-                        await asyncio.sleep(0.1)
-                        continue
-
-                    if data.get('cmd') == 'unsubscribe' and data.get('sender_id') == id(self):
-                        break
-                    await self.handle_mesg(channel_id=channel_id, **data)
-                except asyncio.CancelledError:
-                    # Task was cancelled, exit gracefully
-                    break
+                    await self.deliver(channel_id, data)
                 except Exception as e:
                     logger.error(f"Error processing message: {e}")
-                    break
+        except asyncio.CancelledError:
+            # Task was cancelled, exit gracefully
+            pass
         finally:
             # Clean up task tracking when the listener exits
-            if full_channel_id in self._listening_tasks:
-                self._listening_tasks.pop(full_channel_id, None)
+            self._listening_tasks.pop(full_channel_id, None)
             logger.debug(f"Listening task for {full_channel_id} terminated")
 
     async def unsubscribe(self, channel_id: str):
+        if await self.leave_shared(channel_id) or self.outbox.remove_subscription(channel_id):
+            return
+
         full_channel_id = self.get_full_channel_id(channel_id)
 
-        # Cancel the listening task first to stop the infinite loop
+        # Cancel the listening task (no in-band unsubscribe message is needed)
         if full_channel_id in self._listening_tasks:
             task = self._listening_tasks[full_channel_id]
             if not task.done():
@@ -436,44 +910,544 @@ class InProcessMQProtocol(AbstractMQProtocol):
             # Remove from tracking (may already be removed by finally block)
             self._listening_tasks.pop(full_channel_id, None)
 
-        # Send unsubscribe message
-        await self.do_send('unsubscribe', channel_id, sender_id=id(self))
-
         # Clean up data structures
-        if full_channel_id in self._subscribers:
-            del self._subscribers[full_channel_id]
-        if full_channel_id in self._message_queues:
-            del self._message_queues[full_channel_id]
-        if full_channel_id in self.queues:
-            del self.queues[full_channel_id]
+        queue = self.queues.pop(full_channel_id, None)
+        if queue is not None:
+            self.broker.unsubscribe(full_channel_id, queue)
+            mq_control_stats['unsubscribe'] += 1
 
     async def unsubscribe_all(self):
-        for full_channel_id in list(self._subscribers.keys()):
+        await self.leave_all_shared()
+        for full_channel_id in list(self.queues.keys()):
             channel_id = full_channel_id.split(':', 1)[1] if ':' in full_channel_id else full_channel_id
             await self.unsubscribe(channel_id)
 
+    def listener_count(self) -> int:
+        return len(self.running_tasks) + len(self._listening_tasks)
+
     async def do_send(self, cmd: str, channel: str, **kwargs):
         if not self.connected:
-            self.offline_queue.put((cmd, channel, kwargs))
+            await self.outbox.put(cmd, channel, kwargs)
             return
 
+        kwargs = await self.envelope(cmd, channel, kwargs)
         kwargs['cmd'] = cmd
         full_channel = self.get_full_channel_id(channel)
+        self.broker.publish(full_channel, kwargs)
+        mq_metrics.on_publish(channel, kwargs[TS_KEY])
+
+
+class RedisPubSub:
+    """Process-wide Redis connection shared by every RedisMQProtocol
+
+    - one pub/sub connection per (event loop, url); each channel or pattern is subscribed
+      once however many local sessions listen to it, and messages are demultiplexed locally
+    - channels are always plain subscriptions, whatever characters their names contain;
+      pattern subscriptions (PSUBSCRIBE) are made explicitly with pattern=True
+    - publishes made in the same loop tick are sent in one pipeline round trip
+    """
+
+    def __init__(self, url: str = REDIS_URL):
+        self.url = url
+        self.client = aioredis.from_url(url)
+        self.pubsub = self.client.pubsub()
+        self.listeners: Dict[str, Set] = defaultdict(set) # channel => RedisMQProtocol
+        self.pattern_listeners: Dict[str, Set] = defaultdict(set) # pattern => RedisMQProtocol
+        self._lock = asyncio.Lock()
+        self._reader: asyncio.Task = None
+        self._pending: List[Tuple[str, str, asyncio.Future]] = []
+        self._flush_task: asyncio.Task = None
+        # metrics
+        self.published = 0
+        self.pipelines = 0
+
+    async def subscribe(self, channel: str, listener, pattern: bool = False):
+        async with self._lock:
+            listeners = self.pattern_listeners if pattern else self.listeners
+            first = not listeners[channel]
+            listeners[channel].add(listener)
+            if first:
+                if pattern:
+                    await self.pubsub.psubscribe(channel)
+                else:
+                    await self.pubsub.subscribe(channel)
+            if self._reader is None:
+                self._reader = asyncio.create_task(self._read())
+
+    async def unsubscribe(self, channel: str, listener, pattern: bool = False):
+        async with self._lock:
+            all_listeners = self.pattern_listeners if pattern else self.listeners
+            listeners = all_listeners.get(channel)
+            if listeners is None:
+                return
+            listeners.discard(listener)
+            if listeners:
+                return
+            del all_listeners[channel]
+            if pattern:
+                await self.pubsub.punsubscribe(channel)
+            else:
+                await self.pubsub.unsubscribe(channel)
+
+    async def _read(self):
+        while True:
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f'Redis pub/sub read failed: {e}')
+                await asyncio.sleep(1)
+                continue
+
+            if message is None:
+                continue
+
+            channel = _as_str(message['channel'])
+            pattern = message['type'] == 'pmessage'
+            key = _as_str(message['pattern']) if pattern else channel
+            try:
+                data = json.loads(message['data'])
+            except ValueError as e:
+                logger.error(f'invalid message on {channel}: {e}')
+                continue
+
+            listeners = self.pattern_listeners if pattern else self.listeners
+            for listener in list(listeners.get(key, ())):
+                listener.inbox.put_nowait((key, pattern, channel, data))
+
+    def publish(self, channel: str, body: str) -> asyncio.Future:
+        """Queue a message for the next pipeline flush; the returned future resolves once it is sent"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((channel, body, future))
+        if self._flush_task is None:
+            self._flush_task = loop.create_task(self._flush())
+        return future
+
+    async def _flush(self):
+        try:
+            while self._pending:
+                batch, self._pending = self._pending, []
+                try:
+                    async with self.client.pipeline(transaction=False) as pipe:
+                        for channel, body, _ in batch:
+                            pipe.publish(channel, body)
+                        await pipe.execute()
+                except Exception as e:
+                    logger.error(f'Redis publish failed: {e}')
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                self.published += len(batch)
+                self.pipelines += 1
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+        finally:
+            self._flush_task = None
+
+    async def close(self):
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        if self._reader is not None:
+            self._reader.cancel()
+            await asyncio.gather(self._reader, return_exceptions=True)
+            self._reader = None
+        await self.pubsub.aclose()
+        await self.client.aclose()
+
+
+def _as_str(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+_redis_connections: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, RedisPubSub]]' = weakref.WeakKeyDictionary()
+
+def get_redis_pubsub(url: str = REDIS_URL) -> RedisPubSub:
+    """The process-wide Redis pub/sub connection (per event loop) for url"""
+    connections = _redis_connections.setdefault(asyncio.get_running_loop(), {})
+    connection = connections.get(url)
+    if connection is None:
+        connection = connections[url] = RedisPubSub(url)
+    return connection
+
+
+class RedisMQProtocol(AbstractMQProtocol):
+    """Redis pub/sub implementation of the message queue protocol
+
+    Sessions share the process-wide RedisPubSub connection. subscribe() is always an exact
+    channel subscription, so channel ids built from user input (e.g. 'user.' + screen_name)
+    can't match other channels; psubscribe() subscribes to a glob pattern (e.g. 'user.*')
+    explicitly, and its messages are dispatched with the channel id they were published to.
+    Like pub/sub itself, delivery is at most once: messages published while nobody is
+    subscribed are not kept.
+    """
+
+    def __init__(self, parent: Protocol, url: str = None, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.url = url or REDIS_URL
+        self.redis: RedisPubSub = None
+        self.inbox: asyncio.Queue = asyncio.Queue() # (subscribed channel or pattern, is pattern, channel, data) from RedisPubSub
+        self.patterns: Dict[str, str] = {} # full pattern => pattern as given to psubscribe
+
+    async def run(self):
+        await super().run()
+
+        self.redis = get_redis_pubsub(self.url)
+        self.add_task(self._listen())
+        self.connected = True
+
+        # Do any pending subscriptions and send any pending messages
+        await self.replay_outbox()
+
+    async def close(self):
+        await self.unsubscribe_all()
+        self.connected = False
+        await super().close()
+
+    def hub_kwargs(self) -> Dict[str, Any]:
+        return {'url': self.url}
+
+    def history_store(self) -> ChannelHistory:
+        # shared by every process on the same server
+        return get_history(self.url)
+
+    async def _listen(self):
+        while True:
+            key, pattern, full_channel_id, data = await self.inbox.get()
+            if pattern:
+                if key not in self.patterns:
+                    continue # arrived after we unsubscribed
+                channel_id = full_channel_id.split(':', 1)[1] if ':' in full_channel_id else full_channel_id
+            else:
+                channel_id = self.queues.get(key)
+                if channel_id is None:
+                    continue # arrived after we unsubscribed
+            try:
+                await self.deliver(channel_id, data)
+            except Exception as e:
+                logger.error(f"Error processing message: {e}")
+
+    async def subscribe(self, channel_id: str):
+        if await self.join_shared(channel_id):
+            return
+
+        if not self.connected:
+            self.outbox.add_subscription(channel_id)
+            return
+
+        full_channel_id = self.get_full_channel_id(channel_id)
+        if full_channel_id in self.queues:
+            return
+
+        self.queues[full_channel_id] = channel_id
+        await self.redis.subscribe(full_channel_id, self)
+        mq_control_stats['subscribe'] += 1
+
+    async def unsubscribe(self, channel_id: str):
+        if await self.leave_shared(channel_id) or self.outbox.remove_subscription(channel_id):
+            return
+
+        full_channel_id = self.get_full_channel_id(channel_id)
+        if self.queues.pop(full_channel_id, None) is None:
+            return
+
+        await self.redis.unsubscribe(full_channel_id, self)
+        mq_control_stats['unsubscribe'] += 1
+
+    async def psubscribe(self, pattern: str):
+        """Subscribe to every channel matching a glob pattern (e.g. 'user.*'); requires run()
+
+        Only pass trusted patterns: don't build them from user input.
+        """
+        full_pattern = self.get_full_channel_id(pattern)
+        if full_pattern in self.patterns:
+            return
+        self.patterns[full_pattern] = pattern
+        await self.redis.subscribe(full_pattern, self, pattern=True)
+        mq_control_stats['subscribe'] += 1
+
+    async def punsubscribe(self, pattern: str):
+        full_pattern = self.get_full_channel_id(pattern)
+        if self.patterns.pop(full_pattern, None) is None:
+            return
+        await self.redis.unsubscribe(full_pattern, self, pattern=True)
+        mq_control_stats['unsubscribe'] += 1
+
+    async def unsubscribe_all(self):
+        await self.leave_all_shared()
+        for full_channel_id in list(self.queues.keys()):
+            await self.unsubscribe(full_channel_id)
+        for full_pattern in list(self.patterns):
+            await self.punsubscribe(full_pattern)
+
+    async def do_send(self, cmd: str, channel: str, **kwargs):
+        if not self.connected:
+            await self.outbox.put(cmd, channel, kwargs)
+            return
+
+        kwargs = await self.envelope(cmd, channel, kwargs)
+        full_channel = self.get_full_channel_id(channel)
+
+        # pipelined with other publishes in this tick
+        try:
+            await self.redis.publish(full_channel, await self.encode(cmd, kwargs))
+        except Exception:
+            mq_metrics.on_publish_failed(channel)
+            raise
+        mq_metrics.on_publish(channel, kwargs[TS_KEY])
+
+
+class UnixSocketMQProtocol(AbstractMQProtocol):
+    """Broker-less message queue for processes on one host, over a unix domain socket
+
+    Sessions share the process-wide RouterClient (see mq_router); the router itself is
+    embedded in whichever process claimed it first. Delivery is at most once, like pub/sub.
+    """
+
+    def __init__(self, parent: Protocol, path: str = None, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.path = path or MQ_UNIX_SOCKET
+        self.router: RouterClient = None
+        self.inbox: asyncio.Queue = asyncio.Queue() # (full channel id, body) from RouterClient
+
+    async def run(self):
+        await super().run()
+
+        try:
+            self.router = await get_router_client(self.path)
+        except ConnectionError as e:
+            logger.error(f"MQ router connection failed: {e}")
+            await self.send('ws', 'append_chat', author='info', content=f'We got an unexpected error.\n\nMQ router connection failed: {e}')
+            return
+
+        self.add_task(self._listen())
+        self.connected = True
+
+        # Do any pending subscriptions and send any pending messages
+        await self.replay_outbox()
+
+    async def close(self):
+        await self.unsubscribe_all()
+        self.connected = False
+        await super().close()
+
+    def hub_kwargs(self) -> Dict[str, Any]:
+        return {'path': self.path}
+
+    async def _listen(self):
+        while True:
+            full_channel_id, body = await self.inbox.get()
+            channel_id = self.queues.get(full_channel_id)
+            if channel_id is None:
+                continue # arrived after we unsubscribed
+            try:
+                await self.deliver(channel_id, json.loads(body))
+            except Exception as e:
+                logger.error(f"Error processing message: {e}")
 
-        if full_channel in self._subscribers:
-            message = kwargs
-            for queue in self._subscribers[full_channel]:
-                queue.put(message)
+    async def subscribe(self, channel_id: str):
+        if await self.join_shared(channel_id):
+            return
+
+        if not self.connected:
+            self.outbox.add_subscription(channel_id)
+            return
+
+        full_channel_id = self.get_full_channel_id(channel_id)
+        if full_channel_id not in self.queues:
+            self.queues[full_channel_id] = channel_id
+            self.router.subscribe(full_channel_id, self)
+            mq_control_stats['subscribe'] += 1
+
+    async def unsubscribe(self, channel_id: str):
+        if await self.leave_shared(channel_id) or self.outbox.remove_subscription(channel_id):
+            return
+
+        full_channel_id = self.get_full_channel_id(channel_id)
+        if self.queues.pop(full_channel_id, None) is not None:
+            self.router.unsubscribe(full_channel_id, self)
+            mq_control_stats['unsubscribe'] += 1
+
+    async def unsubscribe_all(self):
+        await self.leave_all_shared()
+        for full_channel_id in list(self.queues.keys()):
+            await self.unsubscribe(full_channel_id)
+
+    async def do_send(self, cmd: str, channel: str, **kwargs):
+        if not self.connected:
+            await self.outbox.put(cmd, channel, kwargs)
+            return
+
+        kwargs = await self.envelope(cmd, channel, kwargs)
+        body = (await self.encode(cmd, kwargs)).encode()
+        # buffered and written with the other frames of this tick
+        self.router.publish(self.get_full_channel_id(channel), body)
+        mq_metrics.on_publish(channel, kwargs[TS_KEY])
+
+
+class AzureSenderPool:
+    """Process-wide Azure Service Bus client with long-lived, batching queue senders
+
+    - one client per (event loop, connection string), shared by every session
+    - one sender per queue, kept open across sends and closed after MQ_AZURE_SENDER_IDLE
+      seconds without use
+    - messages sent in the same loop tick are grouped per queue into ServiceBusMessageBatch
+      sends (split when a batch is full)
+
+    client and message_class can be replaced by a local stand-in for testing.
+    """
+
+    def __init__(self, connection_string: str = None, client=None, message_class=None,
+                 idle_timeout: float = MQ_AZURE_SENDER_IDLE):
+        self.client = client or AsyncServiceBusClient.from_connection_string(conn_str=connection_string, logging_enable=True)
+        self.message_class = message_class or ServiceBusMessage
+        self.idle_timeout = idle_timeout
+        self.senders: Dict[str, Any] = {} # queue name => sender
+        self.last_used: Dict[str, float] = {}
+        self._pending: Dict[str, List[Tuple[str, asyncio.Future]]] = defaultdict(list)
+        self._flush_task: asyncio.Task = None
+        self._sweep_task: asyncio.Task = None
+        # metrics
+        self.sent = 0
+        self.batches = 0
+        self.senders_opened = 0
+        self.senders_expired = 0
+
+    def send(self, queue_name: str, body: str) -> asyncio.Future:
+        """Queue a message for the next flush; the returned future resolves once it is sent"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending[queue_name].append((body, future))
+        if self._flush_task is None:
+            self._flush_task = loop.create_task(self._flush())
+        if self._sweep_task is None and self.idle_timeout > 0:
+            self._sweep_task = loop.create_task(self._sweep_loop())
+        return future
+
+    def sender(self, queue_name: str):
+        sender = self.senders.get(queue_name)
+        if sender is None:
+            sender = self.senders[queue_name] = self.client.get_queue_sender(queue_name)
+            self.senders_opened += 1
+        self.last_used[queue_name] = time.monotonic()
+        return sender
+
+    async def _flush(self):
+        try:
+            while self._pending:
+                pending, self._pending = self._pending, defaultdict(list)
+                await asyncio.gather(*[self._send_queue(name, items) for name, items in pending.items()])
+        finally:
+            self._flush_task = None
+
+    async def _send_queue(self, queue_name: str, items: List[Tuple[str, asyncio.Future]]):
+        sender = self.sender(queue_name)
+        try:
+            batch, in_batch = await sender.create_message_batch(), []
+            for body, future in items:
+                message = self.message_class(body)
+                try:
+                    batch.add_message(message)
+                except ValueError as e: # MessageSizeExceededError
+                    if not in_batch:
+                        future.set_exception(e) # too large on its own
+                        continue
+                    # batch is full: send it and start the next one
+                    await self._send_batch(sender, batch, in_batch)
+                    batch, in_batch = await sender.create_message_batch(), []
+                    try:
+                        batch.add_message(message)
+                    except ValueError as e:
+                        future.set_exception(e)
+                        continue
+                in_batch.append(future)
+            if in_batch:
+                await self._send_batch(sender, batch, in_batch)
+        except Exception as e:
+            logger.error(f'Azure Service Bus send to {queue_name} failed: {e}')
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            # the link may be broken, open a new sender next time
+            if self.senders.pop(queue_name, None) is not None:
+                await asyncio.gather(sender.close(), return_exceptions=True)
+        finally:
+            self.last_used[queue_name] = time.monotonic()
+
+    async def _send_batch(self, sender, batch, futures: List[asyncio.Future]):
+        await sender.send_messages(batch)
+        self.sent += len(futures)
+        self.batches += 1
+        for future in futures:
+            if not future.done():
+                future.set_result(None)
+
+    async def expire_idle(self):
+        """Close senders that have not been used for idle_timeout seconds"""
+        now = time.monotonic()
+        for queue_name in list(self.senders):
+            if now - self.last_used.get(queue_name, now) >= self.idle_timeout and queue_name not in self._pending:
+                sender = self.senders.pop(queue_name)
+                self.last_used.pop(queue_name, None)
+                self.senders_expired += 1
+                try:
+                    await sender.close()
+                except Exception as e:
+                    logger.warning(f'closing idle sender {queue_name} failed: {e}')
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.idle_timeout / 2)
+            await self.expire_idle()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'sent': self.sent,
+            'batches': self.batches,
+            'open_senders': len(self.senders),
+            'senders_opened': self.senders_opened,
+            'senders_expired': self.senders_expired,
+        }
+
+    async def close(self):
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            await asyncio.gather(self._sweep_task, return_exceptions=True)
+            self._sweep_task = None
+        for sender in self.senders.values():
+            await sender.close()
+        self.senders.clear()
+        await self.client.close()
+
+
+_azure_pools: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, AzureSenderPool]]' = weakref.WeakKeyDictionary()
+
+def get_azure_pool(connection_string: str) -> AzureSenderPool:
+    """The process-wide sender pool (per event loop) for a Service Bus namespace"""
+    pools = _azure_pools.setdefault(asyncio.get_running_loop(), {})
+    pool = pools.get(connection_string)
+    if pool is None:
+        pool = pools[connection_string] = AzureSenderPool(connection_string)
+    return pool
 
 
 class AzureServiceBusProtocol(AbstractMQProtocol):
-    """Azure Service Bus implementation of the message queue protocol"""
+    """Azure Service Bus implementation of the message queue protocol
+
+    The client and senders come from the process-wide AzureSenderPool; a session owns
+    only its receivers.
+    """
 
     def __init__(self, parent: Protocol, **kwargs):
         super().__init__(parent, **kwargs)
         self.connection_string = os.getenv('AZURE_SERVICEBUS_CONNECTION_STRING')
+        self.pool: AzureSenderPool = None
         self.servicebus_client: AsyncServiceBusClient = None
-        self.senders: Dict[str, Any] = {}
         self.receivers: Dict[str, Any] = {}
         # Track listening tasks per channel for proper cleanup
         self._listening_tasks: Dict[str, asyncio.Task] = {}
@@ -482,22 +1456,13 @@ class AzureServiceBusProtocol(AbstractMQProtocol):
         await super().run()
 
         try:
-            self.servicebus_client = AsyncServiceBusClient.from_connection_string(
-                conn_str=self.connection_string,
-                logging_enable=True
-            )
+            self.pool = get_azure_pool(self.connection_string)
+            self.servicebus_client = self.pool.client
             self.connected = True
             logger.info('Connected to Azure Service Bus')
 
-            # Process pending subscriptions
-            while not self.offline_subscription_queue.empty():
-                channel_id = self.offline_subscription_queue.get()
-                await self.subscribe(channel_id)
-
-            # Send pending messages
-            while not self.offline_queue.empty():
-                cmd, ch, kwargs = self.offline_queue.get()
-                await self.do_send(cmd, ch, **kwargs)
+            # Do any pending subscriptions and send any pending messages
+            await self.replay_outbox()
 
         except ServiceBusError as e:
             logger.error(f"Azure Service Bus connection failed: {e}")
@@ -508,23 +1473,19 @@ class AzureServiceBusProtocol(AbstractMQProtocol):
     async def close(self):
         await self.unsubscribe_all()
 
-        # Close all senders
-        for sender in self.senders.values():
-            await sender.close()
-
-        # Close all receivers
+        # Close all receivers (the pooled client and senders stay open for other sessions)
         for receiver in self.receivers.values():
             await receiver.close()
 
-        if self.servicebus_client:
-            await self.servicebus_client.close()
-
         self.connected = False
         await super().close()
 
     async def subscribe(self, channel_id: str):
+        if await self.join_shared(channel_id):
+            return
+
         if not self.connected:
-            self.offline_subscription_queue.put(channel_id)
+            self.outbox.add_subscription(channel_id)
             return
 
         full_channel_id = self.get_full_channel_id(channel_id)
@@ -536,10 +1497,12 @@ class AzureServiceBusProtocol(AbstractMQProtocol):
 
         receiver = self.servicebus_client.get_queue_receiver(
             queue_name=full_channel_id,
-            max_wait_time=1  # 1 second wait time for receiving messages
+            max_wait_time=1,  # 1 second wait time for receiving messages
+            prefetch_count=MQ_AZURE_PREFETCH
         )
         self.receivers[full_channel_id] = receiver
         self.queues[full_channel_id] = receiver
+        mq_control_stats['subscribe'] += 1
         logger.info(f'{self.dispatcher.context.user.screen_name} subscribed to {full_channel_id}')
 
         # Create and track listening task for proper cleanup
@@ -554,13 +1517,15 @@ class AzureServiceBusProtocol(AbstractMQProtocol):
             async with receiver:
                 while True:
                     try:
-                        messages = await receiver.receive_messages(max_message_count=10, max_wait_time=1)
+                        messages = await receiver.receive_messages(max_message_count=MQ_AZURE_RECEIVE_BATCH, max_wait_time=1)
                         for message in messages:
                             async with message:
                                 data = json.loads(str(message))
-                                if data.get('cmd') == 'unsubscribe' and data.get('sender_id') == id(self):
-                                    return
-                                await self.handle_mesg(channel_id=channel_id, **data)
+                                if data.get('cmd') == 'unsubscribe' and 'sender_id' in data:
+                                    # in-band unsubscribe from an older peer; not a chat message
+                                    mq_control_stats['legacy_unsubscribe_dropped'] += 1
+                                    continue
+                                await self.deliver(channel_id, data)
                     except Exception as e:
                         logger.error(f"Error processing Azure Service Bus message: {e}")
                         break
@@ -570,9 +1535,13 @@ class AzureServiceBusProtocol(AbstractMQProtocol):
             logger.debug(f"Azure Service Bus listening task for {full_channel_id} terminated")
 
     async def unsubscribe(self, channel_id: str):
+        if await self.leave_shared(channel_id) or self.outbox.remove_subscription(channel_id):
+            return
+
         full_channel_id = self.get_full_channel_id(channel_id)
 
-        # Cancel the listening task first to stop the infinite loop
+        # Cancel the listening task and close the receiver; no in-band unsubscribe message is
+        # sent (other sessions receiving from the same queue would otherwise consume it)
         if full_channel_id in self._listening_tasks:
             task = self._listening_tasks[full_channel_id]
             if not task.done():
@@ -584,38 +1553,38 @@ class AzureServiceBusProtocol(AbstractMQProtocol):
             # Remove from tracking (may already be removed by finally block)
             self._listening_tasks.pop(full_channel_id, None)
 
-        # Send unsubscribe message
-        await self.do_send('unsubscribe', channel_id, sender_id=id(self))
-
         # Clean up data structures
         if full_channel_id in self.receivers:
             receiver = self.receivers[full_channel_id]
             await receiver.close()
             del self.receivers[full_channel_id]
             del self.queues[full_channel_id]
+            mq_control_stats['unsubscribe'] += 1
 
     async def unsubscribe_all(self):
+        await self.leave_all_shared()
         for full_channel_id in list(self.receivers.keys()):
             channel_id = full_channel_id.split(':', 1)[1] if ':' in full_channel_id else full_channel_id
             await self.unsubscribe(channel_id)
 
+    def listener_count(self) -> int:
+        return len(self.running_tasks) + len(self._listening_tasks)
+
     async def do_send(self, cmd: str, channel: str, **kwargs):
         if not self.connected:
-            self.offline_queue.put((cmd, channel, kwargs))
+            await self.outbox.put(cmd, channel, kwargs)
             return
 
-        kwargs['cmd'] = cmd
+        kwargs = await self.envelope(cmd, channel, kwargs)
         full_channel = self.get_full_channel_id(channel)
 
-        # Get or create sender for this channel
-        if full_channel not in self.senders:
-            self.senders[full_channel] = self.servicebus_client.get_queue_sender(full_channel)
-
-        sender = self.senders[full_channel]
-        message = ServiceBusMessage(json.dumps(kwargs))
-
-        async with sender:
-            await sender.send_messages(message)
+        # pooled long-lived sender, batched with other sends in this tick
+        try:
+            await self.pool.send(full_channel, await self.encode(cmd, kwargs))
+        except Exception:
+            mq_metrics.on_publish_failed(channel)
+            raise
+        mq_metrics.on_publish(channel, kwargs[TS_KEY])
 
     async def _retry_operation(self, operation: Callable, max_retries: int = 3):
         """Helper method for retrying Azure operations"""
@@ -628,45 +1597,150 @@ class AzureServiceBusProtocol(AbstractMQProtocol):
                 await asyncio.sleep(1)  # Wait before retry
 
 
-def _detect_and_create_protocol():
-    """Factory function to determine and create appropriate MQ implementation"""
-    # Check for explicit protocol selection
-    forced_protocol = os.getenv('MQ_PROTOCOL', '').lower()
-    if forced_protocol:
-        if forced_protocol == 'azure':
-            asyncio.run(_test_azure_connection(raise_errors=True))
-            print(f"Using Azure Service Bus implementation (MQ_PROTOCOL={forced_protocol})")
-            return AzureServiceBusProtocol
-
-        elif forced_protocol == 'rabbitmq':
-            asyncio.run(_test_rabbitmq_connection(raise_errors=True))
-            print(f"Using RabbitMQ implementation (MQ_PROTOCOL={forced_protocol})")
-            return RabbitMQProtocol
-
-        elif forced_protocol == 'inprocess':
-            print(f"Using InProcess MQ implementation (MQ_PROTOCOL={forced_protocol})")
-            return InProcessMQProtocol
-
-        else:
-            raise ValueError(f"Invalid MQ_PROTOCOL value: {forced_protocol}. "
-                "Must be one of: 'azure', 'rabbitmq', 'inprocess'")
+async def _test_redis_connection(url: str = None, raise_errors: bool = False) -> bool:
+    """Test Redis connection with caching (one attempt)"""
+    if not REDIS_AVAILABLE:
+        if raise_errors:
+            raise ImportError("redis package not installed")
+        return False
 
-    # Auto-detection logic
+    url = url or REDIS_URL
+    cache_key = f"redis:{url}"
+    if cache_key not in _connection_test_results:
+        client = aioredis.from_url(url, socket_connect_timeout=MQ_PROBE_TIMEOUT)
+        try:
+            await client.ping()
+            _connection_test_results[cache_key] = True
+        except Exception as e:
+            logger.debug(f"Redis connection test failed: {e}")
+            _connection_test_results[cache_key] = False
+        finally:
+            await client.aclose()
+
+    if not _connection_test_results[cache_key] and raise_errors:
+        raise ConnectionError(f"Could not connect to Redis at {url}")
+    return _connection_test_results[cache_key]
+
+_protocol_names = {
+    'azure': 'AzureServiceBusProtocol',
+    'rabbitmq': 'RabbitMQProtocol',
+    'redis': 'RedisMQProtocol',
+    'unix': 'UnixSocketMQProtocol',
+    'inprocess': 'InProcessMQProtocol',
+}
+
+_selected_protocol: type = None
+
+
+def _detect_fingerprint() -> str:
+    """Identifies the environment a cached detection result is valid for"""
+    connection_string = os.getenv('AZURE_SERVICEBUS_CONNECTION_STRING', '')
+    return json.dumps([
+        hashlib.sha256(connection_string.encode()).hexdigest() if connection_string else None,
+        os.getenv('RABBITMQ_HOST', 'localhost'),
+        os.getenv('RABBITMQ_PORT', '5672'),
+        AZURE_AVAILABLE,
+        RABBITMQ_AVAILABLE,
+    ])
+
+def _read_detect_cache() -> str:
     try:
-        if asyncio.run(_test_azure_connection()):
-            print("Using Azure Service Bus implementation (auto-detected)")
-            return AzureServiceBusProtocol
-
-        if asyncio.run(_test_rabbitmq_connection()):
-            print("Using RabbitMQ implementation (auto-detected)")
-            return RabbitMQProtocol
-
-    except Exception as e:
-        print(f"Debug: Error during MQ detection: {e}")
+        with open(MQ_DETECT_CACHE) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get('fingerprint') != _detect_fingerprint() or time.time() - cached.get('time', 0) > MQ_DETECT_CACHE_TTL:
+        return None
+    return cached.get('protocol') if cached.get('protocol') in _protocol_names else None
+
+def _write_detect_cache(name: str):
+    try:
+        if dirname(MQ_DETECT_CACHE) == MQ_DETECT_CACHE_DIR:
+            private_dir(MQ_DETECT_CACHE_DIR) # other users can't plant or read our result
+        with open(MQ_DETECT_CACHE, 'w') as f:
+            json.dump({'protocol': name, 'fingerprint': _detect_fingerprint(), 'time': time.time()}, f)
+    except OSError as e:
+        logger.warning(f'could not write MQ detection cache {MQ_DETECT_CACHE}: {e}')
+
+async def _probe(test: Callable[..., Awaitable[bool]], **kwargs) -> bool:
+    try:
+        return await asyncio.wait_for(test(**kwargs), MQ_PROBE_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.debug(f'{test.__name__} timed out')
+        return False
 
-    # Default to InProcess
-    print("Using InProcess MQ implementation (auto-detected)")
-    return InProcessMQProtocol
+async def _detect_protocol_name() -> str:
+    """Probe the brokers in parallel; prefer Azure, then RabbitMQ, then in-process"""
+    azure, rabbitmq = await asyncio.gather(_probe(_test_azure_connection), _probe(_test_rabbitmq_connection))
+    if azure:
+        return 'azure'
+    if rabbitmq:
+        return 'rabbitmq'
+    return 'inprocess'
+
+async def _probe_forced_protocol(name: str):
+    """Wait for the broker of a backend forced by MQ_PROTOCOL: MQ_CONNECT_ATTEMPTS probes, MQ_CONNECT_RETRY_DELAY apart"""
+    probe = {'azure': _test_azure_connection, 'rabbitmq': _test_rabbitmq_connection, 'redis': _test_redis_connection}.get(name)
+    if probe is None:
+        return # no broker to probe
+    attempts = max(1, MQ_CONNECT_ATTEMPTS)
+    for attempt in range(1, attempts + 1):
+        _forget_failed_probes()
+        try:
+            await asyncio.wait_for(probe(raise_errors=True), MQ_PROBE_TIMEOUT)
+            return
+        except (ConnectionError, asyncio.TimeoutError) as e:
+            if attempt == attempts:
+                raise ConnectionError(f'MQ_PROTOCOL={name}: broker unreachable after {attempts} attempts') from e
+            logger.warning(f'MQ_PROTOCOL={name}: broker unreachable (attempt {attempt}/{attempts}), retrying')
+            await asyncio.sleep(MQ_CONNECT_RETRY_DELAY)
+
+async def select_mq_protocol(refresh: bool = False) -> type:
+    """Pick the MQ implementation; call once at server startup (ChatServer.run does)
+
+    MQ_PROTOCOL forces a backend (its broker must be reachable within MQ_CONNECT_ATTEMPTS
+    probes). Otherwise the brokers are probed in parallel with MQ_PROBE_TIMEOUT, and the
+    result is cached in MQ_DETECT_CACHE for MQ_DETECT_CACHE_TTL seconds so the next start
+    skips probing. refresh ignores both caches, and earlier probe failures.
+    """
+    global _selected_protocol
+    if _selected_protocol is not None and not refresh:
+        return _selected_protocol
 
-# Make the selected implementation available as MQProtocol
-MQProtocol = _detect_and_create_protocol()
+    forced_protocol = os.getenv('MQ_PROTOCOL', '').lower()
+    if forced_protocol:
+        if forced_protocol not in _protocol_names:
+            raise ValueError(f"Invalid MQ_PROTOCOL value: {forced_protocol}. "
+                "Must be one of: 'azure', 'rabbitmq', 'redis', 'unix', 'inprocess'")
+        await _probe_forced_protocol(forced_protocol)
+        name, how = forced_protocol, f'MQ_PROTOCOL={forced_protocol}'
+    else:
+        if refresh:
+            _forget_failed_probes()
+        name = None if refresh else _read_detect_cache()
+        how = 'cached'
+        if name is None:
+            name, how = await _detect_protocol_name(), 'auto-detected'
+            _write_detect_cache(name)
+
+    _selected_protocol = globals()[_protocol_names[name]]
+    logger.info(f'Using {_selected_protocol.__name__} ({how})')
+    return _selected_protocol
+
+def mq_protocol_class() -> type:
+    """The implementation chosen by select_mq_protocol()
+
+    If selection has not run, fall back to MQ_PROTOCOL (unprobed) or the in-process backend.
+    """
+    if _selected_protocol is not None:
+        return _selected_protocol
+    forced_protocol = os.getenv('MQ_PROTOCOL', '').lower()
+    name = forced_protocol if forced_protocol in _protocol_names else 'inprocess'
+    logger.warning(f'MQ backend used before select_mq_protocol(), defaulting to {name}')
+    return globals()[_protocol_names[name]]
+
+def __getattr__(name: str):
+    # MQProtocol is resolved lazily so importing this module never probes brokers
+    if name == 'MQProtocol':
+        return mq_protocol_class()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,113 @@
+'''
+session store
+
+Disk store for hibernated session contexts.
+
+When HTTPServerProtocol evicts an idle session, its context is serialized here as
+json, and the session's tasks and MQ subscriptions are torn down. If the same
+SESSION_ID comes back, the context is loaded and applied to a fresh session.
+
+Contexts are kept in a directory only this user can access (SESSION_HIBERNATE_DIR, by
+default a per-user directory in the temp dir), and deleted after SESSION_HIBERNATE_TTL
+seconds if their session doesn't come back.
+'''
+
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+from os.path import join, exists
+
+import aiofiles
+import aiofiles.os
+
+from agi_green.utils import private_dir, user_tmp_path
+
+logger = logging.getLogger(__name__)
+
+SESSION_HIBERNATE_DIR = os.getenv('SESSION_HIBERNATE_DIR') or user_tmp_path('agi_green_sessions')
+SESSION_HIBERNATE_TTL = float(os.getenv('SESSION_HIBERNATE_TTL', 30 * 24 * 3600)) # seconds a hibernated context is kept (0 = forever)
+
+re_safe_id = re.compile(r'^[\w.-]+$')
+
+
+def dump_context(context:dict) -> str:
+    'serialize a session context to json, dropping (with a warning) top level keys that are not json serializable'
+    data = {}
+    for k, v in context.items():
+        try:
+            json.dumps(v)
+        except (TypeError, ValueError) as e:
+            logger.warning(f'session context key {k!r} not serializable, dropped from hibernation: {e}')
+            continue
+        data[k] = v
+    return json.dumps(data)
+
+
+class SessionStore:
+    'json files in a directory, one per hibernated session'
+
+    def __init__(self, path:str=None, ttl:float=SESSION_HIBERNATE_TTL):
+        self.path = private_dir(path or SESSION_HIBERNATE_DIR)
+        self.ttl = ttl
+        self._last_sweep = 0.0
+
+    @staticmethod
+    def valid_id(session_id:str) -> bool:
+        'True if session_id can be stored (used as a file name)'
+        return bool(re_safe_id.match(session_id))
+
+    def _file(self, session_id:str) -> str:
+        if not self.valid_id(session_id):
+            raise ValueError(f'invalid session id {session_id!r}')
+        return join(self.path, f'{session_id}.json')
+
+    async def save(self, session_id:str, snapshot:str):
+        'write a snapshot produced by dump_context()'
+        async with aiofiles.open(self._file(session_id), 'w') as f:
+            await f.write(snapshot)
+
+    def contains(self, session_id:str) -> bool:
+        try:
+            return exists(self._file(session_id))
+        except ValueError:
+            return False
+
+    async def pop(self, session_id:str) -> dict|None:
+        'load and delete the hibernated context for session_id (None if not hibernated)'
+        try:
+            file_path = self._file(session_id)
+            async with aiofiles.open(file_path, 'r') as f:
+                data = json.loads(await f.read())
+        except (ValueError, OSError):
+            return None
+
+        try:
+            await aiofiles.os.remove(file_path)
+        except OSError as e:
+            logger.warning(f'could not remove hibernated session {file_path}: {e}')
+
+        return data
+
+    async def sweep(self, interval:float=3600):
+        'delete contexts older than ttl (at most once per interval seconds)'
+        now = time.monotonic()
+        if not self.ttl or (self._last_sweep and now - self._last_sweep < interval):
+            return
+        self._last_sweep = now
+        removed = await asyncio.get_running_loop().run_in_executor(None, self._sweep, time.time() - self.ttl)
+        if removed:
+            logger.info(f'session store {self.path}: removed {removed} expired sessions')
+
+    def _sweep(self, cutoff:float) -> int:
+        removed = 0
+        for entry in os.scandir(self.path):
+            try:
+                if entry.name.endswith('.json') and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
@@ -0,0 +1,139 @@
+'''
+uploads
+
+Streaming POST body reader.
+
+multipart/form-data bodies are read part by part instead of with request.post().
+File parts are streamed to temporary files as they arrive, with size and sha256
+computed incrementally, so memory use is bounded by the chunk size and the field
+limit rather than by the size of the upload.
+
+Text fields are always str, as with request.post(); a field over
+UPLOAD_FIELD_MAX_BYTES is rejected with 413 (send large content as a file part).
+
+File parts are handed to handlers as UploadedFile, which is compatible with
+aiohttp's FileField (name, filename, file, content_type, headers).
+'''
+
+import os
+import hashlib
+import logging
+import tempfile
+from typing import Any, Dict, List, Tuple
+
+import aiofiles
+from aiohttp import web, BodyPartReader
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 64 * 1024))  # part buffer size
+UPLOAD_FIELD_MAX_BYTES = int(os.getenv('UPLOAD_FIELD_MAX_BYTES', 16 * 1024 * 1024))  # larger text fields are rejected
+UPLOAD_DIR = os.getenv('UPLOAD_DIR') or None  # None => system temp dir
+
+
+class UploadedFile:
+    'a multipart part spooled to a temporary file'
+
+    def __init__(self, name:str, filename:str|None, content_type:str, headers, path:str, size:int, sha256:str):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.headers = headers
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self._file = None
+
+    @property
+    def file(self):
+        'binary file object positioned at the start of the content (FileField compatible)'
+        if self._file is None:
+            self._file = open(self.path, 'rb')
+        return self._file
+
+    def release(self):
+        'close and delete the temporary file (no-op if a handler already moved it)'
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __repr__(self):
+        return f'UploadedFile({self.name!r}, filename={self.filename!r}, size={self.size})'
+
+
+async def spool_part(part, head:bytes=b'') -> UploadedFile:
+    'stream the rest of a multipart part to a temporary file, starting with head'
+    digest = hashlib.sha256(head)
+    size = len(head)
+    fd, path = tempfile.mkstemp(prefix='agi_upload_', dir=UPLOAD_DIR)
+    os.close(fd)
+
+    try:
+        async with aiofiles.open(path, 'wb') as f:
+            if head:
+                await f.write(head)
+            while chunk := await part.read_chunk(UPLOAD_CHUNK_SIZE):
+                digest.update(chunk)
+                size += len(chunk)
+                await f.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+
+    content_type = part.headers.get('Content-Type', 'application/octet-stream')
+    return UploadedFile(part.name, part.filename, content_type, part.headers, path, size, digest.hexdigest())
+
+
+async def read_field(part) -> str:
+    'read a non-file field in memory; 413 if it exceeds UPLOAD_FIELD_MAX_BYTES'
+    buf = bytearray()
+    while chunk := await part.read_chunk(UPLOAD_CHUNK_SIZE):
+        buf.extend(chunk)
+        if len(buf) > UPLOAD_FIELD_MAX_BYTES:
+            logger.warning(f'form field {part.name} exceeds {UPLOAD_FIELD_MAX_BYTES} bytes, rejected')
+            raise web.HTTPRequestEntityTooLarge(max_size=UPLOAD_FIELD_MAX_BYTES, actual_size=len(buf))
+    return buf.decode(part.get_charset(default='utf-8'))
+
+
+async def read_post(request:web.Request) -> Tuple[Dict[str, Any], List[UploadedFile]]:
+    '''read a POST body: return (fields, uploads)
+
+    uploads lists every UploadedFile in fields; the caller releases them when the request is done.
+    '''
+    if request.content_type != 'multipart/form-data':
+        return dict(await request.post()), []
+
+    fields:Dict[str, Any] = {}
+    uploads:List[UploadedFile] = []
+
+    try:
+        reader = await request.multipart()
+        while (part := await reader.next()) is not None:
+            if not isinstance(part, BodyPartReader):
+                logger.warning('nested multipart bodies are not supported, skipped')
+                continue
+
+            if part.filename is not None:
+                value = await spool_part(part)
+            else:
+                value = await read_field(part)
+
+            if isinstance(value, UploadedFile):
+                uploads.append(value)
+                logger.info(f'upload {value.name}: {value.filename} {value.size} bytes sha256={value.sha256}')
+
+            fields[part.name] = value
+    except BaseException:
+        release_uploads(uploads)
+        raise
+
+    return fields, uploads
+
+
+def release_uploads(uploads:List[UploadedFile]):
+    for upload in uploads:
+        upload.release()
@@ -1,3 +1,7 @@
+import os
+import stat
+import tempfile
+
 def red(text):
     return f"\033[91m{text}\033[0m"
 
@@ -6,3 +10,38 @@ def green(text):
 
 def yellow(text):
     return f"\033[93m{text}\033[0m"
+
+def process_rss_mb() -> float:
+    'resident memory of this process in MB (0 if unavailable on this platform)'
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return 0
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+def user_tmp_path(name:str) -> str:
+    'a per-user path in the temp dir, e.g. /tmp/agi_green_blobs-1000'
+    user = os.getuid() if hasattr(os, 'getuid') else os.getenv('USERNAME', 'user')
+    return os.path.join(tempfile.gettempdir(), f'{name}-{user}')
+
+def private_dir(path:str) -> str:
+    'create path (and missing parents) with mode 0700; refuse an existing path that is not our directory'
+    parent = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(parent):
+        private_dir(parent)
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or (hasattr(os, 'getuid') and st.st_uid != os.getuid()):
+        raise PermissionError(f'{path} is not a directory owned by this user')
+    if st.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+def user_runtime_dir() -> str:
+    'a directory for sockets and locks of this user: $XDG_RUNTIME_DIR/agi_green, else a per-user temp dir'
+    runtime = os.getenv('XDG_RUNTIME_DIR')
+    return os.path.join(runtime, 'agi_green') if runtime else user_tmp_path('agi_green')
@@ -0,0 +1,84 @@
+import json
+import random
+import asyncio
+from agi_green.access_log import AccessLog
+
+class Recorder(AccessLog):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+
+    async def write(self, records):
+        self.batches.append([r['n'] for r in records])
+        self.written += len(records)
+
+def test_records_are_batched():
+    async def scenario():
+        log = Recorder(batch=3, flush_interval=0.05)
+        for n in range(7):
+            log.record(n=n)
+        await asyncio.sleep(0.1)
+        assert log.batches == [[0, 1, 2], [3, 4, 5], [6]] # the last one after flush_interval
+        await log.close()
+
+    asyncio.run(scenario())
+
+def test_close_writes_queued_records():
+    async def scenario():
+        log = Recorder(batch=100, flush_interval=10)
+        for n in range(5):
+            log.record(n=n)
+        await asyncio.sleep(0)
+        await log.close()
+        assert log.batches == [[0, 1, 2, 3, 4]] # didn't wait for flush_interval
+        assert log._task is None
+
+    asyncio.run(scenario())
+
+def test_sampling():
+    async def scenario():
+        random.seed(1)
+        log = Recorder(sample=0.25)
+        for n in range(1000):
+            log.record(n=n)
+        await log.close()
+        assert 150 < log.written < 350
+
+        log = Recorder(sample=0)
+        log.record(n=0)
+        await log.close()
+        assert log.written == 0
+
+    asyncio.run(scenario())
+
+def test_file_path(tmp_path):
+    path = tmp_path / 'access.log'
+
+    async def scenario():
+        log = AccessLog(file_path=str(path), flush_interval=0.01)
+        log.record(method='GET', path='/', status=200)
+        log.record(method='POST', path='/upload', status=201)
+        await log.close()
+
+    asyncio.run(scenario())
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(r['method'], r['status']) for r in records] == [('GET', 200), ('POST', 201)]
+
+def test_disabled_when_nothing_would_be_written(monkeypatch):
+    import logging
+    from agi_green import access_log
+    access_logger = access_log.QueueAccessLogger(logging.getLogger('aiohttp.access'), '')
+    monkeypatch.setattr(access_log.access_log, 'file_path', None)
+    level = access_log.logger.level
+    try:
+        access_log.logger.setLevel(logging.WARNING)
+        assert not access_logger.enabled
+
+        access_log.logger.setLevel(logging.INFO)
+        assert access_logger.enabled
+
+        access_log.logger.setLevel(logging.WARNING)
+        monkeypatch.setattr(access_log.access_log, 'file_path', 'access.jsonl')
+        assert access_logger.enabled
+    finally:
+        access_log.logger.setLevel(level)
@@ -38,3 +38,54 @@ def test_attribute_and_item_deletion():
     with pytest.raises(AttributeError):
         _ = obj.a
 
+
+def test_version_change_tracking():
+    obj = DictNamespace(_depth=2)
+    assert obj._changed('k')
+    assert not obj._changed('k')
+
+    obj.a.b = 1 # nested write propagates to the parent
+    assert obj._changed('k')
+    assert not obj._changed('k')
+    assert obj.a._changed('k') and not obj.a._changed('k')
+
+    child = obj.a
+    obj._deep_update({'a': {'c': 2}})
+    assert obj._changed('k') and child._changed('k')
+
+    del obj.a.c
+    assert obj._changed('k')
+    obj['x'] = 5
+    obj.pop('x')
+    obj.update(y=1)
+    assert obj._changed('k') and not obj._changed('k')
+    assert obj._changed('other') # each key has its own view
+
+    # a detached child no longer marks its old parent
+    obj.a = DictNamespace()
+    assert obj._changed('k')
+    child.b = 3
+    assert not obj._changed('k')
+
+    obj.clear()
+    assert obj._changed('k')
+
+def test_copies_track_changes_separately():
+    import copy
+    original = DictNamespace(inner={'x': 1})
+
+    deep = copy.deepcopy(original)
+    assert deep == original and deep.inner is not original.inner
+    assert original._changed('a') and deep._changed('a')
+    deep.inner.x = 2
+    assert deep._changed('a')
+    assert not original._changed('a') # the copy's child doesn't report to the original
+    assert original.inner.x == 1
+
+    shallow = copy.copy(original)
+    assert shallow.inner is original.inner
+    shallow._changed('a')
+    shallow.y = 3
+    assert shallow._changed('a') and not original._changed('a')
+    original.inner.x = 4 # shared child: both containers see it
+    assert shallow._changed('a') and original._changed('a')
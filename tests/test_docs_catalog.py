@@ -0,0 +1,49 @@
+import os
+import pytest
+from agi_green import docs_catalog as dc
+from agi_green.docs_catalog import DocsCatalog
+
+@pytest.fixture
+def static_dir(tmp_path):
+    docs = tmp_path / 'docs'
+    docs.mkdir()
+    (docs / 'alpha.md').write_text('# Alpha doc\nbody')
+    (docs / 'beta.md').write_text('intro\n## Beta doc\n')
+    (docs / 'index.md').write_text('stale generated index')
+    return str(tmp_path)
+
+def test_index_lists_headers(static_dir):
+    catalog = DocsCatalog(scan_interval=0)
+    text = catalog.index([static_dir])
+    assert '| [**alpha**](/docs/alpha) | *Alpha doc* |' in text
+    assert '| [**beta**](/docs/beta) | *Beta doc* |' in text
+    assert 'stale' not in text
+    assert not any(os.path.basename(p) == 'index.md' for p in catalog._headers)
+
+def test_index_is_incremental(static_dir, monkeypatch):
+    catalog = DocsCatalog(scan_interval=0)
+    catalog.index([static_dir])
+
+    parsed = []
+    read_header = dc.read_header
+    monkeypatch.setattr(dc, 'read_header', lambda p: parsed.append(p) or read_header(p))
+
+    catalog.index([static_dir])
+    assert parsed == []
+
+    alpha = os.path.join(static_dir, 'docs', 'alpha.md')
+    with open(alpha, 'w') as f:
+        f.write('# Alpha renamed\n')
+    os.utime(alpha, (1, 1))
+
+    text = catalog.index([static_dir])
+    assert parsed == [alpha]
+    assert '*Alpha renamed*' in text
+
+def test_removed_file_is_dropped(static_dir):
+    catalog = DocsCatalog(scan_interval=0)
+    catalog.index([static_dir])
+    os.remove(os.path.join(static_dir, 'docs', 'beta.md'))
+    text = catalog.index([static_dir])
+    assert 'beta' not in text
+    assert len(catalog._headers) == 1
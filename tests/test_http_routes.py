@@ -0,0 +1,115 @@
+from agi_green.dispatcher import protocol_handler
+from agi_green.protocol_http import HTTPRoutes
+
+@protocol_handler
+async def catch_all(**kwargs):
+    pass
+
+@protocol_handler(priority=1, paths=['/.auth/*'])
+async def auth(**kwargs):
+    pass
+
+@protocol_handler(priority=3, paths=['/robots.txt'])
+async def robots(**kwargs):
+    pass
+
+routes = HTTPRoutes(sorted([catch_all, auth, robots], key=lambda h: h.priority))
+
+def test_assets_skip_catch_all():
+    assert routes.route('/assets/index.js', asset=True) == []
+    assert routes.route('/robots.txt', asset=True) == [robots]
+
+def test_pages_reach_catch_all_in_priority_order():
+    assert routes.route('/') == [catch_all]
+    assert routes.route('/.auth/login/aad') == [auth, catch_all]
+    assert routes.route('/robots.txt') == [catch_all, robots]
+
+
+def test_sessionless_requests_follow_session_static_config(tmp_path, monkeypatch):
+    import asyncio
+    from aiohttp import web
+    from aiohttp.test_utils import make_mocked_request
+    from agi_green.chat_server import ChatServer, ChatSession
+    from agi_green.dispatcher import Protocol
+
+    (tmp_path / 'app.js').write_text('override')
+    (tmp_path / 'hooked.js').write_text('hooked')
+    (tmp_path / 'index.html').write_text('app index')
+    (tmp_path / 'guide.md').write_text('# guide')
+
+    class Hook(Protocol):
+        protocol_id = 'hook'
+
+        @protocol_handler(paths=['/hooked.js'])
+        async def on_http_request(self, **kwargs):
+            pass
+
+        @protocol_handler
+        async def on_http_status(self, **kwargs):
+            return 'ok'
+
+    class Session(ChatSession):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.http.add_static(str(tmp_path), 0)
+            Hook(self)
+
+    def get(filename, query='', cookie=None):
+        headers = {'Cookie': f'SESSION_ID={cookie}'} if cookie else None
+        return make_mocked_request('GET', f'/{filename}{query}', headers=headers, match_info={'filename': filename})
+
+    async def scenario():
+        http = ChatServer(session_class=Session).http
+        created = []
+        monkeypatch.setattr(http, 'get_or_create_session', lambda request: created.append(request.path))
+
+        # no session has been created: the server profiles one without keeping or running it
+        response = await http.handle_http_request(get('missing.js'))
+        assert isinstance(response, web.HTTPNotFound)
+        assert 'SESSION_ID' in response.cookies
+
+        response = await http.handle_http_request(get('guide.md'))
+        assert response._path == tmp_path / 'guide.md' # raw markdown
+
+        response = await http.handle_http_request(get('guide', cookie='s1'))
+        assert response._path == tmp_path / 'index.html' # rendered markdown: the page, open_md waits for its session
+        assert http._pending_ws['s1'] == [('open_md', {'name': 'guide.md', 'content': '# guide', 'viewmode': 'render'})]
+
+        response = await http.handle_http_request(get('app.js', cookie='s2'))
+        assert response._path == tmp_path / 'app.js' # add_static override wins
+        assert 'SESSION_ID' not in response.cookies
+
+        assert http.sessions == {} and created == []
+
+        # a handler or command could see these: they go through a session
+        for request in (get('hooked.js'), get('status'), get('app.js', '?v=1')):
+            assert await http.handle_sessionless_request(request, None) is None
+
+        # static dirs added to a live session later don't leak into sessionless serving
+        session = Session(http, session_id='s1')
+        other = tmp_path / 'other'
+        other.mkdir()
+        (other / 'late.js').write_text('late')
+        session.http.add_static(str(other))
+        assert isinstance(await http.handle_sessionless_request(get('late.js'), 's1'), web.HTTPNotFound)
+
+    asyncio.run(scenario())
+
+
+def test_pending_ws_messages_reach_the_new_session(tmp_path):
+    import asyncio
+    from types import SimpleNamespace
+    from agi_green.chat_server import ChatServer
+    from agi_green.session_store import SessionStore
+
+    sid = '0123abcd-0000-0000-0000-000000000001'
+
+    async def scenario():
+        http = ChatServer().http
+        http.session_store = SessionStore(str(tmp_path))
+        http.defer_ws(sid, 'open_md', name='guide.md', content='# guide', viewmode='render')
+        session, _ = await http.get_or_create_session(SimpleNamespace(cookies={'SESSION_ID': sid}, host='localhost'))
+        assert session.ws.pre_connect_queue[-1] == {'cmd': 'open_md', 'name': 'guide.md', 'content': '# guide', 'viewmode': 'render'}
+        assert sid not in http._pending_ws
+
+    asyncio.run(scenario())
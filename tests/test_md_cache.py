@@ -0,0 +1,34 @@
+import os
+import asyncio
+from agi_green.md_cache import MarkdownCache
+
+def test_hit_and_revalidate(tmp_path):
+    doc = tmp_path / 'doc.md'
+    doc.write_text('# one')
+    cache = MarkdownCache()
+
+    assert asyncio.run(cache.get(str(doc))) == '# one'
+    assert asyncio.run(cache.get(str(doc))) == '# one'
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    doc.write_text('# two!')
+    assert asyncio.run(cache.get(str(doc))) == '# two!'
+    assert cache.misses == 2
+    assert cache.total_bytes == len('# two!')
+
+def test_memory_budget(tmp_path):
+    cache = MarkdownCache(max_bytes=10)
+    paths = []
+    for name in 'abc':
+        p = tmp_path / f'{name}.md'
+        p.write_text(name * 4)
+        paths.append(str(p))
+        asyncio.run(cache.get(str(p)))
+
+    assert cache.total_bytes <= 10
+    assert list(cache._entries) == paths[1:]
+
+    big = tmp_path / 'big.md'
+    big.write_text('x' * 20)
+    assert asyncio.run(cache.get(str(big))) == 'x' * 20
+    assert str(big) not in cache._entries
@@ -0,0 +1,132 @@
+import asyncio
+from agi_green.protocol_mq import AzureSenderPool
+
+class FakeBatch:
+    'stand-in for ServiceBusMessageBatch: holds at most max_messages'
+    def __init__(self, max_messages):
+        self.max_messages = max_messages
+        self.messages = []
+
+    def add_message(self, message):
+        if len(self.messages) >= self.max_messages or len(message) > 100:
+            raise ValueError('batch is full')
+        self.messages.append(message)
+
+class FakeSender:
+    def __init__(self, name, max_batch):
+        self.name = name
+        self.max_batch = max_batch
+        self.sent = []
+        self.closed = False
+
+    async def create_message_batch(self):
+        return FakeBatch(self.max_batch)
+
+    async def send_messages(self, batch):
+        await asyncio.sleep(0)
+        self.sent.append(list(batch.messages))
+
+    async def close(self):
+        self.closed = True
+
+class FakeClient:
+    'stand-in for the async ServiceBusClient'
+    def __init__(self, max_batch=4):
+        self.max_batch = max_batch
+        self.senders = []
+
+    def get_queue_sender(self, queue_name):
+        sender = FakeSender(queue_name, self.max_batch)
+        self.senders.append(sender)
+        return sender
+
+    async def close(self):
+        pass
+
+def test_sends_are_batched_on_long_lived_senders():
+    async def scenario():
+        client = FakeClient(max_batch=4)
+        pool = AzureSenderPool(client=client, message_class=str, idle_timeout=0)
+
+        await asyncio.gather(*[pool.send('test:a', f'a{i}') for i in range(6)], pool.send('test:b', 'b0'))
+        await pool.send('test:a', 'a6')
+
+        # one sender per queue, reused and left open
+        assert [s.name for s in client.senders] == ['test:a', 'test:b']
+        a, b = client.senders
+        assert a.sent == [['a0', 'a1', 'a2', 'a3'], ['a4', 'a5'], ['a6']]
+        assert b.sent == [['b0']]
+        assert not a.closed
+        assert pool.stats()['sent'] == 8
+
+    asyncio.run(scenario())
+
+def test_oversized_message_fails_alone():
+    async def scenario():
+        pool = AzureSenderPool(client=FakeClient(), message_class=str, idle_timeout=0)
+        results = await asyncio.gather(pool.send('test:a', 'x' * 200), pool.send('test:a', 'ok'), return_exceptions=True)
+        assert isinstance(results[0], ValueError)
+        assert results[1] is None
+
+    asyncio.run(scenario())
+
+def test_idle_senders_expire():
+    async def scenario():
+        client = FakeClient()
+        pool = AzureSenderPool(client=client, message_class=str, idle_timeout=0.05)
+        await pool.send('test:a', 'm')
+        await asyncio.sleep(0.15)
+        assert client.senders[0].closed
+        assert pool.stats()['open_senders'] == 0
+
+        await pool.send('test:a', 'n')
+        assert len(client.senders) == 2
+        await pool.close()
+
+    asyncio.run(scenario())
+
+class FakeReceiver:
+    def __init__(self, queue_name):
+        self.queue_name = queue_name
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def receive_messages(self, max_message_count=1, max_wait_time=None):
+        await asyncio.sleep(max_wait_time or 0)
+        return []
+
+    async def close(self):
+        self.closed = True
+
+def test_unsubscribe_is_out_of_band(monkeypatch):
+    from agi_green import protocol_mq
+    from agi_green.dispatcher import Dispatcher
+    from agi_green.protocol_mq import AzureServiceBusProtocol, mq_control_stats
+
+    async def scenario():
+        client = FakeClient()
+        client.get_queue_receiver = lambda queue_name, **kwargs: FakeReceiver(queue_name)
+        pool = AzureSenderPool(client=client, message_class=str, idle_timeout=0)
+        protocol_mq._azure_pools[asyncio.get_running_loop()] = {None: pool}
+        monkeypatch.delenv('AZURE_SERVICEBUS_CONNECTION_STRING', raising=False)
+
+        session = Dispatcher()
+        session.context.subdomain = 'test'
+        mq = AzureServiceBusProtocol(session)
+        await mq.run()
+        await mq.subscribe('room')
+        receiver = mq.receivers['test:room']
+
+        before = mq_control_stats['unsubscribe']
+        await mq.unsubscribe('room')
+        assert receiver.closed
+        assert mq_control_stats['unsubscribe'] == before + 1
+        assert pool.stats()['sent'] == 0 # nothing published to the channel
+        assert client.senders == []
+
+    asyncio.run(scenario())
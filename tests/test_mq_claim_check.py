@@ -0,0 +1,92 @@
+import os
+import asyncio
+import json
+import pytest
+from agi_green import mq_blobs
+from agi_green.mq_blobs import ClaimCheck, FileBlobStore, CLAIM_KEY
+from agi_green.dispatcher import Dispatcher, Protocol, protocol_handler
+from agi_green.protocol_mq import UnixSocketMQProtocol
+
+class Receiver(Protocol):
+    protocol_id = 'receiver'
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.received = asyncio.Queue()
+
+    @protocol_handler
+    async def on_mq_chat(self, channel_id, content, **kwargs):
+        self.received.put_nowait(content)
+
+def test_claim_check_roundtrip(tmp_path):
+    async def scenario():
+        cc = ClaimCheck(FileBlobStore(str(tmp_path)), threshold=200, cache_bytes=1000)
+        small = await cc.encode({'cmd': 'chat', 'content': 'hi'})
+        assert CLAIM_KEY not in json.loads(small)
+
+        message = {'cmd': 'chat', 'content': 'x' * 500}
+        ref = json.loads(await cc.encode(message))
+        assert ref['cmd'] == 'chat' and ref['_size'] > 500
+        assert len(json.dumps(ref)) < 200
+
+        # a fresh receiver reads the blob once, then serves it from the cache
+        receiver = ClaimCheck(FileBlobStore(str(tmp_path)), threshold=200, cache_bytes=1000)
+        assert await receiver.resolve(ref) == message
+        assert await receiver.resolve(ref) == message
+        assert receiver.stats()['resolved'] == 1 and receiver.stats()['cache_hits'] == 1
+
+        # same payload, same blob
+        assert json.loads(await cc.encode(message))[CLAIM_KEY] == ref[CLAIM_KEY]
+        assert len(list(tmp_path.rglob('*'))) == 2 # one shard dir, one blob
+
+        with pytest.raises(KeyError):
+            await receiver.resolve({'cmd': 'chat', CLAIM_KEY: '0' * 64})
+
+    asyncio.run(scenario())
+
+def test_large_message_over_unix_router(tmp_path, monkeypatch):
+    monkeypatch.setattr(mq_blobs.claim_check, 'store', FileBlobStore(str(tmp_path / 'blobs')))
+    monkeypatch.setattr(mq_blobs.claim_check, 'threshold', 1000)
+    path = str(tmp_path / 'mq.sock')
+
+    async def scenario():
+        session = Dispatcher()
+        session.context.subdomain = 'test'
+        mq = UnixSocketMQProtocol(session, path=path)
+        receiver = Receiver(session)
+        await mq.run()
+        await mq.subscribe('room')
+
+        published = []
+        publish = mq.router.publish
+        mq.router.publish = lambda topic, body: published.append(body) or publish(topic, body)
+
+        await mq.do_send('chat', 'room', content='y' * 100000)
+        assert await asyncio.wait_for(receiver.received.get(), 1.0) == 'y' * 100000
+        assert len(published[0]) < 200 # the router only carried the reference
+
+        await mq.router.close()
+
+    asyncio.run(scenario())
+
+def test_file_blob_store_is_private_and_race_free(tmp_path):
+    root = tmp_path / 'blobs'
+    store = FileBlobStore(str(root))
+    key = 'ab' * 32
+
+    async def scenario():
+        await asyncio.gather(*(store.put(key, b'payload') for _ in range(5)))
+        assert await store.get(key) == b'payload'
+        assert [p.name for p in (root / 'ab').iterdir()] == [key] # no temp files left
+
+        # re-sending an existing blob restarts its ttl
+        path = root / 'ab' / key
+        os.utime(path, (0, 0))
+        await store.put(key, b'payload')
+        await store.sweep(60)
+        assert path.exists()
+
+    asyncio.run(scenario())
+    assert (root.stat().st_mode & 0o777) == 0o700
+    assert ((root / 'ab').stat().st_mode & 0o777) == 0o700
+    assert ((root / 'ab' / key).stat().st_mode & 0o077) == 0
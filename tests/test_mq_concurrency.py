@@ -0,0 +1,51 @@
+import asyncio
+from agi_green.protocol_mq import ConcurrencyWindow
+
+def test_window_bounds_concurrency_and_orders_per_key():
+    async def scenario():
+        window = ConcurrencyWindow(limit=3)
+        running = 0
+        peak = 0
+        order = []
+
+        def handler(key, i, delay):
+            async def run():
+                nonlocal running, peak
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(delay)
+                order.append((key, i))
+                running -= 1
+            return run
+
+        # the slow first message for 'alice' must not be overtaken by her later ones
+        await window.submit('alice', handler('alice', 0, 0.05))
+        for i in range(1, 4):
+            await window.submit('alice', handler('alice', i, 0))
+            await window.submit(f'bob{i}', handler('bob', i, 0))
+        await window.drain()
+
+        assert peak <= 3
+        assert [i for key, i in order if key == 'alice'] == [0, 1, 2, 3]
+        assert order.index(('bob', 1)) < order.index(('alice', 0)) # other keys are not blocked
+        assert window.in_flight == 0
+
+    asyncio.run(scenario())
+
+def test_window_handler_error_does_not_block_key():
+    async def scenario():
+        window = ConcurrencyWindow(limit=2)
+        done = []
+
+        async def fail():
+            raise RuntimeError('handler failed')
+
+        async def ok():
+            done.append(True)
+
+        await window.submit('k', fail)
+        await window.submit('k', ok)
+        await window.drain()
+        assert done == [True]
+
+    asyncio.run(scenario())
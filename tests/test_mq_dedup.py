@@ -0,0 +1,58 @@
+import asyncio
+from agi_green.mq_dedup import DedupWindow, new_message_id
+from agi_green.mq_metrics import mq_metrics
+from agi_green.dispatcher import Dispatcher, Protocol, protocol_handler
+from agi_green.protocol_mq import InProcessMQProtocol
+
+class Receiver(Protocol):
+    protocol_id = 'receiver'
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.received = []
+
+    @protocol_handler
+    async def on_mq_chat(self, channel_id, content):
+        self.received.append(content)
+
+def test_window_bounds(monkeypatch):
+    window = DedupWindow(size=3, ttl=10)
+    ids = [new_message_id() for _ in range(4)]
+    assert len(set(ids)) == 4
+
+    assert not any(window.seen(i) for i in ids[:3])
+    assert window.seen(ids[1])
+    assert not window.seen(ids[3]) # evicts the oldest
+    assert len(window) == 3
+    assert not window.seen(ids[0])
+
+    now = [1000.0]
+    monkeypatch.setattr('agi_green.mq_dedup.time.monotonic', lambda: now[0])
+    window = DedupWindow(size=100, ttl=10)
+    assert not window.seen('a')
+    now[0] += 5
+    assert window.seen('a')
+    now[0] += 10
+    assert not window.seen('a') # expired
+    assert window.stats() == {'checked': 3, 'hits': 1, 'hit_rate': 1 / 3, 'size': 1}
+
+def test_redelivery_dropped():
+    async def scenario():
+        session = Dispatcher()
+        session.context.subdomain = 'test'
+        mq = InProcessMQProtocol(session)
+        receiver = Receiver(session)
+        duplicates = mq_metrics.dedup['duplicate']
+
+        message = await mq.envelope('chat', 'room', {'content': 'once'})
+        message['cmd'] = 'chat'
+        await mq.deliver('room', message)
+        await mq.deliver('room', dict(message)) # e.g. redelivered after a reconnect
+        await mq.deliver('room', {'cmd': 'chat', 'content': 'no id'})
+
+        assert receiver.received == ['once', 'no id']
+        assert mq.dedup.stats()['hits'] == 1
+        assert mq_metrics.dedup['duplicate'] - duplicates == 1
+        assert 'agi_mq_dedup_total{result="duplicate"}' in mq_metrics.prometheus()
+
+    asyncio.run(scenario())
@@ -0,0 +1,123 @@
+import asyncio
+from agi_green import mq_history
+from agi_green.mq_history import MemoryHistory
+from agi_green.dispatcher import Dispatcher, Protocol, protocol_handler
+from agi_green.protocol_mq import InProcessMQProtocol
+
+class Receiver(Protocol):
+    protocol_id = 'receiver'
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.received = []
+
+    @protocol_handler
+    async def on_mq_chat(self, channel_id, content):
+        self.received.append((channel_id, content))
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+def make_session():
+    session = Dispatcher()
+    session.context.subdomain = 'test'
+    return InProcessMQProtocol(session), Receiver(session)
+
+def test_ring_buffer():
+    async def scenario():
+        history = MemoryHistory(size=3)
+        for i in range(5):
+            assert await history.append('test:room', {'n': i}) == i + 1
+        assert [seq for seq, _ in await history.read('test:room')] == [3, 4, 5]
+        assert [m['n'] for _, m in await history.read('test:room', last=2)] == [3, 4]
+        assert [seq for seq, _ in await history.read('test:room', since=4)] == [5]
+        assert await history.read('test:other') == []
+
+        # least recently used channels are dropped; a reader behind a dropped channel gets everything
+        history = MemoryHistory(size=3, max_channels=2)
+        for channel in ('a', 'b', 'a', 'c'):
+            await history.append(channel, {'n': 0})
+        assert list(history.buffers) == ['a', 'c']
+        assert await history.read('b') == []
+        await history.append('b', {'n': 1})
+        assert [m['n'] for _, m in await history.read('b', since=5)] == [1]
+
+    asyncio.run(scenario())
+
+def test_late_joiner_replay(monkeypatch):
+    monkeypatch.setattr(mq_history, 'MQ_HISTORY_CHANNELS', ['room', 'user.*'])
+
+    async def scenario():
+        mq1, r1 = make_session()
+        await mq1.run()
+        await mq1.subscribe('room')
+        for i in range(3):
+            await mq1.do_send('chat', 'room', content=f'm{i}')
+        await mq1.do_send('chat', 'lobby', content='not kept')
+        await settle()
+        assert r1.received == [('room', 'm0'), ('room', 'm1'), ('room', 'm2')] # handlers don't see _seq
+        assert mq1.history_seq == {'room': 3}
+
+        # a new session reads the last two messages (to paint them), without running its handlers
+        mq2, r2 = make_session()
+        await mq2.run()
+        await mq2.subscribe('room')
+        assert [(m['cmd'], m['content']) for m in await mq2.history('room', last=2)] == [('chat', 'm1'), ('chat', 'm2')]
+        assert r2.received == []
+        assert await mq2.history('lobby') == []
+
+        # catch up on what was missed since the last message received
+        await mq1.unsubscribe('room')
+        await mq2.do_send('chat', 'room', content='m3')
+        await settle()
+        assert await mq1.replay_history('room') == 1
+        assert r1.received[-1] == ('room', 'm3')
+        assert await mq1.replay_history('room') == 0
+        await mq2.unsubscribe_all()
+
+    asyncio.run(scenario())
+
+def test_new_socket_paints_history_once(monkeypatch):
+    import json
+    from agi_green.chat_server import ChatServer, ChatSession
+    monkeypatch.setattr(mq_history, 'MQ_HISTORY_CHANNELS', ['broadcast'])
+
+    class Socket:
+        id = 'tab1'
+
+        def __init__(self):
+            self.sent = []
+
+        async def send_str(self, s):
+            self.sent.append(json.loads(s))
+
+    async def scenario():
+        other, _ = make_session()
+        await other.run()
+        await other.do_send('chat', 'broadcast', author='a', content='m1')
+
+        session = ChatSession(ChatServer().http, session_id='s1')
+        session.context.subdomain = 'test'
+        session.context.user.email = 'a@example.com' # not a guest: no welcome message
+        await session.mq.run()
+
+        # a message arrives live while the history is being read: it must show once
+        read_history = session.mq.history
+        async def racing_history(channel, **kwargs):
+            await other.do_send('chat', 'broadcast', author='a', content='m2')
+            await settle()
+            return await read_history(channel, **kwargs)
+        monkeypatch.setattr(session.mq, 'history', racing_history)
+
+        socket = Socket()
+        session.ws.sockets.add(socket)
+        await session.on_ws_connect(socket)
+        await other.do_send('chat', 'broadcast', author='a', content='m3')
+        await settle()
+
+        assert [m['content'] for m in socket.sent if m['cmd'] == 'append_chat'] == ['m1', 'm2', 'm3']
+        assert session.painting == {}
+        await session.mq.unsubscribe_all()
+
+    asyncio.run(scenario())
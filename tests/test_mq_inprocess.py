@@ -0,0 +1,74 @@
+import asyncio
+from agi_green.dispatcher import Dispatcher, Protocol, protocol_handler
+from agi_green.protocol_mq import InProcessMQProtocol
+from agi_green.mq_hub import get_hub
+
+class Receiver(Protocol):
+    protocol_id = 'receiver'
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.received = []
+
+    @protocol_handler
+    async def on_mq_chat(self, channel_id, content, **kwargs):
+        self.received.append((channel_id, content))
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+def make_session():
+    session = Dispatcher()
+    session.context.subdomain = 'test'
+    mq = InProcessMQProtocol(session)
+    receiver = Receiver(session)
+    return session, mq, receiver
+
+def test_cross_session_broadcast():
+    async def scenario():
+        (_, mq1, r1), (_, mq2, r2) = make_session(), make_session()
+        await mq1.run()
+        await mq2.run()
+        await mq1.subscribe('broadcast')
+        await mq2.subscribe('broadcast')
+
+        await mq1.do_send('chat', 'broadcast', content='hello')
+        await settle()
+        assert r1.received == [('broadcast', 'hello')]
+        assert r2.received == [('broadcast', 'hello')]
+
+        await mq2.unsubscribe('broadcast')
+        await mq1.do_send('chat', 'broadcast', content='again')
+        await settle()
+        assert len(r1.received) == 2
+        assert len(r2.received) == 1
+        assert mq1.broker.subscriber_count('test:broadcast') == 1
+
+        await mq1.unsubscribe_all()
+        assert mq1.broker.subscriber_count('test:broadcast') == 0
+
+    asyncio.run(scenario())
+
+def test_shared_channel_single_upstream():
+    async def scenario():
+        sessions = [make_session() for _ in range(5)]
+        for _, mq, _ in sessions:
+            await mq.run()
+            await mq.subscribe('broadcast')
+
+        mq0 = sessions[0][1]
+        hub = get_hub(InProcessMQProtocol, **mq0.hub_kwargs())
+        assert mq0.broker.subscriber_count('test:broadcast') == 1
+        assert hub.member_count('test:broadcast') == 5
+
+        await mq0.do_send('chat', 'broadcast', content='hi')
+        await settle()
+        assert all(r.received == [('broadcast', 'hi')] for _, _, r in sessions)
+
+        for _, mq, _ in sessions:
+            await mq.unsubscribe_all()
+        assert hub.member_count('test:broadcast') == 0
+        assert mq0.broker.subscriber_count('test:broadcast') == 0
+
+    asyncio.run(scenario())
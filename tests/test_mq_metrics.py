@@ -0,0 +1,66 @@
+import asyncio
+from agi_green.mq_metrics import Histogram, channel_kind, mq_metrics
+from agi_green.dispatcher import Dispatcher, Protocol, protocol_handler
+from agi_green.protocol_mq import InProcessMQProtocol
+
+class Receiver(Protocol):
+    protocol_id = 'receiver'
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.received = []
+
+    @protocol_handler
+    async def on_mq_chat(self, channel_id, content):
+        self.received.append(content)
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+def test_histogram_and_channel_kinds():
+    h = Histogram(buckets=(0.01, 0.1, 1.0))
+    for v in (0.005, 0.05, 0.05, 5.0):
+        h.observe(v)
+    assert h.cumulative() == [1, 3, 3, 4]
+    assert h.quantile(0.5) == 0.1
+    assert h.quantile(1.0) == float('inf')
+
+    assert channel_kind('test:socket.ab12') == 'socket.*'
+    assert channel_kind('user.bob') == 'user.*'
+    assert channel_kind('test:broadcast') == 'broadcast'
+
+def test_protocol_metrics():
+    async def scenario():
+        session = Dispatcher()
+        session.context.subdomain = 'test'
+        mq = InProcessMQProtocol(session)
+        receiver = Receiver(session)
+        before = dict(mq_metrics.channels['room'])
+        published = mq_metrics.publish_latency.count
+
+        await mq.do_send('chat', 'room', content='queued') # not connected yet: outbox
+        assert mq_metrics.gauges()['outbox_messages'] >= 1
+
+        await mq.run()
+        await mq.subscribe('room')
+        await mq.do_send('chat', 'room', content='hi')
+        await settle()
+        assert receiver.received == ['hi'] # handlers don't see the send time
+
+        counts = mq_metrics.channels['room']
+        assert counts['published'] - before.get('published', 0) == 2
+        assert counts['delivered'] - before.get('delivered', 0) == 1
+        assert mq_metrics.publish_latency.count - published == 2
+        assert mq_metrics.delivery_latency.count >= 1
+        assert mq_metrics.gauges()['listener_tasks'] >= 1
+
+        text = mq_metrics.prometheus()
+        assert 'agi_mq_messages_total{channel="room",event="delivered"}' in text
+        assert 'agi_mq_delivery_latency_seconds_bucket{le="+Inf"}' in text
+        assert 'agi_mq_control_total{op="subscribe"}' in text
+        assert mq_metrics.stats()['channels']['room']['published'] >= 2
+
+        await mq.unsubscribe_all()
+
+    asyncio.run(scenario())
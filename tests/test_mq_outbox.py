@@ -0,0 +1,81 @@
+import asyncio
+import os
+from agi_green.mq_outbox import Outbox, OutboxBudget
+from agi_green.dispatcher import Dispatcher
+from agi_green.protocol_mq import InProcessMQProtocol
+
+async def collect(outbox, batch):
+    return [b async for b in outbox.replay(batch=batch)]
+
+def test_overflow_spills_to_disk_and_replays_in_order(tmp_path):
+    async def scenario():
+        outbox = Outbox(OutboxBudget(max_messages=3, max_bytes=10_000), spill_dir=str(tmp_path))
+        for i in range(8):
+            await outbox.put('chat', 'room', {'i': i})
+
+        assert outbox.stats()['queued'] == 3
+        assert outbox.stats()['spilled'] == 5
+        spill_path = outbox.spill_path
+        assert os.path.exists(spill_path)
+
+        batches = await collect(outbox, batch=4)
+        assert [len(b) for b in batches] == [3, 4, 1]
+        assert [kwargs['i'] for b in batches for _, _, kwargs in b] == list(range(8))
+        assert len(outbox) == 0
+        assert not os.path.exists(spill_path)
+
+    asyncio.run(scenario())
+
+def test_spill_cap_drops(tmp_path):
+    async def scenario():
+        outbox = Outbox(OutboxBudget(max_messages=1, max_bytes=10_000, max_spill_bytes=100), spill_dir=str(tmp_path))
+        for i in range(20):
+            await outbox.put('chat', 'room', {'content': 'x' * 20})
+        assert outbox.dropped > 0
+        assert outbox.spill_bytes <= 100
+
+    asyncio.run(scenario())
+
+def test_outboxes_share_one_budget(tmp_path):
+    async def scenario():
+        budget = OutboxBudget(max_messages=2, max_bytes=10_000, max_spill_bytes=10_000)
+        a, b = Outbox(budget, spill_dir=str(tmp_path)), Outbox(budget, spill_dir=str(tmp_path))
+        await a.put('chat', 'room', {'i': 0})
+        await b.put('chat', 'room', {'i': 1})
+        await b.put('chat', 'room', {'i': 2})
+        assert (len(a.messages), len(b.messages), b.spilled) == (1, 1, 1) # the third message is over the shared cap
+
+        a.clear()
+        assert budget.messages == 1
+        await collect(b, batch=10)
+        assert (budget.messages, budget.memory_bytes, budget.spill_bytes) == (0, 0, 0)
+
+    asyncio.run(scenario())
+
+def test_subscriptions_are_deduplicated():
+    outbox = Outbox()
+    for channel in ['broadcast', 'room', 'broadcast', 'other']:
+        outbox.add_subscription(channel)
+    assert outbox.remove_subscription('other')
+    assert not outbox.remove_subscription('never')
+    assert outbox.pop_subscriptions() == ['broadcast', 'room']
+
+def test_protocol_replays_outbox_on_run():
+    async def scenario():
+        session = Dispatcher()
+        session.context.subdomain = 'test'
+        mq = InProcessMQProtocol(session)
+
+        # before run(): queued, not sent
+        await mq.subscribe('room')
+        await mq.subscribe('room')
+        await mq.do_send('chat', 'room', content='early')
+        assert mq.outbox.stats()['queued'] == 1
+
+        await mq.run()
+        assert len(mq.outbox) == 0
+        assert list(mq.queues) == ['test:room']
+        assert mq.broker.subscriber_count('test:room') == 1
+        await mq.unsubscribe_all()
+
+    asyncio.run(scenario())
@@ -0,0 +1,227 @@
+import asyncio
+import pytest
+
+pytest.importorskip('aio_pika')
+
+from agi_green.protocol_mq import RabbitMQPool
+
+class FakeExchange:
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, message, routing_key, **kwargs):
+        await asyncio.sleep(0)
+        self.published.append((routing_key, message.body))
+
+def test_publishes_in_one_tick_are_batched():
+    async def scenario():
+        pool = RabbitMQPool('localhost', batch=100)
+        pool.exchanges = [FakeExchange(), FakeExchange()]
+
+        futures = [pool.publish(f'test:ch{3 + i % 3}', f'{i}'.encode()) for i in range(250)]
+        await asyncio.gather(*futures)
+
+        assert pool.batches == 3
+        assert pool.published == 250
+        # each routing key stays on one publish channel, in publish order
+        assert pool.exchanges[0].published and pool.exchanges[1].published
+        for key in ('test:ch3', 'test:ch4', 'test:ch5'):
+            exchange = pool.publish_exchange(key)
+            other = pool.exchanges[1 - pool.exchanges.index(exchange)]
+            bodies = [int(body) for k, body in exchange.published if k == key]
+            assert bodies == sorted(bodies) and len(bodies) == len(range(int(key[-1]) - 3, 250, 3))
+            assert not [k for k, _ in other.published if k == key]
+
+        stats = pool.stats()
+        assert stats['pending'] == 0
+        assert stats['latency_p99_ms'] >= stats['latency_p50_ms'] >= 0
+
+    asyncio.run(scenario())
+
+def test_publish_failure_is_reported_to_caller():
+    class BrokenExchange:
+        async def publish(self, message, routing_key, **kwargs):
+            raise ConnectionError('gone')
+
+    async def scenario():
+        pool = RabbitMQPool('localhost')
+        pool.exchanges = [BrokenExchange()]
+        with pytest.raises(ConnectionError):
+            await pool.publish('test:ch', b'x')
+        assert pool.failed == 1
+
+    asyncio.run(scenario())
+
+
+class FakeMessage:
+    def __init__(self, routing_key, body):
+        self.routing_key = routing_key
+        self.body = body
+        self.acked = asyncio.Event()
+
+    async def ack(self):
+        self.acked.set()
+
+    async def reject(self):
+        self.acked.set()
+
+    def process(self, **kwargs):
+        message = self
+
+        class Processing:
+            async def __aenter__(self):
+                return message
+
+            async def __aexit__(self, *exc):
+                message.acked.set()
+
+        return Processing()
+
+class FakeQueue:
+    'an exclusive session queue: bindings, and messages routed to it'
+    def __init__(self):
+        self.name = 'amq.gen-test'
+        self.bindings = set()
+        self.messages = asyncio.Queue()
+        self.deleted = False
+
+    async def bind(self, exchange, routing_key):
+        self.bindings.add(routing_key)
+
+    async def unbind(self, exchange, routing_key):
+        self.bindings.discard(routing_key)
+
+    async def delete(self, **kwargs):
+        self.deleted = True
+
+    def iterator(self):
+        queue = self
+
+        class Iterator:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                pass
+
+            def __aiter__(self):
+                return self
+
+            async def __anext__(self):
+                return await queue.messages.get()
+
+        return Iterator()
+
+class FakeChannel:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def declare_exchange(self, name, kind):
+        return name
+
+    async def declare_queue(self, **kwargs):
+        queue = FakeQueue()
+        self.pool.queues.append(queue)
+        return queue
+
+class FakePool:
+    'direct exchange: a publish goes to every queue bound to its routing key'
+    def __init__(self):
+        self.online = True
+        self.reconnect_listeners = set()
+        self.queues = []
+
+    def consumer_channel(self):
+        return FakeChannel(self)
+
+    def publish(self, routing_key, body):
+        for queue in self.queues:
+            if routing_key in queue.bindings:
+                queue.messages.put_nowait(FakeMessage(routing_key, body))
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(None)
+        return future
+
+def test_session_bindings_and_demux(monkeypatch):
+    from agi_green import dispatcher, protocol_mq
+    from agi_green.dispatcher import Dispatcher, Protocol, protocol_handler
+    from agi_green.protocol_mq import RabbitMQProtocol
+
+    class Receiver(Protocol):
+        protocol_id = 'receiver'
+
+        def __init__(self, parent):
+            super().__init__(parent)
+            self.received = asyncio.Queue()
+
+        @protocol_handler
+        async def on_mq_chat(self, channel_id, content, **kwargs):
+            self.received.put_nowait((channel_id, content))
+
+    pool = FakePool()
+
+    async def get_pool(host, port=5672):
+        return pool
+
+    monkeypatch.setattr(protocol_mq, 'get_rabbitmq_pool', get_pool)
+    monkeypatch.setattr(dispatcher, '_protocol_garbage_tracker', {})
+
+    async def scenario():
+        session = Dispatcher()
+        session.context.subdomain = 'test'
+        mq = RabbitMQProtocol(session, host='localhost')
+        receiver = Receiver(session)
+        await mq.run()
+        queue = pool.queues[0]
+
+        await mq.subscribe('room')
+        await mq.subscribe('user.bob')
+        await mq.subscribe('room') # no second binding
+        assert queue.bindings == {'test:room', 'test:user.bob'}
+
+        # one queue, demultiplexed by routing key
+        await mq.do_send('chat', 'user.bob', content='to bob')
+        await mq.do_send('chat', 'room', content='to room')
+        received = [await asyncio.wait_for(receiver.received.get(), 1.0) for _ in range(2)]
+        assert sorted(received) == [('room', 'to room'), ('user.bob', 'to bob')]
+
+        await mq.unsubscribe('room')
+        assert queue.bindings == {'test:user.bob'}
+
+        # a message routed before the unbind took effect is acked and dropped
+        late = FakeMessage('test:room', b'{"cmd": "chat", "content": "late"}')
+        queue.messages.put_nowait(late)
+        await asyncio.wait_for(late.acked.wait(), 1.0)
+        assert receiver.received.empty()
+
+        await mq.close()
+        assert queue.bindings == set() and queue.deleted
+
+    asyncio.run(scenario())
+
+def test_reconnect_replays_are_tracked():
+    class Listener:
+        def __init__(self, fail=False):
+            self.fail = fail
+            self.replayed = asyncio.Event()
+
+        async def replay_outbox(self):
+            await asyncio.sleep(0)
+            self.replayed.set()
+            if self.fail:
+                raise ConnectionError('gone again')
+
+    async def scenario():
+        pool = RabbitMQPool('localhost')
+        listeners = [Listener(), Listener(fail=True)]
+        for listener in listeners:
+            pool.reconnect_listeners.add(listener)
+
+        pool._on_reconnect(None)
+        assert pool.online and len(pool._replay_tasks) == 2
+        for listener in listeners:
+            await asyncio.wait_for(listener.replayed.wait(), 1.0)
+        await asyncio.sleep(0)
+        assert not pool._replay_tasks # done tasks are dropped, failures logged
+
+    asyncio.run(scenario())
@@ -0,0 +1,163 @@
+import asyncio
+import fnmatch
+import pytest
+from agi_green import protocol_mq
+from agi_green.dispatcher import Dispatcher, Protocol, protocol_handler
+from agi_green.protocol_mq import RedisMQProtocol
+
+class FakeServer:
+    'in-memory stand-in for a redis server: pub/sub only'
+    def __init__(self):
+        self.pubsubs = []
+        self.publish_calls = 0
+        self.pipelines = 0
+
+    def publish(self, channel, data):
+        self.publish_calls += 1
+        for ps in self.pubsubs:
+            ps.deliver(channel, data)
+
+class FakePubSub:
+    def __init__(self, server):
+        self.server = server
+        self.channels = set()
+        self.patterns = set()
+        self.messages = asyncio.Queue()
+        server.pubsubs.append(self)
+
+    async def subscribe(self, *channels):
+        self.channels.update(channels)
+
+    async def psubscribe(self, *patterns):
+        self.patterns.update(patterns)
+
+    async def unsubscribe(self, *channels):
+        self.channels.difference_update(channels)
+
+    async def punsubscribe(self, *patterns):
+        self.patterns.difference_update(patterns)
+
+    def deliver(self, channel, data):
+        if channel in self.channels:
+            self.messages.put_nowait({'type': 'message', 'pattern': None, 'channel': channel.encode(), 'data': data.encode()})
+        for pattern in self.patterns:
+            if fnmatch.fnmatchcase(channel, pattern):
+                self.messages.put_nowait({'type': 'pmessage', 'pattern': pattern.encode(), 'channel': channel.encode(), 'data': data.encode()})
+
+    async def get_message(self, ignore_subscribe_messages=False, timeout=0.0):
+        return await self.messages.get()
+
+    async def aclose(self):
+        pass
+
+class FakePipeline:
+    def __init__(self, server):
+        self.server = server
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def publish(self, channel, data):
+        self.commands.append((channel, data))
+
+    async def execute(self):
+        self.server.pipelines += 1
+        for channel, data in self.commands:
+            self.server.publish(channel, data)
+
+class FakeRedis:
+    def __init__(self, server):
+        self.server = server
+
+    def pubsub(self):
+        return FakePubSub(self.server)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self.server)
+
+    async def aclose(self):
+        pass
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeServer()
+    class FakeModule:
+        @staticmethod
+        def from_url(url, **kwargs):
+            return FakeRedis(server)
+    monkeypatch.setattr(protocol_mq, 'aioredis', FakeModule, raising=False)
+    return server
+
+class Receiver(Protocol):
+    protocol_id = 'receiver'
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.received = []
+
+    @protocol_handler
+    async def on_mq_chat(self, channel_id, content, **kwargs):
+        self.received.append((channel_id, content))
+
+def make_session():
+    session = Dispatcher()
+    session.context.subdomain = 'test'
+    return RedisMQProtocol(session), Receiver(session)
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+def test_redis_channels_and_patterns(server):
+    async def scenario():
+        (mq1, r1), (mq2, r2) = make_session(), make_session()
+        await mq1.run()
+        await mq2.run()
+        await mq1.subscribe('room.1')
+        await mq2.subscribe('room.1')
+        await mq2.psubscribe('user.*')
+
+        # one process-wide pub/sub connection, each channel subscribed once
+        assert len(server.pubsubs) == 1
+        assert server.pubsubs[0].channels == {'test:room.1'}
+        assert server.pubsubs[0].patterns == {'test:user.*'}
+
+        await asyncio.gather(
+            mq1.do_send('chat', 'room.1', content='hello'),
+            mq1.do_send('chat', 'user.bob', content='hi bob'),
+        )
+        await settle()
+        assert server.pipelines == 1 # both publishes in one round trip
+        assert r1.received == [('room.1', 'hello')]
+        assert r2.received == [('room.1', 'hello'), ('user.bob', 'hi bob')]
+
+        await mq1.unsubscribe('room.1')
+        assert server.pubsubs[0].channels == {'test:room.1'}
+        await mq2.unsubscribe_all()
+        assert server.pubsubs[0].channels == set()
+        assert server.pubsubs[0].patterns == set()
+
+    asyncio.run(scenario())
+
+def test_glob_characters_in_channel_ids_are_literal(server):
+    async def scenario():
+        (mq1, _), (mq2, r2) = make_session(), make_session()
+        await mq1.run()
+        await mq2.run()
+        await mq2.subscribe('user.*') # e.g. a user registered with screen name '*'
+
+        assert server.pubsubs[0].channels == {'test:user.*'}
+        assert server.pubsubs[0].patterns == set()
+
+        await mq1.do_send('chat', 'user.bob', content='private')
+        await mq1.do_send('chat', 'user.*', content='to *')
+        await settle()
+        assert r2.received == [('user.*', 'to *')]
+
+        await mq2.unsubscribe_all()
+
+    asyncio.run(scenario())
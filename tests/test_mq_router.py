@@ -0,0 +1,83 @@
+import asyncio
+from agi_green.mq_router import RouterClient, encode_frame, read_frame, OP_PUB
+
+class Listener:
+    def __init__(self):
+        self.inbox = asyncio.Queue()
+
+async def receive(listener, timeout=1.0):
+    return await asyncio.wait_for(listener.inbox.get(), timeout)
+
+def test_frame_roundtrip():
+    async def scenario():
+        reader = asyncio.StreamReader()
+        reader.feed_data(encode_frame(OP_PUB, 'test:broadcast', b'{"x": 1}') + encode_frame(OP_PUB, 't', b''))
+        assert (await read_frame(reader))[:3] == (OP_PUB, 'test:broadcast', b'{"x": 1}')
+        assert (await read_frame(reader))[:3] == (OP_PUB, 't', b'')
+
+    asyncio.run(scenario())
+
+def test_router_fanout_and_failover(tmp_path):
+    path = str(tmp_path / 'mq.sock')
+
+    async def scenario():
+        a, b = RouterClient(path), RouterClient(path)
+        await a.connect()
+        await b.connect()
+        assert a.router is not None and b.router is None # first client embeds the router
+
+        la, lb = Listener(), Listener()
+        a.subscribe('test:room', la)
+        b.subscribe('test:room', lb)
+        await asyncio.sleep(0.05)
+
+        for i in range(3):
+            b.publish('test:room', f'{i}'.encode())
+        assert [await receive(la) for _ in range(3)] == [('test:room', b'0'), ('test:room', b'1'), ('test:room', b'2')]
+        assert (await receive(lb))[1] == b'0'
+        assert b.out.writes == 2 # SUB in one write, the three PUB frames in another
+
+        # the router's process goes away: b takes over and keeps its subscription
+        await a.close()
+        for _ in range(50):
+            if b.out is not None and b.router is not None:
+                break
+            await asyncio.sleep(0.02)
+        assert b.router is not None
+
+        c = RouterClient(path)
+        await c.connect()
+        while not lb.inbox.empty():
+            lb.inbox.get_nowait()
+        c.publish('test:room', b'after')
+        assert await receive(lb) == ('test:room', b'after')
+
+        await c.close()
+        await b.close()
+
+    asyncio.run(scenario())
+
+def test_socket_is_private_and_reconnect_gives_up_loudly(tmp_path, caplog):
+    import os
+    path = str(tmp_path / 'mq.sock')
+
+    async def scenario():
+        a = RouterClient(path)
+        await a.connect()
+        assert (os.stat(path).st_mode & 0o777) == 0o600
+
+        b = RouterClient(path)
+        attempts = []
+
+        async def router_gone(**kwargs):
+            attempts.append(1)
+            raise ConnectionError('no router')
+
+        b.connect = router_gone
+        await b._reconnect(attempts=3, delay=0)
+        assert len(attempts) == 3
+        assert 'giving up' in caplog.text
+
+        await a.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,69 @@
+import asyncio
+import pytest
+from agi_green.dispatcher import Dispatcher, Protocol, protocol_handler
+from agi_green.protocol_mq import InProcessMQProtocol
+from agi_green.mq_rpc import get_reply_router
+
+class Responder(Protocol):
+    protocol_id = 'responder'
+
+    @protocol_handler
+    async def on_mq_is_online(self, channel_id, user):
+        return user == 'bob'
+
+    @protocol_handler
+    async def on_responder_double(self, value):
+        return 2 * value
+
+def make_session(responder=False):
+    session = Dispatcher()
+    session.context.subdomain = 'test'
+    mq = InProcessMQProtocol(session)
+    if responder:
+        Responder(session)
+    return session, mq
+
+def test_request_reply():
+    async def scenario():
+        asker, mq1 = make_session()
+        _, mq2 = make_session(responder=True)
+        _, mq3 = make_session() # subscribed without a handler: doesn't answer
+        for mq in (mq1, mq2, mq3):
+            await mq.run()
+        await mq2.subscribe('user.bob')
+        await mq3.subscribe('user.bob')
+        await mq2.subscribe('broadcast') # shared channel, answered through the fan-out hub
+
+        assert await asker.request('mq', 'is_online', channel='user.bob', user='bob', timeout=1.0) is True
+        assert await asker.request('mq', 'is_online', channel='broadcast', user='alice', timeout=1.0) is False
+
+        router = get_reply_router(InProcessMQProtocol, **mq1.hub_kwargs())
+        assert router.stats['replies'] == 2
+        assert router.pending == {}
+
+        with pytest.raises(asyncio.TimeoutError):
+            await asker.request('mq', 'is_online', channel='nobody', user='bob', timeout=0.05)
+        assert router.stats['timeouts'] == 1 and router.pending == {}
+
+        # cancelling the caller forgets the request
+        task = asyncio.create_task(asker.request('mq', 'is_online', channel='nobody', user='bob', timeout=5))
+        await asyncio.sleep(0.01)
+        assert len(router.pending) == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert router.pending == {} and router.stats['cancelled'] == 1
+
+        for mq in (mq2, mq3):
+            await mq.unsubscribe_all()
+        await router.upstream.unsubscribe_all()
+
+    asyncio.run(scenario())
+
+def test_local_request():
+    async def scenario():
+        session = Dispatcher()
+        Responder(session)
+        assert await session.request('responder', 'double', value=21) == 42
+
+    asyncio.run(scenario())
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import pytest
+from agi_green import protocol_mq
+
+@pytest.fixture
+def fresh_selection(monkeypatch, tmp_path):
+    monkeypatch.setattr(protocol_mq, '_selected_protocol', None)
+    monkeypatch.setattr(protocol_mq, 'MQ_DETECT_CACHE', str(tmp_path / 'mq_backend.json'))
+    monkeypatch.delenv('MQ_PROTOCOL', raising=False)
+    return tmp_path / 'mq_backend.json'
+
+def test_import_does_not_select():
+    # the backend is chosen lazily, not at import
+    assert 'MQProtocol' not in vars(protocol_mq)
+
+def test_forced_inprocess(fresh_selection, monkeypatch):
+    monkeypatch.setenv('MQ_PROTOCOL', 'inprocess')
+    assert asyncio.run(protocol_mq.select_mq_protocol()) is protocol_mq.InProcessMQProtocol
+    assert protocol_mq.MQProtocol is protocol_mq.InProcessMQProtocol
+    assert not fresh_selection.exists()
+
+def test_probes_run_in_parallel_and_result_is_cached(fresh_selection, monkeypatch):
+    calls = []
+
+    async def slow_probe(**kwargs):
+        calls.append(1)
+        await asyncio.sleep(0.2)
+        return False
+
+    async def rabbit_up(**kwargs):
+        calls.append(2)
+        await asyncio.sleep(0.2)
+        return True
+
+    monkeypatch.setattr(protocol_mq, '_test_azure_connection', slow_probe)
+    monkeypatch.setattr(protocol_mq, '_test_rabbitmq_connection', rabbit_up)
+
+    async def timed():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        selected = await protocol_mq.select_mq_protocol()
+        return selected, loop.time() - start
+
+    selected, elapsed = asyncio.run(timed())
+    assert selected is protocol_mq.RabbitMQProtocol
+    assert elapsed < 0.35
+    assert json.loads(fresh_selection.read_text())['protocol'] == 'rabbitmq'
+
+    # next start: the cached choice is used without probing
+    monkeypatch.setattr(protocol_mq, '_selected_protocol', None)
+    calls.clear()
+    assert asyncio.run(protocol_mq.select_mq_protocol()) is protocol_mq.RabbitMQProtocol
+    assert calls == []
+
+def test_probe_timeout(fresh_selection, monkeypatch):
+    async def hangs(**kwargs):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(protocol_mq, 'MQ_PROBE_TIMEOUT', 0.05)
+    monkeypatch.setattr(protocol_mq, '_test_azure_connection', hangs)
+    monkeypatch.setattr(protocol_mq, '_test_rabbitmq_connection', hangs)
+    assert asyncio.run(protocol_mq.select_mq_protocol()) is protocol_mq.InProcessMQProtocol
+
+def test_forced_backend_is_retried(fresh_selection, monkeypatch):
+    attempts = []
+
+    async def rabbit_starting(raise_errors=False, **kwargs):
+        attempts.append(1)
+        ok = protocol_mq._connection_test_results.setdefault('rabbitmq:test', len(attempts) == 3)
+        if not ok and raise_errors:
+            raise ConnectionError('not yet')
+        return ok
+
+    monkeypatch.setenv('MQ_PROTOCOL', 'rabbitmq')
+    monkeypatch.setattr(protocol_mq, 'MQ_CONNECT_RETRY_DELAY', 0)
+    monkeypatch.setattr(protocol_mq, '_connection_test_results', {})
+    monkeypatch.setattr(protocol_mq, '_test_rabbitmq_connection', rabbit_starting)
+    assert asyncio.run(protocol_mq.select_mq_protocol()) is protocol_mq.RabbitMQProtocol
+    assert len(attempts) == 3 # the cached failures didn't stop the retries
+
+    # gives up after MQ_CONNECT_ATTEMPTS
+    async def rabbit_down(raise_errors=False, **kwargs):
+        attempts.append(1)
+        raise ConnectionError('down')
+
+    monkeypatch.setattr(protocol_mq, '_selected_protocol', None)
+    monkeypatch.setattr(protocol_mq, '_test_rabbitmq_connection', rabbit_down)
+    attempts.clear()
+    with pytest.raises(ConnectionError):
+        asyncio.run(protocol_mq.select_mq_protocol())
+    assert len(attempts) == 3
+
+def test_refresh_forgets_failed_probes(fresh_selection, monkeypatch):
+    monkeypatch.setattr(protocol_mq, '_connection_test_results', {'rabbitmq:localhost:5672': False, 'azure:x': True})
+    monkeypatch.setattr(protocol_mq, '_detect_protocol_name', lambda: asyncio.sleep(0, 'inprocess'))
+    asyncio.run(protocol_mq.select_mq_protocol(refresh=True))
+    assert protocol_mq._connection_test_results == {'azure:x': True}
+
+def test_default_detect_cache_is_private_and_per_app(monkeypatch, tmp_path):
+    import os
+    cache_dir = str(tmp_path / 'agi_green-user')
+    assert protocol_mq.MQ_DETECT_CACHE.endswith(f'mq-backend-{protocol_mq.MQ_APP_NAME}.json')
+    monkeypatch.setattr(protocol_mq, 'MQ_DETECT_CACHE_DIR', cache_dir)
+    monkeypatch.setattr(protocol_mq, 'MQ_DETECT_CACHE', os.path.join(cache_dir, 'mq-backend-app.json'))
+
+    protocol_mq._write_detect_cache('inprocess')
+    assert os.stat(cache_dir).st_mode & 0o777 == 0o700
+    assert protocol_mq._read_detect_cache() == 'inprocess'
@@ -0,0 +1,68 @@
+import os
+import signal
+import socket
+import asyncio
+import multiprocessing
+from agi_green.prefork import handoff_channel, peek_session_id, receive_handoffs, session_worker
+
+def test_peek_session_id_does_not_consume():
+    request = b'GET /ws HTTP/1.1\r\nHost: x\r\nCookie: theme=dark; SESSION_ID=abc-123\r\n\r\n'
+
+    async def scenario():
+        a, b = socket.socketpair()
+        a.setblocking(False)
+        b.sendall(request)
+        try:
+            assert await peek_session_id(a) == 'abc-123'
+            assert a.recv(4096) == request
+        finally:
+            a.close()
+            b.close()
+
+    asyncio.run(scenario())
+
+def test_peek_without_cookie():
+    async def scenario():
+        a, b = socket.socketpair()
+        a.setblocking(False)
+        b.sendall(b'GET / HTTP/1.1\r\nHost: x\r\n\r\n')
+        try:
+            assert await peek_session_id(a) is None
+        finally:
+            a.close()
+            b.close()
+
+    asyncio.run(scenario())
+
+def test_session_worker_is_stable():
+    assert all(0 <= session_worker(f'id{i}', 4) < 4 for i in range(100))
+    assert session_worker('abc', 4) == session_worker('abc', 4)
+
+def _hand_off_and_die(parent:socket.socket, conn:socket.socket):
+    socket.send_fds(parent, [b'c'], [conn.fileno()])
+    os.kill(os.getpid(), signal.SIGKILL)
+
+def test_worker_stops_when_parent_is_killed():
+    parent, child = handoff_channel()
+    a, b = socket.socketpair()
+    process = multiprocessing.get_context('fork').Process(target=_hand_off_and_die, args=(parent, a))
+    process.start()
+    parent.close() # only the (killed) parent process holds it now
+    a.close()
+
+    async def scenario():
+        received = []
+        await asyncio.wait_for(receive_handoffs(child, received.append), 5.0)
+        assert len(received) == 1
+        received[0].setblocking(True)
+        received[0].sendall(b'hello')
+        assert b.recv(5) == b'hello'
+        received[0].close()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        process.join(5)
+        child.close()
+        b.close()
+    assert process.exitcode == -signal.SIGKILL
@@ -0,0 +1,90 @@
+import os
+import time
+import asyncio
+from types import SimpleNamespace
+from agi_green.chat_server import ChatServer
+from agi_green.session_store import SessionStore
+
+SESSION_ID = '0123abcd-0000-0000-0000-000000000000'
+
+def make_request(session_id):
+    return SimpleNamespace(cookies={'SESSION_ID': session_id}, host='localhost:8000')
+
+def test_hibernate_and_rehydrate(tmp_path):
+    async def scenario():
+        server = ChatServer()
+        http = server.http
+        http.session_store = SessionStore(str(tmp_path))
+
+        session, new_id = await http.get_or_create_session(make_request(SESSION_ID))
+        assert new_id is None
+        session.context.user.screen_name = 'alice'
+        await asyncio.sleep(0.01)
+
+        http.idle_timeout = 0.001
+        await asyncio.sleep(0.01)
+        assert await http.evict_idle_sessions() == 1
+        assert SESSION_ID not in http.sessions
+        assert http.session_store.contains(SESSION_ID)
+
+        session, _ = await http.get_or_create_session(make_request(SESSION_ID))
+        assert session.context.user.screen_name == 'alice'
+        assert not http.session_store.contains(SESSION_ID)
+
+    asyncio.run(scenario())
+
+def test_lru_cap(tmp_path):
+    async def scenario():
+        server = ChatServer()
+        http = server.http
+        http.session_store = SessionStore(str(tmp_path))
+        http.idle_timeout = 0
+        http.max_sessions = 2
+
+        ids = [f'0123abcd-0000-0000-0000-00000000000{i}' for i in range(4)]
+        for sid in ids:
+            await http.get_or_create_session(make_request(sid))
+        await http.get_or_create_session(make_request(ids[0])) # touch
+        await asyncio.sleep(0.01)
+
+        assert await http.evict_idle_sessions() == 2
+        assert list(http.sessions) == [ids[3], ids[0]]
+
+    asyncio.run(scenario())
+
+def test_unsafe_session_ids_are_dropped_not_saved(tmp_path):
+    async def scenario():
+        server = ChatServer()
+        http = server.http
+        http.session_store = SessionStore(str(tmp_path))
+        http.idle_timeout = 0
+        http.max_sessions = 1
+
+        ids = ['../evil', SESSION_ID, '0123abcd-0000-0000-0000-000000000001']
+        for sid in ids:
+            await http.get_or_create_session(make_request(sid))
+        await asyncio.sleep(0.01)
+
+        assert await http.evict_idle_sessions() == 2 # the batch isn't aborted by the unsafe id
+        assert list(http.sessions) == [ids[2]]
+        assert http.session_store.contains(SESSION_ID)
+        assert os.listdir(tmp_path) == [f'{SESSION_ID}.json']
+
+    asyncio.run(scenario())
+
+def test_store_is_private_and_expires(tmp_path):
+    async def scenario():
+        store = SessionStore(str(tmp_path / 'sessions'), ttl=60)
+        assert (os.stat(store.path).st_mode & 0o777) == 0o700
+
+        await store.save('old', '{}')
+        await store.save('new', '{"a": 1}')
+        old = os.path.join(store.path, 'old.json')
+        os.utime(old, (time.time() - 120, time.time() - 120))
+
+        await store.sweep()
+        assert not store.contains('old')
+        assert await store.pop('new') == {'a': 1}
+        assert not store.contains('new')
+
+    asyncio.run(scenario())
@@ -0,0 +1,66 @@
+import os
+import asyncio
+import hashlib
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer, TestClient
+from agi_green import uploads
+from agi_green.uploads import read_post, release_uploads, UploadedFile
+
+def test_multipart_is_streamed_to_disk(monkeypatch):
+    monkeypatch.setattr(uploads, 'UPLOAD_CHUNK_SIZE', 1024)
+    monkeypatch.setattr(uploads, 'UPLOAD_FIELD_MAX_BYTES', 16)
+    payload = os.urandom(10_000)
+    seen = {}
+
+    async def handler(request):
+        fields, files = await read_post(request)
+        seen.update(fields)
+        seen['paths'] = [f.path for f in files]
+        seen['content'] = fields['file'].file.read()
+        release_uploads(files)
+        return web.Response(text='ok')
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_post('/upload', handler)
+        async with TestClient(TestServer(app)) as client:
+            form = aiohttp.FormData()
+            form.add_field('socket_id', 'abc')
+            form.add_field('notes', 'x' * 16)
+            form.add_field('file', payload, filename='data.bin', content_type='application/octet-stream')
+            r = await client.post('/upload', data=form)
+            assert r.status == 200
+
+    asyncio.run(scenario())
+
+    assert seen['socket_id'] == 'abc'
+    assert seen['notes'] == 'x' * 16 # text fields stay str up to the limit
+    f = seen['file']
+    assert (f.filename, f.size) == ('data.bin', len(payload))
+    assert f.sha256 == hashlib.sha256(payload).hexdigest()
+    assert seen['content'] == payload
+    assert not any(os.path.exists(p) for p in seen['paths'])
+
+def test_oversized_field_is_rejected(monkeypatch):
+    monkeypatch.setattr(uploads, 'UPLOAD_CHUNK_SIZE', 1024)
+    monkeypatch.setattr(uploads, 'UPLOAD_FIELD_MAX_BYTES', 16)
+    created = []
+    monkeypatch.setattr(uploads, 'spool_part', lambda *args: created.append(args))
+
+    async def handler(request):
+        await read_post(request)
+        return web.Response(text='ok')
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_post('/upload', handler)
+        async with TestClient(TestServer(app)) as client:
+            form = aiohttp.FormData()
+            form.add_field('notes', 'x' * 100)
+            form.add_field('file', b'data', filename='data.bin')
+            r = await client.post('/upload', data=form)
+            assert r.status == 413
+
+    asyncio.run(scenario())
+    assert created == [] # rejected before reaching the file part